@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the full CLI pipeline.
+
+Runs main_cli end to end with deterministic stand-ins for the chat and
+embedding models (src/fake_models.py), so no API key or network is needed
+and every run does the same work. Simulated API latency keeps the
+concurrency settings meaningful.
+
+Each configuration runs in its own process with an empty cache directory,
+so every run is cold and peak RSS is measured per configuration. Scaling
+curves vary one setting at a time from the base configuration. Outputs of
+runs over the same documents must be identical; they are also compared
+with the reference spreadsheets in Results/.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+MISSING = {"value not found", "values not found", "not found", ""}
+
+# Values within this relative difference count as matching the reference.
+REFERENCE_TOLERANCE = 0.005
+
+# Cold start budget in seconds for each IMPORT_CHECKS command (best of
+# IMPORT_REPEATS runs), and modules none of them may import.
+IMPORT_BUDGET = 1.0
+IMPORT_REPEATS = 3
+IMPORT_CHECKS = {
+    "run.py --help": ["run.py", "--help"],
+    # what the CLI and every spawned PDF worker import
+    "import pipeline": ["-c", "import src.processing, src.scheduler, src.journal"],
+}
+FORBIDDEN_IMPORTS = ("streamlit",)
+
+
+###############################################################################
+# 1. REFERENCE RESULTS
+###############################################################################
+def normalize_name(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def cell_value(value):
+    """A results cell as a float, or None for "Value not found" and blanks."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, str):
+        if value.strip().lower() in MISSING:
+            return None
+        try:
+            return float(value.replace(",", ""))
+        except ValueError:
+            return None
+    return float(value)
+
+
+def load_reference_results(results_dir):
+    """{workbook name: {(component, action): value or None}} from Results/*.xlsx."""
+    import pandas as pd
+    references = {}
+    for name in sorted(os.listdir(results_dir)):
+        if not name.endswith(".xlsx") or name.startswith("~$"):
+            continue
+        df = pd.read_excel(os.path.join(results_dir, name), sheet_name="Results")
+        values = {}
+        for _, row in df.iterrows():
+            for action in ("No Action", "With Action"):
+                values[(str(row["Component"]).strip(), action)] = cell_value(row[action])
+        references[os.path.splitext(name)[0]] = values
+    return references
+
+
+def match_reference(project, references):
+    """The reference workbook for a project folder, matched by name prefix."""
+    key = normalize_name(project)
+    for name, values in references.items():
+        other = normalize_name(name)
+        if other.startswith(key) or key.startswith(other):
+            return name, values
+    return None, None
+
+
+def values_agree(value, reference):
+    if value is None or reference is None:
+        return value is None and reference is None
+    return abs(value - reference) <= REFERENCE_TOLERANCE * max(abs(reference), 1)
+
+
+###############################################################################
+# 2. DOCUMENT SIZES
+###############################################################################
+def truncated_documents(docs_dir, fraction, out_dir):
+    """
+    Copies every project folder with each PDF cut to its first
+    ceil(fraction * pages) pages. File and folder names stay the same so the
+    routing and results are comparable across sizes.
+    """
+    from pypdf import PdfReader, PdfWriter
+    for dirpath, _, filenames in os.walk(docs_dir):
+        target = os.path.join(out_dir, os.path.relpath(dirpath, docs_dir))
+        os.makedirs(target, exist_ok=True)
+        for name in filenames:
+            if not name.lower().endswith(".pdf"):
+                continue
+            reader = PdfReader(os.path.join(dirpath, name))
+            writer = PdfWriter()
+            for page in reader.pages[:max(1, math.ceil(fraction * len(reader.pages)))]:
+                writer.add_page(page)
+            with open(os.path.join(target, name), "wb") as f:
+                writer.write(f)
+    return out_dir
+
+
+###############################################################################
+# 3. WORKER (one configuration, in its own process)
+###############################################################################
+def peak_rss_mb():
+    """Peak RSS of this process and of its largest child, in MB (None on Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(self_rss, 1), round(children_rss, 1)
+
+
+def run_worker(config_path):
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    # EDI_CACHE_DIR is set by the parent before src is imported
+    from src.cache import register_embedding_backend
+    from src.fake_models import FakeEmbeddings, ReferenceChatModel
+    from src.metrics import get_metrics
+    from src.processing import main_cli, iter_dictionary_questions
+
+    register_embedding_backend(
+        "fake", lambda: FakeEmbeddings(latency=config["embed_latency"], per_text_latency=config["embed_text_latency"])
+    )
+    questions = {
+        " ".join(question.split()): (component, action_label)
+        for _, component, question, action_label, _ in iter_dictionary_questions()
+    }
+    references = {}
+    for values in config["references"].values():
+        for component, action, value in values:
+            if value is not None and value not in references.setdefault((component, action), []):
+                references[(component, action)].append(value)
+    llm = ReferenceChatModel(references=references, questions=questions, latency=config["llm_latency"])
+
+    start = time.perf_counter()
+    results = main_cli(
+        config["docs"],
+        query_workers=config["query_workers"],
+        pdf_workers=config["pdf_workers"],
+        project_workers=config["project_workers"],
+        api_concurrency=config["api_concurrency"],
+        batched=config["batched"],
+        metrics_dir=config["metrics_dir"],
+        llm=llm,
+        embedding_backend="fake",
+    )
+    elapsed = time.perf_counter() - start
+    report = get_metrics().report()
+    self_rss, children_rss = peak_rss_mb()
+
+    values = {}
+    errors = {}
+    for r in results:
+        project = os.path.basename(os.path.normpath(r.directory))
+        if r.error:
+            errors[project] = str(r.error)
+        if r.df is None:
+            continue
+        values[project] = [
+            [row["Component"], action, cell_value(row[action])]
+            for _, row in r.df.iterrows()
+            for action in ("No Action", "With Action")
+        ]
+
+    n_questions = len(questions) * len(values)
+    llm_calls = sum(p["totals"].get("llm_calls", 0) for p in report["projects"].values())
+    output = {
+        "elapsed_seconds": round(elapsed, 3),
+        "questions": n_questions,
+        "questions_per_second": round(n_questions / elapsed, 3) if elapsed else None,
+        "llm_calls": llm_calls,
+        "stages": report["stages"],
+        "peak_rss_mb": self_rss,
+        "peak_child_rss_mb": children_rss,
+        "values": values,
+        "errors": errors,
+    }
+    with open(config["output"], "w", encoding="utf-8") as f:
+        json.dump(output, f)
+
+
+###############################################################################
+# 4. IMPORT TIME
+###############################################################################
+def check_import_times(budget=IMPORT_BUDGET, repeats=IMPORT_REPEATS):
+    """
+    Times each IMPORT_CHECKS command in a fresh interpreter and checks that
+    none of them imports FORBIDDEN_IMPORTS. Returns (timings, problems).
+    """
+    report = (
+        "import atexit, sys\n"
+        "atexit.register(lambda: print('LOADED=' + ','.join(m for m in %r if m in sys.modules)))\n"
+    ) % (FORBIDDEN_IMPORTS,)
+    timings = {}
+    problems = []
+    for name, argv in IMPORT_CHECKS.items():
+        if argv[0] == "-c":
+            argv = ["-c", report + argv[1]]
+        else:
+            argv = ["-c", report + f"import runpy, sys; sys.argv = {argv!r}; runpy.run_path({argv[0]!r}, run_name='__main__')"]
+        best = None
+        loaded = ""
+        for _ in range(repeats):
+            start = time.perf_counter()
+            done = subprocess.run(
+                [sys.executable] + argv, cwd=ROOT, capture_output=True, text=True,
+                env=dict(os.environ, PYTHONPATH=ROOT, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-benchmark")),
+            )
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            loaded = next((line[7:] for line in done.stdout.splitlines() if line.startswith("LOADED=")), loaded)
+            if done.returncode not in (0, None):
+                problems.append(f"{name}: exit code {done.returncode}: {done.stderr.strip()[-300:]}")
+                break
+        timings[name] = round(best, 3)
+        if best > budget:
+            problems.append(f"{name}: {best:.2f}s, over the {budget:.2f}s budget")
+        if loaded:
+            problems.append(f"{name}: imported {loaded}")
+    return timings, problems
+
+
+###############################################################################
+# 5. ORCHESTRATION
+###############################################################################
+def run_config(config, references, args, scratch):
+    """Runs one configuration in a fresh process and cache; returns its result dict."""
+    name = "qw{query_workers}-pw{pdf_workers}-prw{project_workers}-s{size}".format(**config)
+    run_dir = os.path.join(scratch, name)
+    os.makedirs(run_dir)
+    worker_config = dict(
+        config,
+        docs=config["docs"],
+        api_concurrency=args.api_concurrency,
+        batched=args.batched,
+        llm_latency=args.llm_latency,
+        embed_latency=args.embed_latency,
+        embed_text_latency=args.embed_text_latency,
+        references={k: [[c, a, v] for (c, a), v in vals.items()] for k, vals in references.items()},
+        metrics_dir=os.path.join(run_dir, "metrics"),
+        output=os.path.join(run_dir, "result.json"),
+    )
+    config_path = os.path.join(run_dir, "config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(worker_config, f)
+
+    env = dict(os.environ, EDI_CACHE_DIR=os.path.join(run_dir, "cache"),
+               EDI_RESULTS_DIR=os.path.join(run_dir, "results"))
+    log_path = os.path.join(run_dir, "run.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        code = subprocess.call(
+            [sys.executable, os.path.abspath(__file__), "--worker", config_path],
+            cwd=run_dir, env=dict(env, PYTHONPATH=ROOT), stdout=log, stderr=subprocess.STDOUT,
+        )
+    result = {"name": name, "config": config, "log": log_path}
+    if not os.path.exists(worker_config["output"]):
+        result["error"] = f"worker exited with code {code}"
+        return result
+    with open(worker_config["output"], "r", encoding="utf-8") as f:
+        result.update(json.load(f))
+    return result
+
+
+def retrieval_hit_rate(values, references):
+    """
+    Fraction of (project, component, action) values equal to the reference.
+    The fake model answers from these same references whenever the number
+    is in its context, so this measures retrieval, not extraction.
+    """
+    matched = total = 0
+    for project, rows in values.items():
+        _, reference = match_reference(project, references)
+        if reference is None:
+            continue
+        for component, action, value in rows:
+            if (component, action) in reference:
+                total += 1
+                matched += values_agree(value, reference[(component, action)])
+    return matched / total if total else None
+
+
+def check_consistency(results):
+    """Names of runs whose values differ from the first run over the same documents."""
+    first = {}
+    mismatched = []
+    for result in results:
+        if "values" not in result:
+            continue
+        size = result["config"]["size"]
+        if size not in first:
+            first[size] = result
+        elif result["values"] != first[size]["values"]:
+            mismatched.append(f"{result['name']} differs from {first[size]['name']}")
+    return mismatched
+
+
+def format_result(result):
+    if "error" in result:
+        return f"{result['name']:<28} FAILED ({result['error']}; log: {result['log']})"
+    stages = result["stages"]
+    stage_text = " ".join(
+        f"{s}={stages[s]['seconds']:.1f}" for s in ("parse", "split", "embed", "index", "retrieval", "llm")
+        if s in stages
+    )
+    rss = f"{result['peak_rss_mb']:.0f}MB" if result["peak_rss_mb"] is not None else "n/a"
+    return (
+        f"{result['name']:<28} {result['elapsed_seconds']:7.2f}s  {result['questions_per_second']:6.2f} q/s  "
+        f"rss {rss:>7}  {stage_text}"
+    )
+
+
+def parse_list(text, cast=int):
+    return [cast(v) for v in text.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the CLI pipeline with fake models.")
+    parser.add_argument("--worker", metavar="CONFIG", help=argparse.SUPPRESS)
+    parser.add_argument("--docs", default=os.path.join(ROOT, "documents"), metavar="DIR",
+                        help="Project folders to run (default documents/).")
+    parser.add_argument("--results", default=os.path.join(ROOT, "Results"), metavar="DIR",
+                        help="Reference spreadsheets the fake LLM answers from and runs are checked against.")
+    parser.add_argument("--llm-latency", type=float, default=0.5, metavar="S",
+                        help="Simulated seconds per chat call.")
+    parser.add_argument("--embed-latency", type=float, default=0.1, metavar="S",
+                        help="Simulated seconds per embedding request.")
+    parser.add_argument("--embed-text-latency", type=float, default=0.001, metavar="S",
+                        help="Additional simulated seconds per embedded text.")
+    parser.add_argument("--query-workers", default="1,2,4,8,16", metavar="LIST",
+                        help="Query worker counts for the scaling curve.")
+    parser.add_argument("--pdf-workers", default="1,2,4", metavar="LIST",
+                        help="PDF worker counts for the scaling curve.")
+    parser.add_argument("--project-workers", default="1,2,3", metavar="LIST",
+                        help="Project worker counts for the scaling curve.")
+    parser.add_argument("--sizes", default="0.25,0.5,1.0", metavar="LIST",
+                        help="Fractions of each PDF's pages for the document size curve.")
+    parser.add_argument("--base", default="8,4,3,1.0", metavar="QW,PW,PRW,SIZE",
+                        help="Base configuration the curves vary from.")
+    parser.add_argument("--api-concurrency", type=int, default=16, metavar="N")
+    parser.add_argument("--batched", action="store_true", help="Benchmark the batched structured-output mode.")
+    parser.add_argument("--output", metavar="FILE", help="Write every run's results as JSON.")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory with logs and caches.")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET, metavar="S",
+                        help="Max seconds for a cold `run.py --help` and pipeline import.")
+    parser.add_argument("--imports-only", action="store_true", help="Only run the import time check.")
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker)
+        return 0
+
+    import_times, import_problems = check_import_times(args.import_budget)
+    print("Import times (best of %d): %s" % (
+        IMPORT_REPEATS, ", ".join(f"{name} {seconds:.2f}s" for name, seconds in import_times.items())
+    ))
+    for line in import_problems:
+        print(f"IMPORT: {line}")
+    if args.imports_only:
+        return 1 if import_problems else 0
+
+    qw, pw, prw, size = args.base.split(",")
+    base = {"query_workers": int(qw), "pdf_workers": int(pw), "project_workers": int(prw), "size": float(size)}
+    curves = {
+        "query_workers": parse_list(args.query_workers),
+        "pdf_workers": parse_list(args.pdf_workers),
+        "project_workers": parse_list(args.project_workers),
+        "size": parse_list(args.sizes, float),
+    }
+    references = load_reference_results(args.results) if os.path.isdir(args.results) else {}
+    if not references:
+        print(f"No reference spreadsheets in {args.results}; the fake LLM will answer 'Value not found'.")
+
+    scratch = tempfile.mkdtemp(prefix="edi-bench-")
+    results = {}
+    curve_runs = {}
+    try:
+        sized_docs = {1.0: os.path.abspath(args.docs)}
+        for dimension, settings in curves.items():
+            curve_runs[dimension] = []
+            for setting in settings:
+                config = dict(base, **{dimension: setting})
+                key = tuple(sorted(config.items()))
+                if key not in results:
+                    if config["size"] not in sized_docs:
+                        sized_docs[config["size"]] = truncated_documents(
+                            args.docs, config["size"], os.path.join(scratch, f"docs-{config['size']}")
+                        )
+                    config["docs"] = sized_docs[config["size"]]
+                    result = run_config(config, references, args, scratch)
+                    if "values" in result:
+                        result["retrieval_hit_rate"] = retrieval_hit_rate(result["values"], references)
+                    results[key] = result
+                    print(format_result(result), flush=True)
+                curve_runs[dimension].append(results[key])
+    finally:
+        # failed runs keep their logs
+        if not args.keep and all("error" not in r for r in results.values()):
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    print("\nScaling curves (elapsed seconds / questions per second / peak RSS MB):")
+    for dimension, runs in curve_runs.items():
+        points = ", ".join(
+            f"{r['config'][dimension]}: {r['elapsed_seconds']:.1f}s/{r['questions_per_second']:.2f}/{r['peak_rss_mb']}"
+            if "error" not in r else f"{r['config'][dimension]}: failed"
+            for r in runs
+        )
+        print(f"  {dimension:<16} {points}")
+
+    all_runs = list(results.values())
+    for r in all_runs:
+        if r.get("retrieval_hit_rate") is not None and r["config"]["size"] == 1.0:
+            print(
+                f"\nRetrieval-hit rate against {args.results}: {r['retrieval_hit_rate']:.0%} of reference values "
+                f"reached the context ({r['name']}; the fake model answers from them, so extraction is not measured)"
+            )
+            break
+
+    failed = [r for r in all_runs if "error" in r or r.get("errors")]
+    mismatched = check_consistency(all_runs)
+    for r in failed:
+        print(f"FAILED: {r['name']}: {r.get('error') or r.get('errors')}")
+    for line in mismatched:
+        print(f"INCONSISTENT: {line}")
+    if not failed and not mismatched:
+        print("All runs over the same documents produced identical values.")
+    for line in import_problems:
+        print(f"IMPORT: {line}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "base": base, "runs": all_runs, "inconsistent": mismatched,
+                "import_seconds": import_times, "import_problems": import_problems,
+            }, f, indent=2)
+        print(f"Benchmark results saved to {args.output}")
+    return 1 if failed or mismatched or import_problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,71 @@
 #!/usr/bin/env python3
 import argparse
 import src.config   # ← this will read .env and set OPENAI_API_KEY 
+from src.cache import EMBEDDING_BACKENDS, DEFAULT_EMBEDDING_BACKEND
+from src.numpy_index import VECTOR_INDEXES, DEFAULT_VECTOR_INDEX
+from src.watch import WATCH_DEBOUNCE
+from src.processing import DEFAULT_QUERY_WORKERS, DEFAULT_PDF_WORKERS
+from src.scheduler import DEFAULT_PROJECT_WORKERS, DEFAULT_API_CONCURRENCY
 
 def run_ui():
     # call the UI entrypoint
     from streamlit_app import main as ui_main
     ui_main()
 
-def run_cli(directory):
+def run_cli(args):
     # call your CLI pipeline
     from src.processing import main_cli
-    main_cli(directory)
+    from src.cache import get_response_cache, set_response_cache_enabled
+    if args.clear_llm_cache:
+        get_response_cache().clear()
+        print("Cleared the LLM response cache.")
+    if args.no_llm_cache:
+        set_response_cache_enabled(False)
+    if args.watch:
+        from src.watch import watch_cli
+        watch_cli(
+            args.cli,
+            debounce=args.debounce,
+            query_workers=args.query_workers,
+            pdf_workers=args.pdf_workers,
+            project_workers=args.project_workers,
+            api_concurrency=args.api_concurrency,
+            batched=args.batched,
+            hybrid=not args.no_hybrid,
+            top_k=args.top_k,
+            context_tokens=args.context_tokens,
+            metrics_dir=args.metrics_dir,
+            embedding_backend=args.embedding_backend,
+            vector_index=args.vector_index,
+        )
+        return
+    main_cli(
+        args.cli,
+        query_workers=args.query_workers,
+        pdf_workers=args.pdf_workers,
+        project_workers=args.project_workers,
+        api_concurrency=args.api_concurrency,
+        batched=args.batched,
+        hybrid=not args.no_hybrid,
+        top_k=args.top_k,
+        context_tokens=args.context_tokens,
+        metrics_dir=args.metrics_dir,
+        embedding_backend=args.embedding_backend,
+        vector_index=args.vector_index,
+        resume=args.resume,
+    )
+
+def profile_cli(args):
+    # worker threads are profiled too and merged into the saved stats
+    import cProfile
+    from src.metrics import enable_thread_profiling, merged_profile
+    enable_thread_profiling()
+    profiler = cProfile.Profile()
+    profiler.runcall(run_cli, args)
+    stats = merged_profile(profiler)
+    stats.dump_stats(args.profile)
+    stats.sort_stats("cumulative").print_stats(30)
+    print(f"Profile saved to {args.profile} (open with snakeviz or python -m pstats)")
 
 def main():
     parser = argparse.ArgumentParser(
@@ -21,10 +76,119 @@ def main():
         metavar="PDF_DIR",
         help="Run in pure-Python mode on a directory of PDFs."
     )
+    parser.add_argument(
+        "--query-workers",
+        type=int,
+        default=DEFAULT_QUERY_WORKERS,
+        metavar="N",
+        help="Max number of RAG queries in flight at once (1 = sequential)."
+    )
+    parser.add_argument(
+        "--pdf-workers",
+        type=int,
+        default=DEFAULT_PDF_WORKERS,
+        metavar="N",
+        help="Worker processes for PDF parsing/splitting (1 = in-process)."
+    )
+    parser.add_argument(
+        "--project-workers",
+        type=int,
+        default=DEFAULT_PROJECT_WORKERS,
+        metavar="N",
+        help="Project folders processed at the same time (stages overlap)."
+    )
+    parser.add_argument(
+        "--api-concurrency",
+        type=int,
+        default=DEFAULT_API_CONCURRENCY,
+        metavar="N",
+        help="Max OpenAI requests in flight across all projects."
+    )
+    parser.add_argument(
+        "--batched",
+        action="store_true",
+        help="Ask all questions of a prompt category in one structured-output call."
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=4,
+        metavar="K",
+        help="Chunks retrieved as context for each question."
+    )
+    parser.add_argument(
+        "--context-tokens",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Token budget for the context of each LLM call (default 1500, 6000 with --batched)."
+    )
+    parser.add_argument(
+        "--no-hybrid",
+        action="store_true",
+        help="Vector search only; skip the BM25 keyword index."
+    )
+    parser.add_argument(
+        "--embedding-backend",
+        choices=sorted(EMBEDDING_BACKENDS),
+        default=DEFAULT_EMBEDDING_BACKEND,
+        help="openai, or local for offline hashed embeddings computed on the CPU."
+    )
+    parser.add_argument(
+        "--vector-index",
+        choices=VECTOR_INDEXES,
+        default=DEFAULT_VECTOR_INDEX,
+        help="Search chunks in memory with NumPy, in LanceDB, or auto: NumPy unless a project is very large."
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        metavar="DIR",
+        help="Where to write the JSON run report and edi.prom (default .edi_cache/metrics)."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted CLI run: skip finished projects and answered questions."
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running after the CLI run and reprocess a project folder whenever its PDFs change."
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=WATCH_DEBOUNCE,
+        metavar="SECONDS",
+        help="With --watch, wait until a project's files are quiet this long before reprocessing it."
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="edi.prof",
+        metavar="FILE",
+        help="Run the CLI under cProfile and save the stats to FILE (default edi.prof)."
+    )
+    parser.add_argument(
+        "--no-llm-cache",
+        action="store_true",
+        help="Always call the LLM; don't read or write cached answers."
+    )
+    parser.add_argument(
+        "--clear-llm-cache",
+        action="store_true",
+        help="Empty the LLM response cache before running."
+    )
     args = parser.parse_args()
+    if args.watch and not args.cli:
+        parser.error("--watch needs --cli PDF_DIR")
+    if args.watch and args.resume:
+        parser.error("--resume can't be combined with --watch (the watch reprocesses changed projects itself)")
 
-    if args.cli:
-        run_cli(args.cli)
+    if args.cli and args.profile:
+        profile_cli(args)
+    elif args.cli:
+        run_cli(args)
     else:
         run_ui()
 
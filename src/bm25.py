@@ -0,0 +1,165 @@
+# src/bm25.py
+
+from .libraries import os, re, json, time, np
+
+
+# Reciprocal rank fusion constant: larger values flatten the difference
+# between the top ranks of the two retrievers.
+RRF_K = int(os.getenv("EDI_RRF_K", "60"))
+
+# Time each query may spend scoring BM25 terms. Terms are scored rarest
+# first, so running out of budget only drops the least informative ones.
+HYBRID_BUDGET_MS = float(os.getenv("EDI_HYBRID_BUDGET_MS", "50"))
+
+# How many candidates each retriever contributes per query, as a multiple of k.
+CANDIDATE_FACTOR = 5
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+HYPHENS = re.compile(r"[‐‑‒–—−]")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have how in is it its of on or that the
+this to under was were what which will with would any if into not only such
+than then there these they those your you use using when answer answering
+""".split())
+
+
+###############################################################################
+# 1. TOKENIZER
+###############################################################################
+def tokenize(text):
+    """
+    Lowercased word tokens without stopwords. Hyphenated terms are indexed
+    both whole and as parts, so "No‐Action", "No-Action" and "no action"
+    all match each other.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(HYPHENS.sub("-", text.lower())):
+        if "-" in token:
+            parts = token.split("-")
+            tokens.append("".join(parts))
+            tokens.extend(p for p in parts if p not in STOPWORDS)
+        elif token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+###############################################################################
+# 2. INVERTED INDEX
+###############################################################################
+class BM25Index:
+    """
+    In-memory BM25 inverted index over the chunks of one LanceDB table.
+
+    Documents are identified by the table's id column, so search results can
+    be fused with vector hits and fetched back from the same table. version
+    records the table version the index was built from; a mismatch means the
+    table changed and the index must be rebuilt.
+    """
+
+    def __init__(self, ids, postings, doc_lengths, version=None):
+        self.ids = list(ids)
+        self.version = version
+        self.doc_lengths = np.asarray(doc_lengths, dtype=np.float64)
+        self.avg_length = float(self.doc_lengths.mean()) if len(self.ids) else 0.0
+        self.postings = {
+            term: (np.asarray(docs, dtype=np.int64), np.asarray(tfs, dtype=np.float64))
+            for term, (docs, tfs) in postings.items()
+        }
+        self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids, texts, version=None):
+        postings = {}
+        doc_lengths = []
+        for i, text in enumerate(texts):
+            counts = {}
+            tokens = tokenize(text)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, tf in counts.items():
+                docs, tfs = postings.setdefault(term, ([], []))
+                docs.append(i)
+                tfs.append(tf)
+            doc_lengths.append(len(tokens))
+        return cls(ids, postings, doc_lengths, version=version)
+
+    @classmethod
+    def from_table(cls, table, where=None, version=None):
+        """
+        Indexes every chunk currently in a LanceDB table, or those matching
+        the SQL filter where. version defaults to the table's version.
+        """
+        if where is None:
+            data = table.to_arrow().select(["id", "text"])
+        else:
+            data = (
+                table.search().where(where).select(["id", "text"])
+                .limit(max(table.count_rows(where), 1)).to_arrow()
+            )
+        return cls.build(
+            data.column("id").to_pylist(), data.column("text").to_pylist(),
+            version=table.version if version is None else version,
+        )
+
+    def save(self, path):
+        payload = {
+            "version": self.version,
+            "ids": self.ids,
+            "doc_lengths": self.doc_lengths.astype(int).tolist(),
+            "postings": {t: [d.tolist(), f.astype(int).tolist()] for t, (d, f) in self.postings.items()},
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        return cls(payload["ids"], payload["postings"], payload["doc_lengths"], payload["version"])
+
+    def search(self, query, n, allowed=None, budget_ms=HYBRID_BUDGET_MS):
+        """
+        Ids of the top-n chunks for query, best first. allowed is an optional
+        set of ids to restrict the search to (e.g. the chunks of one chapter).
+        """
+        if not self.ids:
+            return []
+        n_docs = len(self.ids)
+        terms = [t for t in dict.fromkeys(tokenize(query)) if t in self.postings]
+        idf = {
+            t: np.log(1 + (n_docs - len(self.postings[t][0]) + 0.5) / (len(self.postings[t][0]) + 0.5))
+            for t in terms
+        }
+        scores = np.zeros(n_docs)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / max(self.avg_length, 1e-9))
+        deadline = time.perf_counter() + budget_ms / 1000 if budget_ms else None
+        for term in sorted(terms, key=idf.get, reverse=True):
+            docs, tfs = self.postings[term]
+            scores[docs] += idf[term] * tfs * (BM25_K1 + 1) / (tfs + norm[docs])
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+
+        if allowed is not None:
+            mask = np.zeros(n_docs, dtype=bool)
+            mask[[self.positions[i] for i in allowed if i in self.positions]] = True
+            scores[~mask] = 0
+        top = np.argsort(-scores, kind="stable")[:n]
+        return [self.ids[i] for i in top if scores[i] > 0]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuses several ranked id lists into one: score(id) = Σ 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
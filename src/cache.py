@@ -0,0 +1,335 @@
+# src/cache.py
+
+from .libraries import os, json, hashlib, sqlite3, threading, time, np
+from .libraries import Embeddings, OpenAIEmbeddings
+from .metrics import get_metrics
+from .context import count_tokens
+from .ratelimit import limited_call, get_http_client
+from .local_embeddings import HashingEmbeddings
+
+
+# Everything the pipeline persists between runs lives under this folder.
+CACHE_DIR = os.getenv("EDI_CACHE_DIR", ".edi_cache")
+
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EDI_EMBEDDING_CACHE_MB", "1024")) * 1024 * 1024
+
+# Texts per embedding request (the OpenAI client would split at 1000 anyway).
+EMBEDDING_BATCH_SIZE = 500
+
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("EDI_RESPONSE_CACHE_MB", "256")) * 1024 * 1024
+RESPONSE_CACHE_TTL = float(os.getenv("EDI_RESPONSE_CACHE_TTL_DAYS", "30")) * 24 * 3600
+
+# Expired entries are deleted at most once per this many seconds; lookups
+# skip them in between.
+CACHE_EXPIRE_INTERVAL = 60
+
+
+def content_key(*parts):
+    """sha256 over the given parts, separated so ("ab", "c") != ("a", "bc")."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+###############################################################################
+# 1. ON-DISK KEY/VALUE STORE
+###############################################################################
+class DiskCache:
+    """
+    A small sqlite-backed key/value store shared by the pipeline caches.
+
+    Values are raw bytes. When the total stored size goes over max_bytes the
+    least recently used entries are evicted until it is back under 90% of it.
+    With a ttl (seconds), entries older than that count as misses and are
+    dropped every CACHE_EXPIRE_INTERVAL seconds. hits / misses count lookups made through this instance.
+    """
+
+    def __init__(self, path, max_bytes, ttl=None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._expired_at = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+            " size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(entries)")]
+        if "created" not in columns:
+            # caches written before TTL support: treat their entries as new
+            self._conn.execute("ALTER TABLE entries ADD COLUMN created REAL NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE entries SET created = accessed")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get_many(self, keys):
+        """Returns {key: value} for the keys that are present."""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            fresh, cutoff = "", ()
+            if self.ttl is not None:
+                now = time.time()
+                if now - self._expired_at >= CACHE_EXPIRE_INTERVAL:
+                    self._expire(now)
+                fresh, cutoff = " AND created >= ?", (now - self.ttl,)
+            # sqlite caps the number of bound parameters, so look up in slices
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({marks}){fresh}", batch + list(cutoff)
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE entries SET accessed = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items):
+        """Stores {key: value} and evicts old entries if over the size limit."""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            for key, value in items.items():
+                old = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                if old:
+                    self._size -= old[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, accessed, created)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, sqlite3.Binary(value), len(value), now, now),
+                )
+                self._size += len(value)
+            self._evict()
+            self._conn.commit()
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def _expire(self, now):
+        self._expired_at = now
+        cutoff = now - self.ttl
+        expired = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM entries WHERE created < ?", (cutoff,)
+        ).fetchone()
+        if expired[1]:
+            self._conn.execute("DELETE FROM entries WHERE created < ?", (cutoff,))
+            self._conn.commit()
+            self._size -= expired[0]
+
+    def _evict(self):
+        if self._size <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC")
+        doomed = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            doomed.append((key,))
+            self._size -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": self._size}
+
+
+###############################################################################
+# 2. EMBEDDING CACHE
+###############################################################################
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings backend so each chunk is embedded at most once.
+
+    Vectors are keyed by sha256(model name + chunk text), so unchanged chunks
+    are served from disk and only new or edited text goes to the backend.
+    Query embeddings are cached the same way under their own key prefix, so
+    they are only recomputed when a prompt string changes.
+    limiter (a ratelimit.RateLimiter) schedules backend calls across
+    projects; new texts are sent in requests of EMBEDDING_BATCH_SIZE.
+    """
+
+    def __init__(self, underlying, cache, model_name=None, limiter=None):
+        self.underlying = underlying
+        self.cache = cache
+        self.model_name = model_name or getattr(underlying, "model", type(underlying).__name__)
+        self.limiter = limiter
+
+    def _key(self, text):
+        return content_key(self.model_name, text)
+
+    def _query_key(self, text):
+        # the ~30 prompt strings are constants, so these hit on every project
+        return content_key("query", self.model_name, text)
+
+    def _embed_cached(self, texts, keys):
+        found = self.cache.get_many(keys)
+        metrics = get_metrics()
+        metrics.count("embedding_cache_hits", sum(1 for k in keys if k in found))
+        metrics.count("embedding_cache_misses", sum(1 for k in keys if k not in found))
+
+        # embed each distinct missing text once, even if it repeats in the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            # OpenAI embeds queries and documents the same way, so uncached
+            # queries can share one batched request too
+            texts = list(missing.values())
+            vectors = []
+            with metrics.stage("embed"):
+                for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+                    batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+                    tokens = sum(count_tokens(t) for t in batch)
+                    vectors += limited_call(
+                        self.limiter, "embedding", tokens, self.underlying.embed_documents, batch
+                    )
+            new_items = {
+                key: np.asarray(vec, dtype=np.float64).tobytes()
+                for key, vec in zip(missing.keys(), vectors)
+            }
+            self.cache.set_many(new_items)
+            found.update(new_items)
+
+        return [np.frombuffer(found[k], dtype=np.float64).tolist() for k in keys]
+
+    def embed_documents(self, texts):
+        return self._embed_cached(texts, [self._key(t) for t in texts])
+
+    def embed_queries(self, texts):
+        """Batch form of embed_query: one backend request for all uncached queries."""
+        return self._embed_cached(texts, [self._query_key(t) for t in texts])
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+
+_embedding_cache = None
+_response_cache = None
+_response_cache_enabled = True
+_open_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """The shared on-disk embedding cache, opened on first use."""
+    global _embedding_cache
+    with _open_lock:
+        if _embedding_cache is None:
+            _embedding_cache = DiskCache(
+                os.path.join(CACHE_DIR, "embeddings.sqlite"), EMBEDDING_CACHE_MAX_BYTES
+            )
+    return _embedding_cache
+
+
+# Embedding backends by name; each factory returns a langchain Embeddings.
+# The OpenAI client doesn't retry itself, the rate limiter does. "local"
+# runs offline on the CPU (see local_embeddings.py).
+EMBEDDING_BACKENDS = {
+    "openai": lambda: OpenAIEmbeddings(max_retries=0, http_client=get_http_client()),
+    "local": lambda: HashingEmbeddings(),
+}
+DEFAULT_EMBEDDING_BACKEND = "openai"
+
+
+def register_embedding_backend(name, factory):
+    """Makes factory() available as get_embeddings(backend=name)."""
+    EMBEDDING_BACKENDS[name] = factory
+
+
+def get_embeddings(limiter=None, backend=DEFAULT_EMBEDDING_BACKEND):
+    """
+    Embeddings from the named backend (OpenAI by default) backed by the
+    shared on-disk cache. Vectors are cached per backend model name, and
+    the project indexes record it, so switching backends rebuilds them.
+    Backends marked local (computed on the CPU) are returned as they are.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"Unknown embedding backend '{backend}' (available: {', '.join(sorted(EMBEDDING_BACKENDS))})"
+        )
+    underlying = EMBEDDING_BACKENDS[backend]()
+    if getattr(underlying, "local", False):
+        return underlying
+    return CachedEmbeddings(underlying, get_embedding_cache(), limiter=limiter)
+
+
+###############################################################################
+# 3. LLM RESPONSE CACHE
+###############################################################################
+def get_response_cache():
+    """The shared on-disk LLM response cache, opened on first use."""
+    global _response_cache
+    with _open_lock:
+        if _response_cache is None:
+            _response_cache = DiskCache(
+                os.path.join(CACHE_DIR, "responses.sqlite"),
+                RESPONSE_CACHE_MAX_BYTES,
+                ttl=RESPONSE_CACHE_TTL,
+            )
+    return _response_cache
+
+
+def set_response_cache_enabled(enabled):
+    """Turns response caching on or off for this process (e.g. --no-llm-cache)."""
+    global _response_cache_enabled
+    _response_cache_enabled = enabled
+
+
+def response_cache_enabled():
+    return _response_cache_enabled
+
+
+def llm_cache_key(llm, messages):
+    """
+    Key for an LLM response: model name, generation parameters and the exact
+    message contents. Any change to the prompt or the retrieved context gives
+    a different key, so only the changed questions go back to the API.
+    """
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", type(llm).__name__)
+    params = {
+        name: getattr(llm, name, None)
+        for name in ("temperature", "top_p", "max_tokens", "seed", "n",
+                     "frequency_penalty", "presence_penalty", "stop", "model_kwargs")
+    }
+    return content_key(
+        model,
+        json.dumps(params, sort_keys=True, default=str),
+        *(f"{m.type}:{m.content}" for m in messages),
+    )
@@ -0,0 +1,190 @@
+# src/context.py
+
+from .libraries import os, re, threading, tiktoken
+
+
+# Prompt-context budgets in tokens: one question, and one batched category.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("EDI_CONTEXT_TOKENS", "1500"))
+BATCH_CONTEXT_TOKEN_BUDGET = int(os.getenv("EDI_BATCH_CONTEXT_TOKENS", "6000"))
+
+# Chunks whose word shingles overlap at least this much count as duplicates.
+NEAR_DUPLICATE_JACCARD = 0.8
+
+# Splitter overlaps shorter than this are treated as coincidence, not overlap.
+MIN_MERGE_OVERLAP = 20
+
+# A trimmed last block shorter than this is dropped instead.
+MIN_TRIM_TOKENS = 50
+
+TOKEN_MODEL = "gpt-4o"
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+###############################################################################
+# 1. TOKEN COUNTING
+###############################################################################
+def get_token_encoding():
+    """
+    The tiktoken encoding for TOKEN_MODEL, loaded once. tiktoken downloads
+    its vocabulary on first use; if that fails (offline), counts fall back
+    to a 4-characters-per-token estimate.
+    """
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.encoding_for_model(TOKEN_MODEL)
+            except Exception as e:
+                print(f"tiktoken unavailable ({type(e).__name__}), estimating tokens from length")
+                _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = get_token_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def truncate_tokens(text, max_tokens):
+    """The first max_tokens tokens of text."""
+    encoding = get_token_encoding()
+    if encoding:
+        tokens = encoding.encode(text)
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+###############################################################################
+# 2. CONTEXT ASSEMBLY
+###############################################################################
+def _page_label(doc):
+    try:
+        return str(int(doc.metadata.get("page", "N/A")))
+    except Exception:
+        return "N/A"
+
+
+def _source_page(key):
+    """(source, page) → "file.pdf p.N" with the page counted from 1."""
+    source, page = key
+    try:
+        page = str(int(page) + 1)
+    except (TypeError, ValueError):
+        page = "N/A"
+    return f"{os.path.basename(str(source or '')) or 'unknown'} p.{page}"
+
+
+def format_context(documents):
+    """Joins retrieved chunks as "Page N:\n<text>" blocks; returns (context, pages)."""
+    context_parts = []
+    pages = []
+    for doc in documents:
+        page = _page_label(doc)
+        pages.append(page)
+        context_parts.append(f"Page {page}:\n{doc.page_content}")
+    return "\n\n".join(context_parts), pages
+
+
+def merge_overlapping(a, b):
+    """
+    Joins two chunks of the same page if one continues the other (the
+    splitter repeats up to chunk_overlap characters between neighbours) or
+    contains it. Returns the merged text, or None if they don't touch.
+    """
+    if b in a:
+        return a
+    if a in b:
+        return b
+    for first, second in ((a, b), (b, a)):
+        for k in range(min(len(first), len(second)), MIN_MERGE_OVERLAP - 1, -1):
+            if first.endswith(second[:k]):
+                return first + second[k:]
+    return None
+
+
+def _shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def _is_near_duplicate(shingles, seen):
+    for other in seen:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= NEAR_DUPLICATE_JACCARD:
+            return True
+    return False
+
+
+def assemble_context(documents, max_tokens=CONTEXT_TOKEN_BUDGET):
+    """
+    Builds the prompt context from retrieved chunks, most relevant first.
+
+    Neighbouring chunks of the same page are merged so their shared overlap
+    appears once, chunks that nearly repeat an earlier one are dropped, and
+    blocks are added in relevance order until max_tokens is reached (the
+    last one trimmed to fit). Returns (context, pages, stats) where pages
+    lists the "file.pdf p.N" source of each block kept and stats holds the
+    token and chunk counts before and after.
+    """
+    naive_context, _ = format_context(documents)
+
+    blocks = []  # [page key, page label, text], in order of best rank
+    for doc in documents:
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        text = doc.page_content
+        for block in blocks:
+            if block[0] == key:
+                merged = merge_overlapping(block[2], text)
+                if merged is not None:
+                    block[2] = merged
+                    break
+        else:
+            blocks.append([key, _page_label(doc), text])
+
+    # drop blocks that nearly repeat a more relevant one (e.g. reprinted text)
+    kept = []
+    seen = []
+    for key, page, text in blocks:
+        shingles = _shingles(text)
+        if _is_near_duplicate(shingles, seen):
+            continue
+        seen.append(shingles)
+        kept.append((key, page, text))
+
+    parts = []
+    pages = []
+    used = 0
+    for key, page, text in kept:
+        part = f"Page {page}:\n{text}"
+        tokens = count_tokens(part) + (2 if parts else 0)  # "\n\n" separator
+        if max_tokens and used + tokens > max_tokens:
+            remaining = max_tokens - used
+            if remaining >= MIN_TRIM_TOKENS:
+                parts.append(truncate_tokens(part, remaining - 2))
+                pages.append(_source_page(key))
+            break
+        parts.append(part)
+        pages.append(_source_page(key))
+        used += tokens
+
+    context = "\n\n".join(parts)
+    stats = {
+        "chunks_before": len(documents),
+        "chunks_after": len(parts),
+        "tokens_before": count_tokens(naive_context),
+        "tokens_after": count_tokens(context),
+    }
+    return context, pages, stats
+
+
+def format_token_stats(stats):
+    before, after = stats["tokens_before"], stats["tokens_after"]
+    saved = 100 * (before - after) / before if before else 0
+    return (
+        f"{before} -> {after} tokens ({saved:.0f}% saved), "
+        f"{stats['chunks_before']} chunks -> {stats['chunks_after']} blocks"
+    )
@@ -0,0 +1,194 @@
+# src/dedup.py
+
+from .libraries import os, re, json, hashlib, zlib, np, Document
+
+
+# Chunks are deduplicated between splitting and embedding (set EDI_DEDUP=0
+# to turn it off). Near duplicates are chunks whose word 5-gram sets have a
+# Jaccard similarity of at least DEDUP_JACCARD; MinHash + LSH banding finds
+# the candidates and the exact Jaccard decides.
+DEDUP_ENABLED = os.getenv("EDI_DEDUP", "1") != "0"
+DEDUP_JACCARD = float(os.getenv("EDI_DEDUP_JACCARD", "0.85"))
+SHINGLE_WORDS = 5
+
+# 16 bands of 8 rows: a pair at 0.85 Jaccard becomes a candidate >99% of
+# the time, a pair at 0.5 about 6% of the time.
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 16
+
+_PRIME = (1 << 31) - 1  # keeps a * x + b below 2**63 for 31-bit hashes
+
+
+def dedup_settings():
+    """Recorded in the index manifest, so changing any of these rebuilds the index."""
+    if not DEDUP_ENABLED:
+        return None
+    return {"jaccard": DEDUP_JACCARD, "shingle_words": SHINGLE_WORDS,
+            "permutations": MINHASH_PERMUTATIONS, "bands": LSH_BANDS}
+
+
+def _normalized_words(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def _shingle_hashes(words):
+    """Sorted unique crc32s of the word shingles (stable across processes, unlike hash())."""
+    if len(words) < SHINGLE_WORDS:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    return np.unique(np.fromiter(
+        (zlib.crc32(g.encode("utf-8")) & _PRIME for g in grams), dtype=np.uint64, count=len(grams)
+    ))
+
+
+class MinHasher:
+    """MinHash signatures from fixed random permutations (a * x + b) mod p."""
+
+    def __init__(self, permutations=MINHASH_PERMUTATIONS, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, size=permutations, dtype=np.uint64)[:, None]
+        self.b = rng.integers(0, _PRIME, size=permutations, dtype=np.uint64)[:, None]
+
+    def signature(self, hashes):
+        return ((self.a * hashes[None, :] + self.b) % _PRIME).min(axis=1)
+
+
+def _jaccard(a, b):
+    shared = len(np.intersect1d(a, b, assume_unique=True))
+    return shared / (len(a) + len(b) - shared)
+
+
+def _location(doc):
+    page = doc.metadata.get("page", "N/A")
+    try:
+        page = str(int(page) + 1)
+    except (TypeError, ValueError):
+        page = "N/A"
+    return f"{os.path.basename(str(doc.metadata.get('source', '')))} p.{page}"
+
+
+class Deduplicator:
+    """
+    Finds exact and near-duplicate chunks in one pass over a stream of
+    them, keeping the first occurrence in stream order (file order, then
+    page order). Only hashes are kept, not chunk text: about 1 KB per
+    distinct chunk. Each kept chunk gets:
+
+        metadata["also_in"]  "file.pdf p.N" of every dropped copy
+        metadata["chapter"]  all chapters it appeared in, joined by " | ",
+                             so chapter routing still finds it
+
+    A copy can turn up after the chunk it duplicates, so those are only
+    final once the whole stream has been seen: add() every chunk, then pass
+    the same chunks again, in the same order, through kept(); the second
+    pass may skip whole files. chapter(source) names a file's chapter
+    (processing.detect_chapter).
+    """
+
+    def __init__(self, chapter=None):
+        self.chapter = chapter
+        self.hasher = MinHasher()
+        self.rows_per_band = MINHASH_PERMUTATIONS // LSH_BANDS
+        self.annotations = []   # [also_in, chapters] of each kept chunk
+        self.shingles = []      # shingle hashes of each kept chunk
+        self.exact = {}         # normalized text hash -> kept position
+        self.buckets = {}       # (band, band signature) -> kept positions
+        self.is_kept = bytearray()  # one flag per chunk seen
+        self.files = {}         # source -> [first chunk, first kept position, chunks]
+        self.stats = {"chunks": 0, "kept": 0, "exact": 0, "near": 0}
+
+    def add(self, doc):
+        """Records doc; returns whether it is kept."""
+        source = doc.metadata.get("source", "")
+        self.files.setdefault(source, [len(self.is_kept), len(self.annotations), 0])[2] += 1
+        self.stats["chunks"] += 1
+        words = _normalized_words(doc.page_content)
+        key = hashlib.sha1(" ".join(words).encode("utf-8")).digest()
+        match = self.exact.get(key)
+        new = False
+        if match is not None:
+            self.stats["exact"] += 1
+        else:
+            hashes = _shingle_hashes(words)
+            signature = self.hasher.signature(hashes)
+            bands = [
+                (band, signature[band * self.rows_per_band:(band + 1) * self.rows_per_band].tobytes())
+                for band in range(LSH_BANDS)
+            ]
+            candidates = sorted({i for band in bands for i in self.buckets.get(band, ())})
+            match = next((i for i in candidates if _jaccard(hashes, self.shingles[i]) >= DEDUP_JACCARD), None)
+            if match is not None:
+                self.stats["near"] += 1
+            else:
+                new = True
+                match = len(self.annotations)
+                self.annotations.append([[], []])
+                self.shingles.append(hashes)
+                for band in bands:
+                    self.buckets.setdefault(band, []).append(match)
+            self.exact[key] = match
+        if not new:
+            self.annotations[match][0].append(_location(doc))
+        if self.chapter is not None:
+            name = self.chapter(doc.metadata.get("source", ""))
+            if name and name not in self.annotations[match][1]:
+                self.annotations[match][1].append(name)
+        self.is_kept.append(new)
+        self.stats["kept"] = len(self.annotations)
+        return new
+
+    def file_digests(self):
+        """
+        A digest per file name of which of its chunks are kept and of their
+        also_in / chapter annotations. Given the same file, an unchanged
+        digest means kept() yields the same chunks for it as before.
+        """
+        digests = {}
+        for source, (first, position, count) in self.files.items():
+            flags = self.is_kept[first:first + count]
+            annotations = self.annotations[position:position + sum(flags)]
+            payload = json.dumps([flags.hex(), annotations]).encode("utf-8")
+            digests[os.path.basename(source)] = hashlib.sha1(payload).hexdigest()
+        return digests
+
+    def kept(self, docs):
+        """
+        The kept chunks of docs, annotated: the chunks given to add() again,
+        or those of only some of the files (each file's chunks complete).
+        """
+        source = chunk = position = None
+        for doc in docs:
+            if doc.metadata.get("source", "") != source:
+                source = doc.metadata.get("source", "")
+                chunk, position, _ = self.files[source]
+            kept = self.is_kept[chunk]
+            chunk += 1
+            if not kept:
+                continue
+            also_in, chapters = self.annotations[position]
+            position += 1
+            metadata = dict(doc.metadata, also_in=also_in)
+            if chapters:
+                metadata["chapter"] = " | ".join(chapters)
+            yield Document(page_content=doc.page_content, metadata=metadata)
+
+
+def deduplicate(splits, chapter=None):
+    """
+    Drops exact and near-duplicate chunks from a list (see Deduplicator).
+    Returns (kept chunks, {"chunks", "kept", "exact", "near"}).
+    """
+    dedup = Deduplicator(chapter=chapter)
+    for doc in splits:
+        dedup.add(doc)
+    return list(dedup.kept(splits)), dedup.stats
+
+
+def format_dedup_stats(stats):
+    dropped = stats["chunks"] - stats["kept"]
+    share = 100 * dropped / stats["chunks"] if stats["chunks"] else 0
+    return (
+        f"{stats['chunks']} chunks → {stats['kept']} after deduplication "
+        f"({dropped} dropped, {share:.0f}%: {stats['exact']} exact, {stats['near']} near duplicates)"
+    )
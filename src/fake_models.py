@@ -0,0 +1,109 @@
+# src/fake_models.py
+
+from .libraries import re, time, hashlib, np, Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+
+# Offline stand-ins for the OpenAI models, used by benchmark.py. They never
+# touch the network, give the same output for the same input, and sleep to
+# simulate API latency so concurrency settings behave as they would live.
+
+
+###############################################################################
+# 1. EMBEDDINGS
+###############################################################################
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic unit vectors seeded from a hash of each text. Each request
+    sleeps latency seconds plus per_text_latency for every text in it.
+    """
+
+    def __init__(self, size=256, latency=0.0, per_text_latency=0.0):
+        self.size = size
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.model = f"fake-embedding-{size}"
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+###############################################################################
+# 2. CHAT MODEL
+###############################################################################
+def _number_in_text(value, text):
+    """True if value is written in text, with or without thousands separators."""
+    plain = f"{value:f}".rstrip("0").rstrip(".")
+    candidates = {plain, f"{value:,.0f}" if float(value).is_integer() else plain}
+    flat = re.sub(r"(?<=\d),(?=\d{3})", "", text)
+    return any(
+        re.search(rf"(?<![\d.]){re.escape(c.replace(',', ''))}(?![\d]|\.\d)", flat) for c in candidates
+    )
+
+
+class ReferenceChatModel(BaseChatModel):
+    """
+    Answers from known reference values, but only when the retrieved context
+    actually contains the number.
+
+    references maps (component, action) to candidate values (one per
+    project). For a question about a component the model replies with the
+    first candidate found in the prompt's context and "Value not found"
+    otherwise, so its answers depend on retrieval and context assembly the
+    way a real model's do. Each call sleeps latency seconds.
+    """
+
+    references: dict = {}
+    questions: dict = {}
+    latency: float = 0.0
+    model_name: str = "fake-reference-chat"
+
+    @property
+    def _llm_type(self):
+        return "fake-reference"
+
+    def _answer(self, component, action, context):
+        for value in self.references.get((component, action), []):
+            if _number_in_text(value, context):
+                return value
+        return None
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        prompt = messages[-1].content
+        context, _, question = prompt.partition("\n\nQuestion: ")
+        question = question.rsplit("\nAnswer:", 1)[0]
+        component, action = self.questions.get(" ".join(question.split()), (None, None))
+        value = self._answer(component, action, context) if component else None
+        text = f"{component}: {value:g}" if value is not None else "Value not found"
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def with_structured_output(self, schema, include_raw=False, **kwargs):
+        question_line = re.compile(r"^(q\d+) - (.+) \((No Action|With Action)\): ", re.MULTILINE)
+
+        def run(messages):
+            time.sleep(self.latency)
+            prompt = messages[-1].content
+            answers = {}
+            for name, component, action in question_line.findall(prompt):
+                value = self._answer(component, action, prompt.split("\nAnswer each question", 1)[0])
+                answers[name] = {"value": value, "unit": ""}
+            for name in schema["properties"]:
+                answers.setdefault(name, {"value": None, "unit": ""})
+            if include_raw:
+                return {"raw": AIMessage(content=""), "parsed": answers, "parsing_error": None}
+            return answers
+
+        return RunnableLambda(run)
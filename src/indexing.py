@@ -0,0 +1,513 @@
+# src/indexing.py
+
+from .libraries import os, re, glob, json, time, shutil, threading, uuid, lancedb, LanceDB, ThreadPoolExecutor
+from .cache import CACHE_DIR, content_key, file_sha256, get_embeddings
+from .processing import iter_indexed_splits, find_duplicates, chunk_metadata, sql_list, CHUNK_SIZE, CHUNK_OVERLAP
+from .dedup import dedup_settings
+from .bm25 import BM25Index
+from .metrics import get_metrics
+
+
+# Every project's chunks live in one LanceDB dataset under INDEX_DIR/lancedb,
+# one table per embedding model (vectors of different models can't share a
+# column). Each project folder keeps its manifest and keyword index in its
+# own folder next to it.
+INDEX_DIR = os.path.join(CACHE_DIR, "indexes")
+SHARED_DB_NAME = "lancedb"
+TABLE_PREFIX = "chunks"
+MANIFEST_NAME = "manifest.json"
+BM25_NAME = "bm25.json"
+
+# Bump when the table layout or chunk metadata changes so old indexes get rebuilt.
+INDEX_VERSION = 5
+
+# Once a table holds this many chunks it gets an IVF-PQ vector index, so
+# search time stays flat as the corpus grows; below it an exact scan is
+# fast enough. Chunks added after an index was built are scanned exactly
+# until OPTIMIZE_UNINDEXED_ROWS of them have piled up and optimize() folds
+# them in.
+ANN_INDEX_MIN_ROWS = int(os.getenv("EDI_ANN_MIN_ROWS", "100000"))
+OPTIMIZE_UNINDEXED_ROWS = 10000
+
+# Chunks are embedded and written to the table in batches while the PDFs
+# are still being split, so indexing memory does not grow with the size of
+# a project. A batch has at most EDI_INGEST_BATCH chunks, fewer if two
+# batches (one being embedded, the previous one being written) would take
+# more than EDI_INGEST_MEMORY_MB. Until the first batch shows the vector
+# width, vectors are assumed to be ASSUMED_VECTOR_DIM wide.
+INGEST_BATCH = int(os.getenv("EDI_INGEST_BATCH", "500"))
+INGEST_MEMORY_MB = int(os.getenv("EDI_INGEST_MEMORY_MB", "256"))
+ASSUMED_VECTOR_DIM = 3072
+
+# Projects are indexed side by side; their writes to the shared table are
+# serialized within the process.
+_write_lock = threading.Lock()
+
+# One lock per project folder, so two runs (e.g. two UI sessions) on the
+# same folder can't both see its PDFs as changed and insert the same chunks
+# twice. Reentrant: callers may hold it around open_project_index.
+_project_locks = {}
+_project_locks_guard = threading.Lock()
+
+
+###############################################################################
+# 1. MANIFEST
+###############################################################################
+def project_index_dir(directory):
+    """One index folder per project, named after the folder plus a path hash."""
+    abspath = os.path.abspath(directory)
+    name = re.sub(r"[^A-Za-z0-9_-]+", "_", os.path.basename(os.path.normpath(abspath)))
+    return os.path.join(INDEX_DIR, f"{name}-{content_key(abspath)[:12]}")
+
+
+def index_settings(embedding):
+    """Everything that, if changed, makes the stored vectors unusable."""
+    return {
+        "version": INDEX_VERSION,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "embedding_model": getattr(embedding, "model_name", type(embedding).__name__),
+        "dedup": dedup_settings(),
+    }
+
+
+def load_manifest(index_dir):
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable index manifest {path}: {e}")
+        return None
+
+
+def save_manifest(index_dir, manifest):
+    # write-then-rename so a crash never leaves a half-written manifest behind
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def diff_pdfs(pdf_files, known_files):
+    """
+    Compares the PDFs on disk against the manifest entries.
+
+    Files whose size and mtime match the manifest are trusted without hashing,
+    which is what keeps reopening an unchanged project cheap. Returns
+    (entries, changed, removed): fresh manifest entries for every PDF, the
+    paths that need (re)indexing, and the names that disappeared.
+    """
+    entries = {}
+    changed = []
+    for pdf_file in pdf_files:
+        name = os.path.basename(pdf_file)
+        stat = os.stat(pdf_file)
+        known = known_files.get(name)
+        if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            entries[name] = known
+            continue
+        sha = file_sha256(pdf_file)
+        if known and known["sha256"] == sha:
+            # touched but not modified: keep the chunks, refresh the mtime
+            entries[name] = dict(known, mtime=stat.st_mtime)
+            continue
+        entries[name] = {
+            "sha256": sha, "size": stat.st_size, "mtime": stat.st_mtime, "chunks": 0, "tables": [],
+        }
+        changed.append(pdf_file)
+    removed = [name for name in known_files if name not in entries]
+    return entries, changed, removed
+
+
+def project_version(manifest):
+    """Changes whenever a project's chunks in the shared table do."""
+    return content_key(json.dumps(manifest, sort_keys=True))[:16]
+
+
+###############################################################################
+# 2. SHARED CHUNK TABLE
+###############################################################################
+def shared_db_dir():
+    return os.path.join(INDEX_DIR, SHARED_DB_NAME)
+
+
+def shared_table_name(model_name):
+    """The shared table for one embedding model, e.g. chunks_text_embedding_ada_002_1a2b3c4d."""
+    slug = re.sub(r"[^A-Za-z0-9_]+", "_", model_name).strip("_")[:40]
+    return f"{TABLE_PREFIX}_{slug}_{content_key(model_name)[:8]}"
+
+
+def _model_name(embedding):
+    return getattr(embedding, "model_name", type(embedding).__name__)
+
+
+def open_shared_index(embedding=None, connection=None):
+    """
+    LanceDB vectorstore over the chunks of every indexed project, for
+    retrieval across projects: pass project_filter / projects_filter to
+    processing.rag_query or retrieve_batch to narrow it down.
+    """
+    if embedding is None:
+        embedding = get_embeddings()
+    return LanceDB(
+        connection=connection or lancedb.connect(shared_db_dir()),
+        embedding=embedding,
+        table_name=shared_table_name(_model_name(embedding)),
+        mode="append",
+    )
+
+
+def project_filter(directory):
+    """
+    SQL filter for one project folder's chunks. The project column carries
+    the scalar index; the path tells apart folders that share a name.
+    """
+    abspath = os.path.abspath(directory)
+    name = os.path.basename(os.path.normpath(abspath))
+    return f"project = {sql_list([name])} AND project_dir = {sql_list([abspath])}"
+
+
+def projects_filter(names):
+    """SQL filter for the chunks of the projects with these folder names."""
+    return f"project IN ({sql_list(names)})"
+
+
+def _chunk_rows(directory, texts, metadatas, vectors):
+    """
+    Table rows: id, text, vector and the metadata struct LangChain reads
+    back, plus top-level project, project_dir, chapter and page columns to
+    filter and index on.
+    """
+    abspath = os.path.abspath(directory)
+    name = os.path.basename(os.path.normpath(abspath))
+    rows = []
+    for text, metadata, vector in zip(texts, metadatas, vectors):
+        page = metadata.get("page")
+        rows.append({
+            "vector": vector,
+            "id": str(uuid.uuid4()),
+            "text": text,
+            "metadata": dict(metadata, project=name),
+            "project": name,
+            "project_dir": abspath,
+            "chapter": metadata.get("chapter") or "",
+            "page": page if isinstance(page, int) else -1,
+        })
+    return rows
+
+
+def _sub_vectors(dim):
+    """PQ sub-vectors: the divisor of dim closest to dim / 16 (16-d sub-vectors)."""
+    return min((n for n in range(1, dim + 1) if dim % n == 0), key=lambda n: abs(n - dim / 16))
+
+
+def ensure_table_indexes(table, compact=False):
+    """
+    A bitmap index on project (every per-project search and delete filters
+    on it), an IVF-PQ vector index once the table reaches
+    ANN_INDEX_MIN_ROWS, and an optimize() when many rows were added since;
+    each is checked on its own, so the first ingest of a large corpus gets
+    both indexes at once. compact=True optimizes anyway, to merge the small fragments a streamed
+    ingest leaves behind (one per batch). Call it holding _write_lock.
+    """
+    # another project may have written since this handle was opened, and an
+    # index build or delete against an old version conflicts with a compaction
+    table.checkout_latest()
+    indices = {tuple(i.columns): i.name for i in table.list_indices()}
+    if ("project",) not in indices:
+        table.create_scalar_index("project", index_type="BITMAP")
+    if ("vector",) not in indices:
+        rows = table.count_rows()
+        if rows >= ANN_INDEX_MIN_ROWS:
+            start = time.time()
+            dim = table.schema.field("vector").type.list_size
+            table.create_index(
+                metric="l2", num_partitions=max(1, int(rows ** 0.5)), num_sub_vectors=_sub_vectors(dim),
+                index_type="IVF_PQ",
+            )
+            print(f"Built an IVF-PQ index over {rows} chunks ({time.time() - start:.1f}s)")
+    # (an index built just now covers every row, so its count is 0)
+    names = [i.name for i in table.list_indices()]
+    if names:
+        unindexed = max(table.index_stats(name).num_unindexed_rows for name in names)
+        compact = compact or unindexed >= OPTIMIZE_UNINDEXED_ROWS
+    if compact:
+        table.optimize()
+
+
+def _append_rows(connection, name, rows):
+    if name in connection.table_names():
+        table = connection.open_table(name)
+        table.add(rows)
+    else:
+        table = connection.create_table(name, data=rows)
+    return table
+
+
+def ingest_batch_size(dim):
+    """Chunks per batch for vectors of dim floats (see INGEST_BATCH)."""
+    # chunk text and metadata, plus each vector as a list of Python floats,
+    # its cached float64 bytes and its float32 copy in the table write
+    per_chunk = CHUNK_SIZE * 4 + 2048 + dim * 44
+    return max(1, min(INGEST_BATCH, INGEST_MEMORY_MB * 2 ** 20 // (2 * per_chunk)))
+
+
+def ingest_chunks(chunks, embedding, write):
+    """
+    Embeds a stream of chunks batch by batch and passes each batch to
+    write(texts, metadatas, vectors). A batch is written in the background
+    while the next one is split and embedded, but only one write is ever
+    pending: a slow table holds back splitting instead of letting batches
+    queue up. Returns the number of chunks.
+    """
+    chunks = iter(chunks)
+    size = ingest_batch_size(ASSUMED_VECTOR_DIM)
+    total = 0
+    metrics = get_metrics()
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        pending = None
+        while True:
+            # range first: zip stops on it without taking a chunk
+            batch = [doc for _, doc in zip(range(size), chunks)]
+            if not batch:
+                break
+            texts = [doc.page_content for doc in batch]
+            metadatas = [chunk_metadata(doc) for doc in batch]
+            del batch
+            # includes embedding the new chunks, also reported as "embed"
+            with metrics.stage("index"):
+                vectors = embedding.embed_documents(texts)
+                if pending is not None:
+                    pending.result()
+            pending = writer.submit(write, texts, metadatas, vectors)
+            total += len(texts)
+            size = ingest_batch_size(len(vectors[0]))
+            del texts, metadatas, vectors
+        if pending is not None:
+            with metrics.stage("index"):
+                pending.result()
+    return total
+
+
+def build_throwaway_index(directory, embedding, uri, pdf_workers=1, pool=None, tables=None):
+    """
+    Streams a project folder's PDFs into a private LanceDB table under uri,
+    for projects that are not kept in the shared index (e.g. uploads in the
+    UI). Returns a LanceDB vectorstore, or None if there is nothing to index.
+    """
+    pdf_files = sorted(glob.glob(os.path.join(directory, "*.pdf")))
+    if not pdf_files:
+        print(f"No PDF files found in {directory}")
+        return None
+    connection = lancedb.connect(uri)
+    name = shared_table_name(_model_name(embedding))
+    chunks = iter_indexed_splits(pdf_files, "Chunks", workers=pdf_workers, pool=pool, tables=tables)
+    written = ingest_chunks(
+        chunks, embedding,
+        lambda texts, metadatas, vectors: _append_rows(
+            connection, name, _chunk_rows(directory, texts, metadatas, vectors)
+        ),
+    )
+    if not written:
+        return None
+    return LanceDB(connection=connection, embedding=embedding, table_name=name, mode="append")
+
+
+def drop_project_index(directory):
+    """Removes a project's chunks from the shared table and its index folder."""
+    index_dir = project_index_dir(directory)
+    with project_lock(directory):
+        manifest = load_manifest(index_dir)
+        if manifest is not None:
+            connection = lancedb.connect(shared_db_dir())
+            name = shared_table_name(manifest["settings"]["embedding_model"])
+            if name in connection.table_names():
+                with _write_lock:
+                    connection.open_table(name).delete(project_filter(directory))
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+###############################################################################
+# 3. PERSISTENT PROJECT INDEX
+###############################################################################
+def project_lock(directory):
+    """The lock that serializes opening and dropping one project's index."""
+    key = os.path.abspath(directory)
+    with _project_locks_guard:
+        return _project_locks.setdefault(key, threading.RLock())
+
+
+def open_project_index(directory, embedding=None, pdf_workers=1, pool=None):
+    """
+    Brings one project folder's chunks in the shared LanceDB table up to
+    date with the PDFs currently in that folder.
+
+    Only chunks belonging to added, changed or deleted PDFs are inserted or
+    removed; an unchanged project is opened straight from disk. With chunk
+    deduplication on (see dedup.py) duplicates can span files, so a change
+    also re-indexes the unchanged PDFs whose kept chunks or their
+    also_in / chapter change with it. New chunks are
+    streamed in: split, embedded and appended batch by batch (see
+    ingest_chunks), so memory stays flat however many pages a project has.
+    Table rows parsed from each PDF are kept on its manifest entry (see
+    project_table_rows). Returns a LanceDB vectorstore over the shared
+    table (search it with project_filter(directory)), or None if the folder
+    has no PDFs. Runs on the same folder take turns (see project_lock).
+    """
+    with project_lock(directory):
+        return _open_project_index(directory, embedding, pdf_workers, pool)
+
+
+def _open_project_index(directory, embedding, pdf_workers, pool):
+    pdf_files = sorted(glob.glob(os.path.join(directory, "*.pdf")))
+    if not pdf_files:
+        return None
+    if embedding is None:
+        embedding = get_embeddings()
+
+    start = time.time()
+    index_dir = project_index_dir(directory)
+    os.makedirs(index_dir, exist_ok=True)
+    settings = index_settings(embedding)
+    manifest = load_manifest(index_dir)
+    scope = project_filter(directory)
+    legacy_dir = os.path.join(index_dir, "lancedb")
+    if os.path.isdir(legacy_dir):
+        # the project's own table from before the shared one
+        shutil.rmtree(legacy_dir, ignore_errors=True)
+
+    connection = lancedb.connect(shared_db_dir())
+    vectorstore = open_shared_index(embedding, connection=connection)
+    table_name = shared_table_name(settings["embedding_model"])
+    table = vectorstore.get_table()
+
+    if manifest is None or manifest.get("settings") != settings or table is None:
+        # first run, or settings changed: start over from none of this
+        # project's chunks, in whichever model's table they were
+        old_model = (manifest or {}).get("settings", {}).get("embedding_model", settings["embedding_model"])
+        old_name = shared_table_name(old_model)
+        if old_name in connection.table_names():
+            with _write_lock:
+                connection.open_table(old_name).delete(scope)
+        known_files = {}
+    else:
+        known_files = manifest["files"]
+
+    entries, changed, removed = diff_pdfs(pdf_files, known_files)
+
+    # a kept chunk stands in for its copies in other PDFs, so a change can
+    # alter which chunks of an unchanged PDF are kept, or their also_in /
+    # chapter. A first dedup pass over the whole project (cheap from the
+    # page cache) gives each PDF a digest of that; the unchanged PDFs whose
+    # digest moved are re-indexed along with the changed ones.
+    to_index = changed
+    dedup = None
+    table_rows = []
+    if dedup_settings() and (changed or removed):
+        dedup = find_duplicates(
+            pdf_files, f"Index for {directory}", workers=pdf_workers, pool=pool, tables=table_rows
+        )
+        digests = dedup.file_digests()
+        moved = set()
+        for name, entry in entries.items():
+            if entry.get("dedup") != digests.get(name):
+                entry.update(chunks=0, tables=[], dedup=digests.get(name))
+                moved.add(name)
+        to_index = [p for p in pdf_files if p in changed or os.path.basename(p) in moved]
+    # new files too: an interrupted run may have written some of their chunks
+    stale = removed + [os.path.basename(p) for p in to_index]
+    # (after a reset all of the project's chunks were deleted above)
+    if stale and known_files and table is not None:
+        with get_metrics().stage("index"), _write_lock:
+            table.checkout_latest()
+            table.delete(f"{scope} AND metadata.source IN ({sql_list(stale)})")
+
+    writes = 0
+    if to_index:
+        chunks = iter_indexed_splits(
+            to_index, f"Index for {directory}", workers=pdf_workers, pool=pool,
+            tables=table_rows, dedup=dedup,
+        )
+
+        def write(texts, metadatas, vectors):
+            nonlocal table, writes
+            writes += 1
+            for meta in metadatas:
+                entries[meta["source"]]["chunks"] += 1
+            rows = _chunk_rows(directory, texts, metadatas, vectors)
+            with _write_lock:
+                table = _append_rows(connection, table_name, rows)
+
+        ingest_chunks(chunks, embedding, write)
+        indexed = {os.path.basename(p) for p in to_index}
+        for row in table_rows:
+            if row["source"] in indexed:
+                entries[row["source"]]["tables"].append(row)
+    if table is not None and (to_index or stale):
+        with get_metrics().stage("index"), _write_lock:
+            ensure_table_indexes(table, compact=writes > 1)
+
+    save_manifest(index_dir, {"settings": settings, "files": entries})
+
+    elapsed = time.time() - start
+    if changed or removed:
+        shared = len(to_index) - len(changed)
+        shared = f" ({shared} unchanged, sharing duplicates with a change)" if shared else ""
+        print(
+            f"Index for {directory}: {len(to_index)} PDF(s) (re)indexed{shared}, "
+            f"{len(removed)} removed, {len(pdf_files) - len(to_index)} unchanged ({elapsed:.2f}s)"
+        )
+    else:
+        print(f"Index for {directory} is up to date ({elapsed * 1000:.0f} ms)")
+    return vectorstore
+
+
+def index_fingerprint(directory, embedding):
+    """
+    Identifies the state open_project_index would bring a project to: the
+    index settings plus the name, size and mtime of every PDF. Callers that
+    keep opened indexes in memory can reuse one while this is unchanged.
+    """
+    files = tuple(
+        (os.path.basename(p), os.stat(p).st_size, os.stat(p).st_mtime)
+        for p in sorted(glob.glob(os.path.join(directory, "*.pdf")))
+    )
+    return os.path.abspath(directory), json.dumps(index_settings(embedding), sort_keys=True), files
+
+
+def project_table_rows(directory):
+    """Table rows parsed from a project's PDFs when they were last indexed."""
+    manifest = load_manifest(project_index_dir(directory)) or {"files": {}}
+    return [row for entry in manifest["files"].values() for row in entry.get("tables", [])]
+
+
+def open_project_bm25(directory, vectorstore):
+    """
+    The keyword index over a project's chunks in the shared table. It is
+    stored in the project's index folder and tagged with project_version of
+    the manifest it was built from; any insert or delete of the project's
+    chunks changes that, so a stale index is rebuilt from the table.
+    """
+    table = vectorstore.get_table()
+    if table is None:
+        return None
+    index_dir = project_index_dir(directory)
+    version = project_version(load_manifest(index_dir))
+    path = os.path.join(index_dir, BM25_NAME)
+    if os.path.exists(path):
+        try:
+            index = BM25Index.load(path)
+            if index.version == version:
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable keyword index {path}: {e}")
+    start = time.time()
+    with get_metrics().stage("index"):
+        index = BM25Index.from_table(table, where=project_filter(directory), version=version)
+        index.save(path)
+    print(f"Keyword index for {directory}: {len(index)} chunks ({time.time() - start:.2f}s)")
+    return index
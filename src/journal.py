@@ -0,0 +1,129 @@
+# src/journal.py
+
+from .libraries import os, json, threading, time
+from .cache import CACHE_DIR, content_key
+from .results_store import new_run_id
+
+
+JOURNAL_DIR = os.path.join(CACHE_DIR, "journals")
+
+
+def journal_path(directory):
+    """One journal per input directory, named after it plus a path hash."""
+    abspath = os.path.abspath(directory)
+    name = os.path.basename(os.path.normpath(abspath)) or "root"
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+    return os.path.join(JOURNAL_DIR, f"{safe}-{content_key(abspath)[:12]}.jsonl")
+
+
+class RunJournal:
+    """
+    Append-only record of a batch run, one JSON object per line:
+
+        {"type": "start", "settings": {...}, "run_id": ...}
+        {"type": "index", "project": ..., "seconds": ...}
+        {"type": "row", "project": ..., "component": ..., "row": {...}}
+        {"type": "done", "project": ..., "output": ...}
+
+    Rows are written as each value is recorded, so a run that dies part way
+    loses at most the calls in flight. With resume=True an existing journal
+    whose settings match is continued; otherwise it is started over. A torn
+    last line from a crash is ignored. A resumed run keeps the run id it
+    started with, so its results land under one id in the results store.
+    """
+
+    def __init__(self, path, settings, resume=False):
+        self.path = path
+        self.settings = settings
+        self._lock = threading.Lock()
+        self.rows = {}      # project -> {component: row}
+        self.indexed = set()
+        self.outputs = {}   # project -> output of the finished project
+        self.resumed = False
+        self.run_id = None
+
+        records = self._read() if resume else []
+        if records and records[0].get("type") == "start" and records[0].get("settings") == settings:
+            self.resumed = True
+            self.run_id = records[0].get("run_id")
+            for record in records[1:]:
+                self._apply(record)
+        elif resume and records:
+            print(f"Run settings changed since {path} was written; starting over.")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, "a" if self.resumed else "w", encoding="utf-8")
+        if self.resumed and not self._ends_with_newline():
+            self._file.write("\n")  # fence off a torn last line
+        self.run_id = self.run_id or new_run_id()
+        if not self.resumed:
+            self._write({"type": "start", "settings": settings, "run_id": self.run_id, "time": time.time()})
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _apply(self, record):
+        kind = record.get("type")
+        if kind == "row":
+            self.rows.setdefault(record["project"], {})[record["component"]] = record["row"]
+        elif kind == "index":
+            self.indexed.add(record["project"])
+        elif kind == "done":
+            self.outputs[record["project"]] = record["output"]
+
+    def _write(self, record, sync=False):
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+            self._apply(record)
+
+    @staticmethod
+    def _key(project):
+        return os.path.abspath(project)
+
+    def project_rows(self, project):
+        """{component: row} recorded for project so far."""
+        with self._lock:
+            return {c: dict(r) for c, r in self.rows.get(self._key(project), {}).items()}
+
+    def output(self, project):
+        return self.outputs.get(self._key(project))
+
+    def record_index(self, project, seconds):
+        self._write({"type": "index", "project": self._key(project), "seconds": round(seconds, 3)})
+
+    def record_row(self, project, component, row):
+        self._write({"type": "row", "project": self._key(project), "component": component, "row": row})
+
+    def record_done(self, project, output):
+        self._write({"type": "done", "project": self._key(project), "output": output}, sync=True)
+
+    def summary(self):
+        values = sum(
+            1 for rows in self.rows.values() for row in rows.values()
+            for action in ("No Action", "With Action") if row.get(action, 0) != 0
+        )
+        return f"{len(self.outputs)} project(s) finished, {len(self.indexed)} indexed, {values} values recorded"
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -1,19 +1,101 @@
-import os, re, glob
-from collections import defaultdict
+import os, re, glob, json, hashlib, mmap, shutil, sqlite3, threading, time, uuid, multiprocessing, tempfile, traceback
+import cProfile, pstats, importlib, zlib
+from collections import defaultdict, deque
+from contextlib import nullcontext, contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-import pandas as pd
-from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+from dotenv import load_dotenv, find_dotenv
 
-import streamlit as st
-import nest_asyncio
+# Cheap, and needed at import time for subclassing / retry policies
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from tenacity import Retrying, stop_after_attempt, wait_random_exponential, retry_if_exception
 
-from dotenv import load_dotenv, find_dotenv
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import LanceDB
+###############################################################################
+# LAZY IMPORTS
+###############################################################################
+# The heavy libraries below (OpenAI + LangChain, LanceDB, pandas, pyarrow,
+# openpyxl, Streamlit) take seconds to import. They are bound here to
+# stand-ins that import the real thing on first use, so `run.py --help`,
+# short CLI runs and spawned PDF workers only pay for what they touch, and
+# the CLI never imports Streamlit at all.
+class LazyModule:
+    """Stands in for a module until one of its attributes is first used."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+class LazyObject:
+    """Stands in for a class or function until it is first called or inspected."""
+
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+        self._object = None
+
+    def _load(self):
+        if self._object is None:
+            self._object = getattr(importlib.import_module(self._module), self._name)
+        return self._object
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return f"<lazy {self._module}.{self._name}>"
+
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+pa = LazyModule("pyarrow")
+pq = LazyModule("pyarrow.parquet")
+pads = LazyModule("pyarrow.dataset")
+Workbook = LazyObject("openpyxl", "Workbook")
+
+st = LazyModule("streamlit")
+
+pypdf = LazyModule("pypdf")
+tiktoken = LazyModule("tiktoken")
+openai = LazyModule("openai")
+lancedb = LazyModule("lancedb")
+PyPDFLoader = LazyObject("langchain_community.document_loaders", "PyPDFLoader")
+RecursiveCharacterTextSplitter = LazyObject("langchain_text_splitters", "RecursiveCharacterTextSplitter")
+ChatOpenAI = LazyObject("langchain_openai", "ChatOpenAI")
+OpenAIEmbeddings = LazyObject("langchain_openai", "OpenAIEmbeddings")
+LanceDB = LazyObject("langchain_community.vectorstores", "LanceDB")
+Observer = LazyObject("watchdog.observers", "Observer")
+
+
+_nest_asyncio_applied = False
+
 
-# ensure async compatibility
-nest_asyncio.apply()
+def apply_nest_asyncio():
+    """
+    Lets code that runs its own event loop work inside one that is already
+    running (Streamlit's). Only the UI needs it, so it is applied there
+    rather than on import.
+    """
+    global _nest_asyncio_applied
+    if not _nest_asyncio_applied:
+        import nest_asyncio
+        nest_asyncio.apply()
+        _nest_asyncio_applied = True
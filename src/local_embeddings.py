@@ -0,0 +1,70 @@
+# src/local_embeddings.py
+
+from .libraries import os, zlib, np, Embeddings
+from .bm25 import tokenize
+from .metrics import get_metrics
+
+
+# Dimensions of the local vectors. More dimensions mean fewer hash
+# collisions between terms at the cost of a larger index.
+LOCAL_EMBEDDING_SIZE = int(os.getenv("EDI_LOCAL_EMBEDDING_SIZE", "1024"))
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Offline embeddings computed on the CPU, for runs without network access
+    or an OpenAI key (get_embeddings(backend="local")).
+
+    Each text's word tokens (bm25.tokenize: lowercased, stopwords dropped)
+    and adjacent token pairs are hashed into size signed buckets, weighted
+    by 1 + log(term frequency) and L2-normalized, so nearest neighbours are
+    the chunks sharing the most distinctive terms with the question.
+
+    A vector depends only on its own text. Unlike a fitted TF-IDF or SVD
+    model nothing has to be refit when a project's corpus changes, so
+    indexes are still updated incrementally and every project shares one
+    vector space.
+    """
+
+    # computed faster than it could be read back from the embedding cache,
+    # and never rate limited (see cache.get_embeddings)
+    local = True
+
+    def __init__(self, size=LOCAL_EMBEDDING_SIZE, bigrams=True):
+        self.size = size
+        self.bigrams = bigrams
+        self.model = f"hashing-{size}{'-bigrams' if bigrams else ''}-v1"
+        self.model_name = self.model
+        self.limiter = None
+
+    def _features(self, text):
+        tokens = tokenize(text)
+        if self.bigrams:
+            tokens += [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        return tokens
+
+    def _vector(self, text):
+        vector = np.zeros(self.size, dtype=np.float64)
+        features = self._features(text)
+        if not features:
+            return vector
+        hashes, counts = np.unique(
+            np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features)),
+            return_counts=True,
+        )
+        # low bits pick the bucket, the top bit the sign, so collisions
+        # cancel out on average instead of piling up
+        signs = np.where(hashes >> 31, -1.0, 1.0)
+        np.add.at(vector, hashes % self.size, signs * (1.0 + np.log(counts)))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts):
+        with get_metrics().stage("embed"):
+            return [self._vector(text).tolist() for text in texts]
+
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,258 @@
+# src/metrics.py
+
+from .libraries import os, json, threading, time, contextmanager, cProfile, pstats
+
+
+# Pipeline stages, in the order they happen for a project.
+STAGES = ("parse", "split", "dedup", "embed", "index", "retrieval", "llm", "extraction", "excel")
+
+UNSCOPED = "(none)"
+
+_scope = threading.local()
+
+
+###############################################################################
+# 1. PROJECT SCOPE
+###############################################################################
+@contextmanager
+def project_scope(project):
+    """
+    Attributes everything recorded on this thread to project. Work handed to
+    other threads (query pools, PDF processes) passes the project explicitly.
+    """
+    previous = getattr(_scope, "project", None)
+    _scope.project = project
+    try:
+        yield
+    finally:
+        _scope.project = previous
+
+
+def current_project():
+    return getattr(_scope, "project", None) or UNSCOPED
+
+
+@contextmanager
+def metrics_scope(metrics):
+    """
+    Records everything on this thread into metrics (a Metrics) instead of
+    the process-wide registry, so runs side by side (two UI sessions) keep
+    their own numbers. None keeps the thread's current registry. Threads
+    that work for the run enter the same scope (see run_projects).
+    """
+    previous = getattr(_scope, "metrics", None)
+    if metrics is not None:
+        _scope.metrics = metrics
+    try:
+        yield
+    finally:
+        _scope.metrics = previous
+
+
+###############################################################################
+# 2. METRICS REGISTRY
+###############################################################################
+class Metrics:
+    """
+    Wall time per (project, stage) and counters per (project, component).
+
+    Counter names are free-form (prompt_tokens, llm_calls,
+    embedding_cache_hits, ...); the exporters turn each one into a metric.
+    Stages can nest: "index" includes the embedding of new chunks, which is
+    also reported on its own as "embed". Thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.run_id = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        self.stages = {}    # (project, stage) -> [calls, seconds]
+        self.counters = {}  # (name, project, component) -> value
+
+    def add_time(self, stage, seconds, project=None, calls=1):
+        key = (project or current_project(), stage)
+        with self._lock:
+            entry = self.stages.setdefault(key, [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+
+    @contextmanager
+    def stage(self, stage, project=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, project=project)
+
+    def count(self, name, value=1, project=None, component=""):
+        if not value:
+            return
+        key = (name, project or current_project(), component)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def report(self):
+        """Everything recorded so far as a JSON-ready dict."""
+        with self._lock:
+            stages = dict(self.stages)
+            counters = dict(self.counters)
+
+        projects = {}
+        for (project, stage), (calls, seconds) in stages.items():
+            entry = projects.setdefault(project, {"stages": {}, "components": {}, "totals": {}})
+            entry["stages"][stage] = {"calls": calls, "seconds": round(seconds, 4)}
+        for (name, project, component), value in counters.items():
+            entry = projects.setdefault(project, {"stages": {}, "components": {}, "totals": {}})
+            if component:
+                entry["components"].setdefault(component, {})[name] = value
+            entry["totals"][name] = entry["totals"].get(name, 0) + value
+
+        for entry in projects.values():
+            totals = entry["totals"]
+            entry["cache_hit_rates"] = {
+                cache: _rate(totals.get(f"{cache}_cache_hits", 0), totals.get(f"{cache}_cache_misses", 0))
+                for cache in ("embedding", "response")
+            }
+            for values in entry["components"].values():
+                values["response_cache_hit_rate"] = _rate(
+                    values.get("response_cache_hits", 0), values.get("response_cache_misses", 0)
+                )
+
+        stage_totals = {}
+        for (project, stage), (calls, seconds) in stages.items():
+            total = stage_totals.setdefault(stage, {"calls": 0, "seconds": 0.0})
+            total["calls"] += calls
+            total["seconds"] = round(total["seconds"] + seconds, 4)
+
+        return {
+            "run_id": self.run_id,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "elapsed_seconds": round(time.time() - self.started, 3),
+            "stages": stage_totals,
+            "projects": projects,
+        }
+
+    def prometheus_text(self):
+        """The same data in the Prometheus text exposition format."""
+        with self._lock:
+            stages = dict(self.stages)
+            counters = dict(self.counters)
+
+        lines = [
+            "# HELP edi_run_duration_seconds Wall time of the run so far.",
+            "# TYPE edi_run_duration_seconds gauge",
+            f"edi_run_duration_seconds {time.time() - self.started:.3f}",
+            "# HELP edi_stage_seconds_total Wall time spent in each pipeline stage.",
+            "# TYPE edi_stage_seconds_total counter",
+        ]
+        for (project, stage), (calls, seconds) in sorted(stages.items()):
+            lines.append(f"edi_stage_seconds_total{_labels(project=project, stage=stage)} {seconds:.6f}")
+        lines += [
+            "# HELP edi_stage_calls_total Times each pipeline stage ran.",
+            "# TYPE edi_stage_calls_total counter",
+        ]
+        for (project, stage), (calls, seconds) in sorted(stages.items()):
+            lines.append(f"edi_stage_calls_total{_labels(project=project, stage=stage)} {calls}")
+
+        for name in sorted({key[0] for key in counters}):
+            metric = f"edi_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, project, component), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"{metric}{_labels(project=project, component=component)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self, directory):
+        """
+        Writes run-<run id>.json and edi.prom (overwritten each run, for a
+        node_exporter textfile collector) into directory. Returns both paths.
+        """
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, f"run-{self.run_id}.json")
+        prom_path = os.path.join(directory, "edi.prom")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        tmp_path = prom_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, prom_path)
+        return json_path, prom_path
+
+
+def _rate(hits, misses):
+    return round(hits / (hits + misses), 4) if hits + misses else None
+
+
+def _labels(**labels):
+    parts = []
+    for name, value in labels.items():
+        if value:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """The registry of the run this thread works for (see metrics_scope)."""
+    scoped = getattr(_scope, "metrics", None)
+    return scoped if scoped is not None else _metrics
+
+
+def reset_metrics():
+    """Starts a fresh process-wide run (e.g. each CLI run or watch update)."""
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def format_stage_summary(report):
+    """One line per stage, in pipeline order, for the end of a CLI run."""
+    lines = [f"Run {report['run_id']}: {report['elapsed_seconds']:.1f}s"]
+    for stage in STAGES:
+        total = report["stages"].get(stage)
+        if total:
+            lines.append(f"  {stage:<11} {total['seconds']:9.2f}s  ({total['calls']} calls)")
+    return "\n".join(lines)
+
+
+###############################################################################
+# 3. PROFILING
+###############################################################################
+# cProfile only sees the thread that enabled it, and the pipeline runs on
+# project and query threads, so each of those gets its own profiler while
+# profiling is on and they are merged at the end.
+_profiling = False
+_profiles = []
+_profiles_lock = threading.Lock()
+
+
+def enable_thread_profiling():
+    global _profiling
+    _profiling = True
+
+
+@contextmanager
+def profiled_thread():
+    if not _profiling:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _profiles_lock:
+            _profiles.append(profiler)
+
+
+def merged_profile(main_profiler):
+    """pstats.Stats over the main thread plus every profiled worker thread."""
+    stats = pstats.Stats(main_profiler)
+    with _profiles_lock:
+        for profiler in _profiles:
+            stats.add(profiler)
+    return stats
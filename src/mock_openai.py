@@ -0,0 +1,227 @@
+# src/mock_openai.py
+"""
+A local stand-in for the OpenAI chat and embeddings endpoints that enforces
+its own rate limits, for exercising the rate limiter (src/ratelimit.py)
+without an account:
+
+    python -m src.mock_openai --rpm 60 --tpm 40000 --port 8765
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test python run.py --cli documents
+
+Requests over the per-minute budgets get a 429 with retry-after and
+x-ratelimit-* headers like the real API; --fail-rate adds random 429s and
+--error-rate random 500s. GET /stats returns the request counts.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Budget:
+    """Requests and tokens per minute, refilled continuously like the real API."""
+
+    def __init__(self, rpm, tpm):
+        self.limits = {"requests": rpm, "tokens": tpm}
+        self.levels = {"requests": float(rpm), "tokens": float(tpm)}
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, tokens):
+        """Returns (allowed, headers)."""
+        with self.lock:
+            now = time.monotonic()
+            for name, limit in self.limits.items():
+                self.levels[name] = min(limit, self.levels[name] + (now - self.updated) * limit / 60)
+            self.updated = now
+            wanted = {"requests": 1, "tokens": tokens}
+            allowed = all(self.levels[n] >= min(wanted[n], self.limits[n]) for n in self.limits)
+            if allowed:
+                for name in self.limits:
+                    self.levels[name] -= min(wanted[name], self.limits[name])
+            headers = {}
+            for name, limit in self.limits.items():
+                missing = max(0.0, min(wanted[name], limit) - self.levels[name])
+                headers[f"x-ratelimit-limit-{name}"] = str(limit)
+                headers[f"x-ratelimit-remaining-{name}"] = str(max(0, int(self.levels[name])))
+                headers[f"x-ratelimit-reset-{name}"] = f"{missing * 60 / limit:.3f}s"
+            return allowed, headers
+
+
+def estimate_tokens(payload):
+    if "messages" in payload:
+        text = "".join(str(m.get("content") or "") for m in payload["messages"])
+        return len(text) // 4 + int(payload.get("max_tokens") or 0)
+    inputs = payload.get("input") or []
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    return sum(len(i) if isinstance(i, list) else len(i) // 4 for i in inputs)
+
+
+def fake_vector(item, size=64):
+    digest = hashlib.sha256(json.dumps(item).encode("utf-8")).digest()
+    values = [b - 127.5 for b in (digest * math.ceil(size / len(digest)))[:size]]
+    norm = math.sqrt(sum(v * v for v in values))
+    return [v / norm for v in values]
+
+
+def chat_response(payload, prompt_tokens):
+    message = {"role": "assistant", "content": "Value not found"}
+    finish_reason = "stop"
+    tools = payload.get("tools") or []
+    if tools:
+        # structured output via function calling: every field left empty
+        function = tools[0]["function"]
+        arguments = {
+            name: {"value": None, "unit": ""}
+            for name in function.get("parameters", {}).get("properties", {})
+        }
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": "call_mock",
+                "type": "function",
+                "function": {"name": function["name"], "arguments": json.dumps(arguments)},
+            }],
+        }
+        finish_reason = "tool_calls"
+    completion_tokens = 5
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "mock"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def embeddings_response(payload, tokens):
+    inputs = payload.get("input") or []
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    return {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": fake_vector(item)} for i, item in enumerate(inputs)],
+        "model": payload.get("model", "mock"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+def make_handler(args):
+    budgets = {
+        "chat": Budget(args.rpm, args.tpm),
+        "embeddings": Budget(args.embedding_rpm, args.embedding_tpm),
+    }
+    stats = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "max_in_flight": 0}
+    in_flight = [0]
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *log_args):
+            if args.verbose:
+                super().log_message(format, *log_args)
+
+        def _send(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                with lock:
+                    self._send(200, dict(stats))
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if self.path.endswith("/chat/completions"):
+                kind = "chat"
+            elif self.path.endswith("/embeddings"):
+                kind = "embeddings"
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            tokens = estimate_tokens(payload)
+            with lock:
+                stats["requests"] += 1
+                in_flight[0] += 1
+                stats["max_in_flight"] = max(stats["max_in_flight"], in_flight[0])
+            try:
+                allowed, headers = budgets[kind].take(tokens)
+                if allowed and random.random() < args.fail_rate:
+                    allowed = False
+                if not allowed:
+                    with lock:
+                        stats["rate_limited"] += 1
+                    wait = max(parse_seconds(headers["x-ratelimit-reset-requests"]),
+                               parse_seconds(headers["x-ratelimit-reset-tokens"]))
+                    headers["retry-after"] = f"{max(wait, 0.1):.3f}"
+                    self._send(429, {"error": {
+                        "message": f"Rate limit reached for {kind} (mock)",
+                        "type": "requests", "code": "rate_limit_exceeded", "param": None,
+                    }}, headers)
+                    return
+                if random.random() < args.error_rate:
+                    with lock:
+                        stats["errors"] += 1
+                    self._send(500, {"error": {"message": "mock server error", "type": "server_error"}})
+                    return
+                time.sleep(args.latency)
+                body = chat_response(payload, tokens) if kind == "chat" else embeddings_response(payload, tokens)
+                with lock:
+                    stats["ok"] += 1
+                self._send(200, body, headers)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+    return Handler, stats
+
+
+def parse_seconds(text):
+    return float(text.rstrip("s"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate-limited mock of the OpenAI chat and embeddings API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rpm", type=int, default=60, help="Chat requests per minute.")
+    parser.add_argument("--tpm", type=int, default=60000, help="Chat tokens per minute.")
+    parser.add_argument("--embedding-rpm", type=int, default=300)
+    parser.add_argument("--embedding-tpm", type=int, default=1000000)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per successful request.")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with a random 429.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500.")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    args = parser.parse_args()
+
+    handler, stats = make_handler(args)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Mock OpenAI API on http://{args.host}:{args.port}/v1 (chat {args.rpm} rpm / {args.tpm} tpm)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Mock OpenAI API stats: {json.dumps(stats)}")
+
+
+if __name__ == "__main__":
+    main()
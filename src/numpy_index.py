@@ -0,0 +1,169 @@
+# src/numpy_index.py
+
+from .libraries import os, uuid, np, Document, VectorStore
+
+
+# Which index answers the vector searches: "numpy" keeps every chunk vector
+# in memory and scores them by matrix multiply, "lancedb" searches the
+# LanceDB table, "auto" uses NumPy for projects of at most
+# NUMPY_INDEX_MAX_CHUNKS chunks (about 120 MB of 1536-d vectors) and
+# LanceDB above that.
+VECTOR_INDEXES = ("auto", "numpy", "lancedb")
+DEFAULT_VECTOR_INDEX = os.getenv("EDI_VECTOR_INDEX", "auto")
+NUMPY_INDEX_MAX_CHUNKS = int(os.getenv("EDI_NUMPY_INDEX_MAX_CHUNKS", "20000"))
+
+# Queries scored per matrix multiply, which bounds the score matrix to
+# QUERY_BATCH × chunks floats.
+QUERY_BATCH = 64
+
+
+def _unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Exact in-memory vector index for small projects: all chunk vectors as
+    one float32 matrix of unit rows. A batch of query vectors is scored
+    with one matrix multiply and the top k of each row is picked with
+    argpartition, so there is no per-query overhead and no approximate
+    index to build. Ranks by cosine similarity, which is the same order as
+    LanceDB's L2 distance for normalized embeddings.
+
+    Chunk ids and metadata follow the LanceDB rows it was loaded from (see
+    from_lancedb), so a BM25 index built over those rows applies unchanged.
+    """
+
+    def __init__(self, embedding, ids, texts, metadatas, vectors, limit=4):
+        self._embedding = embedding
+        self.ids = list(ids)
+        self.texts = list(texts)
+        self.metadatas = [dict(m or {}) for m in metadatas]
+        self.limit = limit
+        self.matrix = _unit_rows(vectors) if len(vectors) else np.zeros((0, 0), dtype=np.float32)
+        self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self._chapters = [str(m.get("chapter") or "").lower() for m in self.metadatas]
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = embedding.embed_documents(texts) if texts else []
+        return cls(embedding, ids, texts, metadatas, vectors, **kwargs)
+
+    @classmethod
+    def from_lancedb(cls, vectorstore, where=None):
+        """
+        Loads the rows of a LanceDB vectorstore's table into memory: all of
+        them, or those matching the SQL filter where (e.g. one project's).
+        """
+        table = vectorstore.get_table()
+        columns = ["id", "text", "metadata", "vector"]
+        if where is None:
+            data = table.to_arrow().select(columns)
+        else:
+            data = table.search().where(where).select(columns).limit(max(table.count_rows(where), 1)).to_arrow()
+        column = data.column("vector").combine_chunks()
+        vectors = column.flatten().to_numpy(zero_copy_only=False).reshape(len(data), -1)
+        return cls(
+            vectorstore.embeddings,
+            data.column("id").to_pylist(),
+            data.column("text").to_pylist(),
+            data.column("metadata").to_pylist(),
+            vectors,
+            limit=vectorstore.limit,
+        )
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = _unit_rows(self._embedding.embed_documents(texts))
+        self.matrix = vectors if not len(self.matrix) else np.vstack([self.matrix, vectors])
+        for doc_id, text, metadata in zip(ids, texts, metadatas):
+            self.positions[doc_id] = len(self.ids)
+            self.ids.append(doc_id)
+            self.texts.append(text)
+            self.metadatas.append(dict(metadata or {}))
+            self._chapters.append(str(self.metadatas[-1].get("chapter") or "").lower())
+        return ids
+
+    def chapter_rows(self, chapters):
+        """Positions of the chunks whose chapter contains any of the lowercase keywords."""
+        return np.fromiter(
+            (i for i, chapter in enumerate(self._chapters) if any(kw in chapter for kw in chapters)),
+            dtype=np.int64,
+        )
+
+    def search_ids(self, vectors, k, chapters=None):
+        """
+        Ids of the k most similar chunks for each query vector, best first.
+        chapters (lowercase keywords, see processing.chapter_keywords) limits
+        the search to the chunks of those chapters.
+        """
+        queries = _unit_rows(vectors)
+        rows = self.chapter_rows(chapters) if chapters is not None else None
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        k = min(k, len(matrix))
+        if k == 0:
+            return [[] for _ in range(len(queries))]
+        results = []
+        for start in range(0, len(queries), QUERY_BATCH):
+            scores = queries[start:start + QUERY_BATCH] @ matrix.T
+            if k < scores.shape[1]:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+            for positions in np.take_along_axis(top, order, axis=1):
+                if rows is not None:
+                    positions = rows[positions]
+                results.append([self.ids[p] for p in positions])
+        return results
+
+    def ids_in_chapters(self, chapters):
+        return {self.ids[p] for p in self.chapter_rows(chapters)}
+
+    def documents(self, ids):
+        return [
+            Document(page_content=self.texts[self.positions[i]], metadata=dict(self.metadatas[self.positions[i]]))
+            for i in ids
+        ]
+
+    def similarity_search_by_vector(self, embedding, k=None, **kwargs):
+        return self.documents(self.search_ids([embedding], k or self.limit)[0])
+
+    def similarity_search(self, query, k=None, **kwargs):
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k=k)
+
+
+def use_numpy_index(vector_index, chunks):
+    """Whether a project of chunks chunks is searched with NumpyVectorStore."""
+    if vector_index not in VECTOR_INDEXES:
+        raise ValueError(f"Unknown vector index '{vector_index}' (choose from {', '.join(VECTOR_INDEXES)})")
+    return vector_index == "numpy" or (vector_index == "auto" and chunks <= NUMPY_INDEX_MAX_CHUNKS)
+
+
+def searchable_index(vectorstore, vector_index=DEFAULT_VECTOR_INDEX, where=None):
+    """
+    The index to search a persistent LanceDB vectorstore with (see
+    VECTOR_INDEXES); where narrows it to one project of the shared table.
+    """
+    if use_numpy_index(vector_index, vectorstore.get_table().count_rows(where)):
+        return NumpyVectorStore.from_lancedb(vectorstore, where=where)
+    return vectorstore
@@ -0,0 +1,122 @@
+# src/pagecache.py
+
+from .libraries import os, mmap, threading, np
+from .cache import CACHE_DIR, file_sha256
+
+
+# Parsed page text, one entry per distinct PDF (by content hash):
+#   <sha256>.txt  all pages' text, UTF-8, back to back
+#   <sha256>.npy  int64 byte offsets, page i is txt[offsets[i]:offsets[i + 1]]
+# Both are memory-mapped when read, so a page costs only its own bytes.
+PAGE_CACHE_DIR = os.path.join(CACHE_DIR, "pages")
+
+# Bump when the text extraction changes so cached text is not reused.
+PAGE_TEXT_VERSION = 1
+
+_lock = threading.Lock()
+_hashes = {}  # (path, size, mtime) -> sha256, so a file is hashed once per process
+
+
+def pdf_key(pdf_file):
+    """Cache key of a PDF: its content hash, memoized on size and mtime."""
+    stat = os.stat(pdf_file)
+    memo = (os.path.abspath(pdf_file), stat.st_size, stat.st_mtime)
+    with _lock:
+        sha = _hashes.get(memo)
+    if sha is None:
+        sha = file_sha256(pdf_file)
+        with _lock:
+            _hashes[memo] = sha
+    return f"{sha}-v{PAGE_TEXT_VERSION}"
+
+
+def _paths(key):
+    base = os.path.join(PAGE_CACHE_DIR, key)
+    return base + ".txt", base + ".npy"
+
+
+class PageText:
+    """Read-only, memory-mapped page text of one cached PDF."""
+
+    def __init__(self, key):
+        text_path, offsets_path = _paths(key)
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self._file = open(text_path, "rb")
+        # mmap can't map an empty file (a PDF without any text)
+        size = os.fstat(self._file.fileno()).st_size
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def page(self, i):
+        return self._blob[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def close(self):
+        if not isinstance(self._blob, bytes):
+            self._blob.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_pages(key):
+    """PageText for key, or None if that PDF has not been parsed yet."""
+    text_path, offsets_path = _paths(key)
+    if not os.path.exists(offsets_path) or not os.path.exists(text_path):
+        return None
+    try:
+        return PageText(key)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable page cache entry {key}: {e}")
+        return None
+
+
+def cached_page_count(key):
+    """Number of pages cached for key, or None; reads only the offsets header."""
+    offsets_path = _paths(key)[1]
+    if not os.path.exists(offsets_path):
+        return None
+    try:
+        return len(np.load(offsets_path, mmap_mode="r")) - 1
+    except (OSError, ValueError):
+        return None
+
+
+class PageWriter:
+    """
+    Writes one PDF's cache entry a few pages at a time, so a long PDF is
+    cached while it is parsed without holding all of its text. Only the
+    offsets stay in memory; commit() moves both files into place, the
+    offsets file last, which marks the entry complete.
+    """
+
+    def __init__(self, key):
+        os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+        self.text_path, self.offsets_path = _paths(key)
+        self.suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self.text_path + self.suffix, "wb")
+        self._offsets = [0]
+
+    def add(self, pages):
+        for page in pages:
+            encoded = page.encode("utf-8")
+            self._file.write(encoded)
+            self._offsets.append(self._offsets[-1] + len(encoded))
+
+    def commit(self):
+        self._file.close()
+        with open(self.offsets_path + self.suffix, "wb") as f:
+            np.save(f, np.asarray(self._offsets, dtype=np.int64))
+        os.replace(self.text_path + self.suffix, self.text_path)
+        os.replace(self.offsets_path + self.suffix, self.offsets_path)
+
+    def discard(self):
+        self._file.close()
+        for path in (self.text_path + self.suffix, self.offsets_path + self.suffix):
+            if os.path.exists(path):
+                os.remove(path)
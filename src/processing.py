@@ -1,16 +1,36 @@
 # src/processing.py
 
-from .libraries import os, re, glob, pd, defaultdict, Workbook, dataframe_to_rows, st
-from .libraries import PyPDFLoader, RecursiveCharacterTextSplitter
+from .libraries import os, re, glob, json, np, pd, defaultdict, deque, Workbook
+from .libraries import threading, time, lancedb, ThreadPoolExecutor
+from .libraries import pypdf, multiprocessing, ProcessPoolExecutor, Document, RecursiveCharacterTextSplitter
 from .libraries import ChatOpenAI, OpenAIEmbeddings, LanceDB
+from .cache import get_embeddings, get_embedding_cache, CACHE_DIR, DEFAULT_EMBEDDING_BACKEND
+from .cache import get_response_cache, response_cache_enabled, llm_cache_key, content_key
 from .prompts import (
     rag_fusion_with_no_action,
     rag_fusion_with_action,
     rag_with_no_action,
     rag_with_action,
     component_units_map,
+    category_chapter_keywords,
+    component_table_labels,
 )
-from langchain.schema import HumanMessage  # wns everything related to constructing and sending prompts and not general utilities so NOT libraries.py
+from .tables import extract_table_rows
+from .pagecache import pdf_key, open_pages, cached_page_count, PageWriter
+from .dedup import DEDUP_ENABLED, Deduplicator, deduplicate, format_dedup_stats
+from .metrics import get_metrics, reset_metrics, metrics_scope, profiled_thread, format_stage_summary
+from .ratelimit import limited_call, make_chat_model, COMPLETION_TOKEN_RESERVE
+from .bm25 import reciprocal_rank_fusion, CANDIDATE_FACTOR
+from .numpy_index import NumpyVectorStore, use_numpy_index, DEFAULT_VECTOR_INDEX
+from .results_store import RESULTS_DIR, get_results_store, export_run
+from .context import (
+    assemble_context,
+    format_token_stats,
+    count_tokens,
+    CONTEXT_TOKEN_BUDGET,
+    BATCH_CONTEXT_TOKEN_BUDGET,
+)
+from langchain_core.messages import HumanMessage  # wns everything related to constructing and sending prompts and not general utilities so NOT libraries.py
 
 
 ###############################################################################
@@ -37,58 +57,557 @@ def cleanup_generated_files(directory_path):
 ###############################################################################
 # 3. LOADING, SPLITTING, VECTORSTORE
 ###############################################################################
-def load_and_split_pdfs_from_directory(directory_path):
-    all_splits = []
+# Splitter settings. They are recorded in each persistent index manifest, so
+# changing them here makes the next run rebuild the affected indexes.
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Large PDFs are cut into page ranges of this size so one long chapter can be
+# parsed by several worker processes at once.
+PAGES_PER_TASK = 8
+DEFAULT_PDF_WORKERS = min(4, os.cpu_count() or 1)
+
+# Page ranges parsed ahead of the consumer, per PDF worker (see iter_pdf_splits).
+PARSE_PREFETCH = 2
+
+_text_splitter = None
+
+
+def _get_text_splitter():
+    # one splitter per process, reused for every file and page range
+    global _text_splitter
+    if _text_splitter is None:
+        _text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return _text_splitter
+
+
+def _extract_page_texts(pdf_file, start, stop, key):
+    """
+    Text of pages [start, stop): from the page cache entry key if given,
+    otherwise (or if the entry can't be read) parsed the way PyPDFLoader
+    does it (pypdf "plain" mode, stripped).
+    """
+    pages = open_pages(key) if key else None
+    if pages is not None:
+        with pages:
+            return [pages.page(page) for page in range(start, stop)]
+    reader = pypdf.PdfReader(pdf_file)
+    return [reader.pages[page].extract_text(extraction_mode="plain").strip() for page in range(start, stop)]
+
+
+def _load_and_split_page_range(task):
+    """
+    Reads pages [start, stop) of one PDF and splits them into chunks, one
+    Document per page. The splitter never crosses page boundaries, so
+    splitting a page range gives the same chunks as splitting the whole
+    file. Runs inside worker processes, hence the single argument.
+    The page text is also scanned for No-Action / With-Action tables while
+    it is at hand. Returns (chunks, table rows, (parse seconds, split
+    seconds), parsed texts): key names the page cache entry to read instead
+    of parsing; without one the parsed page texts come back for the cache.
+    """
+    pdf_file, start, stop, key = task
+    parse_start = time.perf_counter()
+    texts = _extract_page_texts(pdf_file, start, stop, key)
+    docs = [
+        Document(page_content=text, metadata={"source": pdf_file, "page": page})
+        for page, text in zip(range(start, stop), texts)
+    ]
+    table_rows = []
+    for doc in docs:
+        table_rows.extend(
+            extract_table_rows(doc.page_content, os.path.basename(pdf_file), doc.metadata["page"])
+        )
+    split_start = time.perf_counter()
+    splits = _get_text_splitter().split_documents(docs)
+    timings = (split_start - parse_start, time.perf_counter() - split_start)
+    return splits, table_rows, timings, texts if key is None else None
+
+
+def make_pdf_pool(workers):
+    # spawn rather than fork: the parent may already be running LanceDB and
+    # HTTP client threads, and spawn is what Windows uses anyway
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def iter_pdf_splits(pdf_files, workers=1, pool=None, tables=None, report=True):
+    """
+    Parses and splits the given PDFs lazily, yielding chunks in file order,
+    then page order, so the result does not depend on the worker count.
+    With workers > 1 the page ranges are spread over a process pool; pass
+    an existing pool to share one set of worker processes between
+    projects. Pass a list as tables to collect the parsed table rows as
+    well, and report=False on a second pass over the same PDFs so their
+    page cache hits are not counted twice.
+
+    At most PARSE_PREFETCH page ranges per worker are parsed ahead of the
+    consumer: a new range is only handed to the pool when the oldest one is
+    taken, so a slow consumer (embedding, say) holds back parsing instead
+    of letting parsed chunks pile up.
+
+    Page text is kept in the page cache (see pagecache.py) by file hash, so
+    a PDF is only parsed by pypdf once; later runs, chunk size changes and
+    index rebuilds re-split the cached text.
+    """
+    tasks = []
+    keys = {}
+    page_counts = {}
+    for pdf_file in pdf_files:
+        key = pdf_key(pdf_file)
+        page_count = cached_page_count(key)
+        if page_count is None:
+            # every range of this PDF is parsed, so the cache entry comes out whole
+            keys[pdf_file] = key
+            page_count = len(pypdf.PdfReader(pdf_file).pages)
+        page_counts[pdf_file] = page_count
+        cached_key = None if pdf_file in keys else key
+        for start in range(0, page_count, PAGES_PER_TASK):
+            tasks.append((pdf_file, start, min(start + PAGES_PER_TASK, page_count), cached_key))
+
+    metrics = get_metrics()
+    cached = len(pdf_files) - len(keys)
+    if report:
+        metrics.count("page_cache_hits", cached)
+        metrics.count("page_cache_misses", len(keys))
+    if report and cached:
+        print(f"Page text of {cached} of {len(pdf_files)} PDF(s) read from the page cache")
+
+    # only parsing is worth a worker process; cached text is split right
+    # here while the pool parses
+    to_parse = sum(1 for task in tasks if task[3] is None)
+    own_pool = None
+    if pool is None and workers > 1 and to_parse > 1:
+        pool = own_pool = make_pdf_pool(min(workers, to_parse))
+    elif to_parse <= 1:
+        pool = None
+
+    def submit(task):
+        if pool is None or task[3] is not None:
+            return None
+        return pool.submit(_load_and_split_page_range, task)
+
+    remaining = iter(tasks)
+    # range first: zip stops on it without taking a task from remaining
+    pending = deque((task, submit(task)) for _, task in zip(range(PARSE_PREFETCH * max(workers, 1)), remaining))
+    writers = {}
+    try:
+        while pending:
+            task, future = pending.popleft()
+            result = future.result() if future is not None else _load_and_split_page_range(task)
+            following = next(remaining, None)
+            if following is not None:
+                pending.append((following, submit(following)))
+            splits, table_rows, (parse_seconds, split_seconds), texts = result
+            if tables is not None:
+                tables.extend(table_rows)
+            pdf_file = task[0]
+            if pdf_file in keys:
+                # ranges come back in page order, so the entry is written front to back
+                if pdf_file not in writers:
+                    writers[pdf_file] = PageWriter(keys[pdf_file])
+                writers[pdf_file].add(texts)
+                if task[2] == page_counts[pdf_file]:
+                    writers.pop(pdf_file).commit()
+            # CPU time summed over workers, so it can exceed the wall time
+            metrics.add_time("parse", parse_seconds)
+            metrics.add_time("split", split_seconds)
+            yield from splits
+    finally:
+        for _, future in pending:
+            if future is not None:
+                future.cancel()
+        for writer in writers.values():
+            writer.discard()
+        if own_pool is not None:
+            own_pool.shutdown(cancel_futures=True)
+
+
+def load_and_split_pdfs(pdf_files, workers=1, pool=None, tables=None):
+    """All chunks of the given PDFs as one list (see iter_pdf_splits)."""
+    return list(iter_pdf_splits(pdf_files, workers=workers, pool=pool, tables=tables))
+
+
+def load_and_split_pdfs_from_directory(directory_path, workers=1, pool=None, tables=None):
     pdf_files = glob.glob(os.path.join(directory_path, "*.pdf"))
     if not pdf_files:
-        st.error(f"No PDF files found in {directory_path}")
+        print(f"No PDF files found in {directory_path}")
         return []
-    for pdf_file in pdf_files:
-        loader = PyPDFLoader(pdf_file)
-        docs = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        splits = text_splitter.split_documents(docs)
-        all_splits.extend(splits)
-    return all_splits
+    return load_and_split_pdfs(pdf_files, workers=workers, pool=pool, tables=tables)
+
+
+# FEIS chapters are published as e.g. "21DCP180Q_FEIS_11_Solid Waste and Sanitation Services.pdf"
+CHAPTER_PATTERN = re.compile(r"_FEIS_(\d+)_\s*(.+?)\.pdf$", re.IGNORECASE)
+
+
+def detect_chapter(pdf_file):
+    """
+    Chapter title from an FEIS file name ("Solid Waste and Sanitation
+    Services"). Files that don't follow the naming scheme fall back to their
+    file name without extension.
+    """
+    name = os.path.basename(pdf_file)
+    match = CHAPTER_PATTERN.search(name)
+    if match:
+        return match.group(2).strip()
+    return os.path.splitext(name)[0].replace("_", " ").strip()
 
 
-def create_vectorstore(splits):
-    # collect just the text and the page number metadata
+def chunk_metadata(doc):
+    """
+    The metadata kept in the index for each chunk: page, source file and
+    chapter, plus where deduplication found copies of it (see dedup.py).
+    """
+    source = doc.metadata.get("source", "")
+    return {
+        "page": doc.metadata.get("page", "N/A"),
+        "source": os.path.basename(source),
+        "chapter": doc.metadata.get("chapter") or detect_chapter(source),
+        "also_in": "; ".join(doc.metadata.get("also_in", [])),
+    }
+
+
+def deduplicate_splits(splits, label):
+    """Drops duplicate chunks before they are embedded (EDI_DEDUP=0 keeps them all)."""
+    if not DEDUP_ENABLED or not splits:
+        return splits
+    with get_metrics().stage("dedup"):
+        kept, stats = deduplicate(splits, chapter=detect_chapter)
+    get_metrics().count("chunks_deduplicated", stats["chunks"] - stats["kept"])
+    print(f"{label}: {format_dedup_stats(stats)}")
+    return kept
+
+
+def find_duplicates(pdf_files, label, workers=1, pool=None, tables=None):
+    """
+    The first pass of iter_indexed_splits on its own: splits pdf_files and
+    returns the Deduplicator that has seen all their chunks (None with
+    deduplication off).
+    """
+    if not DEDUP_ENABLED:
+        return None
+    dedup = Deduplicator(chapter=detect_chapter)
+    seconds = 0.0
+    for doc in iter_pdf_splits(pdf_files, workers=workers, pool=pool, tables=tables):
+        start = time.perf_counter()
+        dedup.add(doc)
+        seconds += time.perf_counter() - start
+    get_metrics().add_time("dedup", seconds)
+    stats = dedup.stats
+    get_metrics().count("chunks_deduplicated", stats["chunks"] - stats["kept"])
+    if stats["chunks"]:
+        print(f"{label}: {format_dedup_stats(stats)}")
+    return dedup
+
+
+def iter_indexed_splits(pdf_files, label, workers=1, pool=None, tables=None, dedup=None):
+    """
+    Streams the chunks of pdf_files that go into an index (see
+    iter_pdf_splits). With deduplication on, the PDFs are split twice: a
+    first pass finds the duplicates, keeping only their hashes, and a
+    second pass over the page cache yields the kept chunks with their final
+    also_in / chapter metadata. Neither pass holds chunk text. Passing
+    dedup, a find_duplicates result over these PDFs and possibly others,
+    skips the first pass (and tables is then not filled).
+    """
+    if not DEDUP_ENABLED:
+        yield from iter_pdf_splits(pdf_files, workers=workers, pool=pool, tables=tables)
+        return
+    if dedup is None:
+        dedup = find_duplicates(pdf_files, label, workers=workers, pool=pool, tables=tables)
+    yield from dedup.kept(iter_pdf_splits(pdf_files, workers=workers, pool=pool, report=False))
+
+
+def create_vectorstore(splits, embedding=None, uri="/tmp/lancedb", vector_index="lancedb"):
+    splits = deduplicate_splits(splits, "Chunks")
+    # collect the text plus page / source file / chapter metadata
     texts = [doc.page_content for doc in splits]
-    metadatas = [{"page": doc.metadata.get("page", "N/A")} for doc in splits]
+    metadatas = [chunk_metadata(doc) for doc in splits]
+    # chunks already embedded on an earlier run come from the on-disk cache
+    if embedding is None:
+        embedding = get_embeddings()
+    # small projects: search in memory, no table to write at all
+    if use_numpy_index(vector_index, len(texts)):
+        return NumpyVectorStore.from_texts(texts, embedding=embedding, metadatas=metadatas)
     # build the LanceDB index on those texts + metadata
     return LanceDB.from_texts(
         texts,
-        embedding=OpenAIEmbeddings(),
+        embedding=embedding,
         metadatas=metadatas,
+        connection=lancedb.connect(uri),
     )
 
 
+def format_cache_stats(name, stats):
+    return f"{name} cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries"
+
+
 ###############################################################################
 # 4. RAG QUERY (Modified to return page numbers for terminal logging)
 ###############################################################################
-def rag_query(query, vectorstore, llm):
-    retriever = vectorstore.as_retriever()
-    documents = retriever.get_relevant_documents(query)
-    context_parts = []
-    pages = []
-    for doc in documents:
-        page = doc.metadata.get("page", "N/A")
+# Search settings for tables with an IVF-PQ index (see indexing.py): IVF
+# partitions probed per query, and how many times k candidates are
+# re-ranked by exact distance. Exact searches ignore them.
+ANN_NPROBES = int(os.getenv("EDI_ANN_NPROBES", "20"))
+ANN_REFINE_FACTOR = int(os.getenv("EDI_ANN_REFINE_FACTOR", "5"))
+
+
+def chapter_keywords(category):
+    """Lowercase keywords of the chapter titles a prompt category is routed to, or None."""
+    keywords = category_chapter_keywords.get(category)
+    return [kw.lower() for kw in keywords] if keywords else None
+
+
+def chapter_filter(category):
+    """
+    SQL filter limiting a prompt category's retrieval to its FEIS chapters,
+    e.g. "SolidWaste" → chapters whose title contains "solid waste". None
+    means the category has no routing rule and searches every chunk.
+    """
+    keywords = chapter_keywords(category)
+    if not keywords:
+        return None
+    clauses = [
+        "lower(metadata.chapter) LIKE '%" + kw.replace("'", "''") + "%'"
+        for kw in keywords
+    ]
+    return " OR ".join(clauses)
+
+
+def sql_and(*filters):
+    """The given SQL filters (None skipped) joined with AND, or None."""
+    filters = [f for f in filters if f]
+    if len(filters) <= 1:
+        return filters[0] if filters else None
+    return " AND ".join(f"({f})" for f in filters)
+
+
+def routing_filter(vectorstore, category, project_filter=None):
+    """
+    chapter_filter for a LanceDB store, chapter_keywords for a
+    NumpyVectorStore; None if the category or store can't be routed.
+    Also None when no chunk (of the project_filter projects) matches, so
+    the caller searches everything.
+    """
+    if isinstance(vectorstore, NumpyVectorStore):
+        where = chapter_keywords(category)
+        return where if where is not None and len(vectorstore.chapter_rows(where)) else None
+    table = vectorstore.get_table() if hasattr(vectorstore, "get_table") else None
+    where = chapter_filter(category)
+    if where is None or table is None or not table.count_rows(sql_and(project_filter, where)):
+        return None
+    return where
+
+
+def retrieve_routed(jobs, vectorstore, k=None, bm25=None, project_filter=None):
+    """
+    Retrieval for the question jobs, with each prompt category searched only
+    within its relevant chapters (see chapter_filter). Questions whose routed
+    search finds nothing, e.g. a project without that chapter or an index
+    built without chapter metadata, fall back to a search over all chunks.
+    project_filter limits every search to some projects of the shared table
+    (see retrieve_batch). Returns {question: documents}.
+    """
+    by_category = {}
+    for job in jobs:
+        by_category.setdefault(job[0], []).append(job[2])
+
+    documents_by_question = {}
+    unrouted = []
+    for category, questions in by_category.items():
+        where = routing_filter(vectorstore, category, project_filter)
+        if where is None:
+            unrouted.extend(questions)
+            continue
         try:
-            page = str(int(page))
-        except Exception:
-            page = "N/A"
-        pages.append(page)
-        context_parts.append(f"Page {page}:\n{doc.page_content}")
-    context = "\n\n".join(context_parts)
+            routed = retrieve_batch(
+                questions, vectorstore, k=k, where=where, bm25=bm25, project_filter=project_filter
+            )
+        except Exception as e:
+            print(f"Chapter routing failed for {category}, searching all chunks: {e}")
+            routed = [[] for _ in questions]
+        for question, docs in zip(questions, routed):
+            if docs:
+                documents_by_question[question] = docs
+            else:
+                unrouted.append(question)
+
+    unrouted = list(dict.fromkeys(unrouted))
+    documents_by_question.update(zip(
+        unrouted, retrieve_batch(unrouted, vectorstore, k=k, bm25=bm25, project_filter=project_filter)
+    ))
+    return documents_by_question
+
+
+def retrieve_batch(queries, vectorstore, k=None, where=None, bm25=None, project_filter=None):
+    """
+    Top-k chunks for many queries at once: the query embeddings come from one
+    (cached) batched request and the LanceDB table is searched once with all
+    query vectors. Returns one document list per query, matching what the
+    default retriever would return for each query on its own. where is an
+    optional filter applied before the vector search (see routing_filter).
+    A NumpyVectorStore scores the whole batch with one matrix multiply.
+
+    project_filter (see indexing.project_filter / projects_filter) is a SQL
+    filter on the project columns of the shared table, ANDed with where and
+    pushed down into the LanceDB search; the project scalar index keeps it
+    cheap however many projects share the table. A NumpyVectorStore holds a
+    single project's chunks and ignores it. Once the table has an IVF-PQ
+    index the search probes ANN_NPROBES partitions and re-ranks
+    ANN_REFINE_FACTOR × the candidates by exact distance.
+
+    With a bm25 index (see bm25.py) the search is hybrid: each retriever
+    proposes k * CANDIDATE_FACTOR chunks, the two rankings are merged with
+    reciprocal rank fusion and the top k of the fused list are returned.
+    """
+    if not queries:
+        return []
+    if not hasattr(vectorstore, "get_table") and not isinstance(vectorstore, NumpyVectorStore):
+        retriever = vectorstore.as_retriever()
+        if where is not None or project_filter is not None:
+            return [[] for _ in queries]  # can't filter: let the caller fall back
+        return [retriever.get_relevant_documents(q) for q in queries]
+
+    k = k or vectorstore.limit
+    hybrid = bm25 is not None and len(bm25) > 0
+    embedding = vectorstore.embeddings
+    unique = list(dict.fromkeys(queries))
+    if hasattr(embedding, "embed_queries"):
+        vectors = embedding.embed_queries(unique)
+    else:
+        vectors = [embedding.embed_query(q) for q in unique]
+
+    if isinstance(vectorstore, NumpyVectorStore):
+        ids_by_query = vectorstore.search_ids(vectors, k * CANDIDATE_FACTOR if hybrid else k, chapters=where)
+        if hybrid:
+            allowed = vectorstore.ids_in_chapters(where) if where is not None else None
+            ids_by_query = [
+                reciprocal_rank_fusion([ids, bm25.search(q, k * CANDIDATE_FACTOR, allowed=allowed)])[:k]
+                for q, ids in zip(unique, ids_by_query)
+            ]
+        docs_by_query = {q: vectorstore.documents(ids) for q, ids in zip(unique, ids_by_query)}
+        return [docs_by_query[q] for q in queries]
+
+    table = vectorstore.get_table()
+    where = sql_and(project_filter, where)
+    search = (
+        table.search(np.asarray(vectors)).limit(k * CANDIDATE_FACTOR if hybrid else k)
+        .nprobes(ANN_NPROBES).refine_factor(ANN_REFINE_FACTOR)
+    )
+    if where is not None:
+        search = search.where(where, prefilter=True)
+    results = search.to_arrow()
+    if "query_index" in results.schema.names:
+        query_index = results.column("query_index").to_pylist()
+    else:
+        query_index = [0] * len(results)  # single query: no index column
+    distances = results.column("_distance").to_pylist()
+
+    rows_by_query = [[] for _ in unique]
+    for row in sorted(range(len(results)), key=lambda i: (query_index[i], distances[i])):
+        rows_by_query[query_index[row]].append(row)
+
+    if hybrid:
+        rows_by_query, results = _fuse_with_bm25(unique, rows_by_query, results, table, bm25, k, where)
+
+    docs_by_query = {
+        q: vectorstore.results_to_docs(results.take(rows)) for q, rows in zip(unique, rows_by_query)
+    }
+    return [docs_by_query[q] for q in queries]
+
+
+def _fuse_with_bm25(queries, rows_by_query, results, table, bm25, k, where):
+    """RRF of the vector rows and BM25 hits; returns (rows_by_query, rows table)."""
+    allowed = None
+    if where is not None:
+        # the same filter as the vector search, evaluated by LanceDB
+        allowed = set(
+            table.search().where(where).select(["id"]).limit(max(len(bm25), 1))
+            .to_arrow().column("id").to_pylist()
+        )
+    result_ids = results.column("id").to_pylist()
+    fused = []
+    for query, rows in zip(queries, rows_by_query):
+        vector_ids = [result_ids[r] for r in rows]
+        keyword_ids = bm25.search(query, k * CANDIDATE_FACTOR, allowed=allowed)
+        fused.append(reciprocal_rank_fusion([vector_ids, keyword_ids])[:k])
+
+    # one lookup for every fused chunk, whichever retriever found it
+    wanted = list(dict.fromkeys(doc_id for ids in fused for doc_id in ids))
+    if not wanted:
+        return [[] for _ in queries], results
+    rows = (
+        table.search().where(f"id IN ({sql_list(wanted)})")
+        .select(["id", "text", "metadata"]).limit(len(wanted)).to_arrow()
+    )
+    position = {doc_id: i for i, doc_id in enumerate(rows.column("id").to_pylist())}
+    return [[position[i] for i in ids if i in position] for ids in fused], rows
+
+
+def use_response_cache(response_cache=None):
+    """Whether to use the LLM response cache: response_cache, or the process-wide setting if None."""
+    return response_cache_enabled() if response_cache is None else response_cache
+
+
+def sql_list(values):
+    """Quoted, comma-separated SQL literals for an IN (...) clause."""
+    return ", ".join("'" + str(v).replace("'", "''") + "'" for v in values)
+
+
+def rag_query(query, vectorstore, llm, limiter=None, documents=None, max_tokens=CONTEXT_TOKEN_BUDGET,
+              project_filter=None, response_cache=None):
+    """
+    Answers one question from its retrieved chunks, assembled into at most
+    max_tokens of context (see context.assemble_context). project_filter
+    limits retrieval from the shared table to some projects, e.g.
+    indexing.projects_filter(["Innovation QNS"]); without it a shared-table
+    vectorstore (indexing.open_shared_index) answers across all projects.
+    response_cache turns the LLM response cache on or off for this call;
+    None follows set_response_cache_enabled.
+    Returns (answer, context, pages, stats): stats has the context token
+    counts, whether the answer came from the response cache and, for live
+    calls, llm_seconds, prompt_tokens and completion_tokens.
+    """
+    # documents can be passed in when retrieval was already done in a batch
+    if documents is None:
+        documents = retrieve_batch([query], vectorstore, project_filter=project_filter)[0]
+    context, pages, token_stats = assemble_context(documents, max_tokens)
 
     # wrap your prompt in a HumanMessage
     messages = [
         HumanMessage(content=f"Context:\n{context}\n\nQuestion: {query}\nAnswer:")
     ]
-    response = llm(messages)
+    # identical prompt + context + model settings → reuse the stored answer
+    cache = get_response_cache() if use_response_cache(response_cache) else None
+    key = llm_cache_key(llm, messages)
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        return cached.decode("utf-8"), context, pages, dict(token_stats, cached=True)
+
+    # limiter schedules chat calls across all projects (see ratelimit.py)
+    estimate = sum(count_tokens(m.content) for m in messages) + COMPLETION_TOKEN_RESERVE
+    start = time.perf_counter()
+    response = limited_call(limiter, "chat", estimate, llm, messages)
+    llm_seconds = time.perf_counter() - start
     # response is an AIMessage with .content
-    return response.content.strip(), context, pages
+    answer = response.content.strip()
+    if cache:
+        cache.set(key, answer.encode("utf-8"))
+    usage = llm_usage(response, messages, answer)
+    return answer, context, pages, dict(token_stats, cached=False, llm_seconds=llm_seconds, **usage)
+
+
+def llm_usage(response, messages, answer_text):
+    """
+    prompt_tokens / completion_tokens from the API's usage metadata, or
+    tiktoken estimates when the backend doesn't report them.
+    """
+    usage = getattr(response, "usage_metadata", None) or {}
+    if usage.get("input_tokens") is not None:
+        return {"prompt_tokens": usage["input_tokens"], "completion_tokens": usage.get("output_tokens", 0)}
+    return {
+        "prompt_tokens": sum(count_tokens(m.content) for m in messages),
+        "completion_tokens": count_tokens(answer_text),
+    }
 
 
 ###############################################################################
@@ -157,77 +676,410 @@ def extract_value_rag(text, component):
     return extract_numeric_value(text, component)
 
 
+###############################################################################
+# 6. BATCHED STRUCTURED ANSWERS (one LLM call per prompt category)
+###############################################################################
+def group_questions_by_category(jobs):
+    """
+    Groups question jobs by prompt category, No Action and With Action
+    together, keeping the prompt order within each group.
+    """
+    batches = {}
+    for job in jobs:
+        batches.setdefault(job[0], []).append(job)
+    return list(batches.items())
+
+
+def category_answer_schema(jobs):
+    """JSON schema with one {value, unit} slot per question, keyed q1..qN."""
+    properties = {}
+    for i, (category, component, question, action_label, use_fusion) in enumerate(jobs, 1):
+        properties[f"q{i}"] = {
+            "type": "object",
+            "description": f"{component} ({action_label})",
+            "properties": {
+                "value": {
+                    "type": ["number", "null"],
+                    "description": "The number asked for, or null if the context does not give it.",
+                },
+                "unit": {
+                    "type": "string",
+                    "description": "Unit of the value as stated in the context, e.g. units, GSF, tons, pounds.",
+                },
+            },
+            "required": ["value", "unit"],
+            "additionalProperties": False,
+        }
+    return {
+        "title": "category_answers",
+        "description": "One numeric answer per question.",
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def build_batch_prompt(context, jobs):
+    lines = [
+        f"Context:\n{context}\n",
+        "Answer each question below using only the context above. Follow the "
+        "instructions inside each question, but ignore its 'Format:' line: put the "
+        "number in the value field instead (no commas, no text) and use null when "
+        "the context does not contain it.\n",
+    ]
+    for i, (category, component, question, action_label, use_fusion) in enumerate(jobs, 1):
+        question_text = " ".join(question.split())
+        lines.append(f"q{i} - {component} ({action_label}): {question_text}")
+    return "\n".join(lines)
+
+
+def rag_query_batch(jobs, vectorstore, llm, limiter=None, documents_by_question=None,
+                    max_tokens=BATCH_CONTEXT_TOKEN_BUDGET, project_filter=None, k=None, bm25=None,
+                    response_cache=None):
+    """
+    Answers all questions of one category with a single structured LLM call.
+
+    Each question still does its own retrieval; the retrieved chunks are
+    interleaved by rank (every question's best chunk first) and assembled
+    into one shared context of at most max_tokens. Unless
+    documents_by_question was retrieved already, each question gets k
+    chunks, fused with the bm25 keyword index when one is given (see
+    retrieve_routed). response_cache is as in rag_query. Returns
+    ({"q1": {"value": ..., "unit": ...}, ...}, context, pages, stats) with
+    stats as in rag_query.
+    """
+    if documents_by_question is None:
+        documents_by_question = retrieve_routed(
+            jobs, vectorstore, k=k, bm25=bm25, project_filter=project_filter
+        )
+    ranked = [documents_by_question[job[2]] for job in jobs]
+    documents = []
+    seen = set()
+    for rank in range(max((len(docs) for docs in ranked), default=0)):
+        for docs in ranked:
+            if rank >= len(docs):
+                continue
+            doc = docs[rank]
+            doc_key = (doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content)
+            if doc_key not in seen:
+                seen.add(doc_key)
+                documents.append(doc)
+    context, pages, token_stats = assemble_context(documents, max_tokens)
+
+    schema = category_answer_schema(jobs)
+    messages = [HumanMessage(content=build_batch_prompt(context, jobs))]
+
+    cache = get_response_cache() if use_response_cache(response_cache) else None
+    key = content_key(llm_cache_key(llm, messages), json.dumps(schema, sort_keys=True))
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        return json.loads(cached.decode("utf-8")), context, pages, dict(token_stats, cached=True)
+
+    structured_llm = llm.with_structured_output(
+        schema, method="function_calling", strict=True, include_raw=True
+    )
+    estimate = sum(count_tokens(m.content) for m in messages) + COMPLETION_TOKEN_RESERVE
+    start = time.perf_counter()
+    result = limited_call(limiter, "chat", estimate, structured_llm.invoke, messages)
+    llm_seconds = time.perf_counter() - start
+    # include_raw keeps the AIMessage, whose usage metadata has the token counts
+    raw = None
+    if isinstance(result, dict) and "parsed" in result and "raw" in result:
+        if result.get("parsing_error"):
+            raise result["parsing_error"]
+        raw, answers = result["raw"], result["parsed"]
+    else:
+        answers = result
+    if cache:
+        cache.set(key, json.dumps(answers).encode("utf-8"))
+    usage = llm_usage(raw, messages, json.dumps(answers))
+    return answers, context, pages, dict(token_stats, cached=False, llm_seconds=llm_seconds, **usage)
+
+
+def structured_value(component, answer):
+    """
+    Turns one {value, unit} answer into the number stored in the results,
+    with the same pounds → tons rule as extract_numeric_value. Missing
+    answers come back as 0, which the caller records as "Value not found".
+    """
+    value = (answer or {}).get("value")
+    if value is None:
+        return 0
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        print(f"Non-numeric structured value for component '{component}': {value!r}")
+        return 0
+    unit = str(answer.get("unit") or "").lower()
+    if component.lower() == "greenhouse gas emissions" and ("pound" in unit or "lb" in unit):
+        return value / 2000
+    return value
+
+
 ###############################################################################
 # 7. PROCESSING ALL DICTIONARY-BASED QUESTIONS
 ###############################################################################
-def process_all_dictionary_questions(directory, vectorstore, llm):
+# Number of rag_query calls kept in flight at once. Each call is mostly network
+# wait (retrieval embedding + chat completion), so threads are enough here.
+DEFAULT_QUERY_WORKERS = 8
+
+RESULT_COLUMNS = ["Component", "No Action", "With Action", "Units", "No Action Pages", "With Action Pages"]
+
+_log_lock = threading.Lock()
+
+
+def iter_dictionary_questions():
+    """
+    Yields (category, component, question, action_label, use_fusion) for every prompt,
+    in the same order the four prompt dictionaries have always been processed.
     """
-    Build a DataFrame with columns: [Component, No Action, With Action, Units].
-    The 'No Action' and 'With Action' columns are numeric, 'Units' is text.
+    prompt_sets = [
+        (rag_fusion_with_no_action, "No Action", True),     # 1) RAG-Fusion No Action
+        (rag_fusion_with_action, "With Action", True),      # 2) RAG-Fusion With Action
+        (rag_with_no_action, "No Action", False),           # 3) Agentic RAG No Action
+        (rag_with_action, "With Action", False),            # 4) Agentic RAG With Action
+    ]
+    for prompt_dict, action_label, use_fusion in prompt_sets:
+        for category, list_of_dicts in prompt_dict.items():
+            for question_dict in list_of_dicts:
+                for component, question in question_dict.items():
+                    yield category, component, question, action_label, use_fusion
+
+
+def record_value(final_data, component, action_label, extracted_val, pages=None):
+    """pages are the "file.pdf p.N" sources of the context the value came from."""
+    if extracted_val == 0 or extracted_val == "0":
+        final_data[component][action_label] = "Value not found"
+        final_data[component][f"{action_label} Pages"] = ""
+    else:
+        final_data[component][action_label] = extracted_val
+        final_data[component][f"{action_label} Pages"] = "; ".join(dict.fromkeys(pages or []))
+
+    if not final_data[component]["Units"]:
+        final_data[component]["Units"] = component_units_map.get(component, "")
+
+
+def answer_from_tables(jobs, table_lookup, project_name, final_data):
     """
-    final_data = defaultdict(lambda: {"No Action": 0, "With Action": 0, "Units": ""})
+    Records every job a parsed table answers and returns the jobs that still
+    need the LLM, in their original order.
+    """
+    remaining = []
+    with _log_lock:
+        for job in jobs:
+            category, component, question, action_label, use_fusion = job
+            value, row = table_lookup.answer(component, action_label, component_table_labels)
+            if value is None:
+                remaining.append(job)
+                continue
+            print(
+                f"TABLE LOOKUP [{project_name}] {component} [{action_label}]: {value:,} "
+                f"(row '{row['label']}', {row['source']} page {row['page'] + 1})"
+            )
+            record_value(final_data, component, action_label, value,
+                         pages=[f"{row['source']} p.{row['page'] + 1}"])
+            get_metrics().count("table_answers", project=project_name, component=component)
+    if len(remaining) < len(jobs):
+        print(f"{len(jobs) - len(remaining)} of {len(jobs)} questions answered from tables for {project_name}")
+    return remaining
+
+
+def process_all_dictionary_questions(directory, vectorstore, llm, max_workers=1, limiter=None,
+                                     batched=False, table_lookup=None, bm25=None, top_k=None,
+                                     context_tokens=None, on_row=None, completed=None, project_filter=None,
+                                     response_cache=None):
+    """
+    Build a DataFrame with columns: [Component, No Action, With Action, Units,
+    No Action Pages, With Action Pages]. The 'No Action' and 'With Action'
+    columns are numeric, 'Units' is text and the page columns list the
+    "file.pdf p.N" sources of the context each value was read from.
+
+    With max_workers > 1 the rag_query calls run concurrently on a thread pool.
+    Results are still consumed in prompt order, so the logs for each query stay
+    grouped together and the DataFrame is identical to a sequential run.
+    limiter (a ratelimit.RateLimiter) is shared across projects and schedules
+    every LLM call against the account's rate limits.
+
+    With batched=True each prompt category (No Action and With Action
+    together) is answered by one structured-output call instead of one call
+    per component; see rag_query_batch.
 
-    def handle_query(component, question, action_label, use_fusion):
-        response, context, pages = rag_query(question, vectorstore, llm)
+    table_lookup (a tables.TableLookup) is consulted first: components it
+    answers with confidence are filled from the parsed table and never reach
+    the LLM. Misses and ambiguous rows fall through to the queries above.
+
+    bm25 (a bm25.BM25Index over the same chunks) turns on hybrid keyword +
+    vector retrieval; top_k overrides the number of chunks per question.
+    project_filter scopes retrieval from the shared table to this project
+    (indexing.project_filter).
+    context_tokens overrides the context token budget of each LLM call, and
+    response_cache turns the LLM response cache on or off (see rag_query).
+    Context token counts before and after assembly are logged per call and
+    totalled per project.
+
+    on_row(component, row) is called on the calling thread each time one of
+    a component's values is recorded, with a copy of its {No Action, With
+    Action, Units} row, so a UI can show results as they arrive.
+
+    completed ({component: row}, e.g. from an interrupted run's journal)
+    seeds the results; questions it already answers are skipped. In batched
+    mode a category is only skipped when all of its questions are answered,
+    so every batch asks the same questions as in an uninterrupted run.
+    """
+    final_data = defaultdict(empty_result_row)
+    jobs = list(iter_dictionary_questions())
+    project_name = os.path.basename(os.path.normpath(directory))
+
+    if completed:
+        for component, row in completed.items():
+            final_data[component] = dict(empty_result_row(), **row)
+
+        def answered(job):
+            return completed.get(job[1], {}).get(job[3], 0) != 0
+
+        if batched:
+            pending = {job[0] for job in jobs if not answered(job)}
+            jobs = [job for job in jobs if job[0] in pending]
+        else:
+            jobs = [job for job in jobs if not answered(job)]
+        print(f"Resuming {project_name}: {len(jobs)} questions left")
+
+    if table_lookup is not None and len(table_lookup):
+        remaining = answer_from_tables(jobs, table_lookup, project_name, final_data)
+        if on_row:
+            for component in dict.fromkeys(job[1] for job in jobs if job not in remaining):
+                on_row(component, dict(final_data[component]))
+        jobs = remaining
+
+    # every question's top-k chunks, batched per category and routed to the
+    # chapters that category is about
+    with get_metrics().stage("retrieval", project_name):
+        documents_by_question = retrieve_routed(
+            jobs, vectorstore, k=top_k, bm25=bm25, project_filter=project_filter
+        )
+
+    token_totals = {"chunks_before": 0, "chunks_after": 0, "tokens_before": 0, "tokens_after": 0}
+
+    def record(component, action_label, extracted_val, pages):
+        record_value(final_data, component, action_label, extracted_val, pages)
+        if on_row:
+            on_row(component, dict(final_data[component]))
+
+    metrics = get_metrics()
+
+    def record_call(stats, component):
+        for name in token_totals:
+            token_totals[name] += stats[name]
+        print(f"CONTEXT TOKENS: {format_token_stats(stats)}\n")
+        if stats["cached"]:
+            metrics.count("response_cache_hits", project=project_name, component=component)
+            return
+        metrics.count("response_cache_misses", project=project_name, component=component)
+        metrics.count("llm_calls", project=project_name, component=component)
+        metrics.count("prompt_tokens", stats["prompt_tokens"], project=project_name, component=component)
+        metrics.count(
+            "completion_tokens", stats["completion_tokens"], project=project_name, component=component
+        )
+        metrics.add_time("llm", stats["llm_seconds"], project=project_name)
+
+    def run_query(job):
+        category, component, question, action_label, use_fusion = job
+        return rag_query(
+            question, vectorstore, llm, limiter=limiter, documents=documents_by_question[question],
+            max_tokens=context_tokens or CONTEXT_TOKEN_BUDGET, response_cache=response_cache,
+        )
+
+    def handle_result(job, result):
+        # several projects may be logging at once, keep each query block whole
+        with _log_lock:
+            _handle_result(job, result)
+
+    def _handle_result(job, result):
+        category, component, question, action_label, use_fusion = job
+        response, context, pages, stats = result
         print("==========================================================")
+        print(f"PROJECT: {project_name}\n")
         print(f"COMPONENT: {component}\n")
         print(f"ACTION TYPE: {action_label}\n")
         print(f"QUERY:\n{question}\n")
         print(f"CONTEXT (first 500 chars):\n{context[:500]}...\n")
+        record_call(stats, component)
         print(f"RESPONSE:\n{response}")
 
-        if use_fusion:
-            extracted_val = extract_value_rag_fusion(response, component)
-        else:
-            extracted_val = extract_value_rag(response, component)
+        with metrics.stage("extraction", project_name):
+            if use_fusion:
+                extracted_val = extract_value_rag_fusion(response, component)
+            else:
+                extracted_val = extract_value_rag(response, component)
 
         print(f"EXTRACTED NUMERIC VALUE: {extracted_val}")
         print("==========================================================\n")
+        record(component, action_label, extracted_val, pages)
 
-        if extracted_val == 0 or extracted_val == "0":
-            final_data[component][action_label] = "Value not found"
-        else:
-            final_data[component][action_label] = extracted_val
-
-        if not final_data[component]["Units"]:
-            final_data[component]["Units"] = component_units_map.get(component, "")
-
-    # 1) RAG-Fusion No Action
-    for category, list_of_dicts in rag_fusion_with_no_action.items():
-        for question_dict in list_of_dicts:
-            for component, question in question_dict.items():
-                handle_query(component, question, "No Action", use_fusion=True)
-
-    # 2) RAG-Fusion With Action
-    for category, list_of_dicts in rag_fusion_with_action.items():
-        for question_dict in list_of_dicts:
-            for component, question in question_dict.items():
-                handle_query(component, question, "With Action", use_fusion=True)
-
-    # 3) Agentic RAG No Action
-    for category, list_of_dicts in rag_with_no_action.items():
-        for question_dict in list_of_dicts:
-            for component, question in question_dict.items():
-                handle_query(component, question, "No Action", use_fusion=False)
-
-    # 4) Agentic RAG With Action
-    for category, list_of_dicts in rag_with_action.items():
-        for question_dict in list_of_dicts:
-            for component, question in question_dict.items():
-                handle_query(component, question, "With Action", use_fusion=False)
-
-    # Build final DataFrame with columns: Component, No Action, With Action, Units
+    def run_batch(batch):
+        category, batch_jobs = batch
+        return rag_query_batch(
+            batch_jobs, vectorstore, llm, limiter=limiter, documents_by_question=documents_by_question,
+            max_tokens=context_tokens or BATCH_CONTEXT_TOKEN_BUDGET, response_cache=response_cache,
+        )
+
+    def handle_batch_result(batch, result):
+        with _log_lock:
+            _handle_batch_result(batch, result)
+
+    def _handle_batch_result(batch, result):
+        category, batch_jobs = batch
+        answers, context, pages, stats = result
+        print("==========================================================")
+        print(f"PROJECT: {project_name}\n")
+        print(f"CATEGORY: {category} ({len(batch_jobs)} questions, one call)\n")
+        print(f"CONTEXT (first 500 chars):\n{context[:500]}...\n")
+        record_call(stats, f"{category} (batch)")
+        for i, (_, component, question, action_label, use_fusion) in enumerate(batch_jobs, 1):
+            answer = answers.get(f"q{i}")
+            with metrics.stage("extraction", project_name):
+                extracted_val = structured_value(component, answer)
+            print(f"{component} [{action_label}]: {answer} -> {extracted_val}")
+            record(component, action_label, extracted_val, pages)
+        print("==========================================================\n")
+
+    if batched:
+        units, run, handle = group_questions_by_category(jobs), run_batch, handle_batch_result
+    else:
+        units, run, handle = jobs, run_query, handle_result
+
+    # Logging and extraction happen here on the calling thread, in prompt order,
+    # while the pool only does the I/O-bound retrieval + LLM calls.
+    if max_workers > 1:
+        def run_in_pool(unit):
+            with metrics_scope(metrics), profiled_thread():
+                return run(unit)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for unit, result in zip(units, pool.map(run_in_pool, units)):
+                handle(unit, result)
+    else:
+        for unit in units:
+            handle(unit, run(unit))
+    if token_totals["chunks_before"]:
+        print(f"Context for {project_name}: {format_token_stats(token_totals)}")
+    return results_dataframe(final_data)
+
+
+def empty_result_row():
+    return {"No Action": 0, "With Action": 0, "Units": "", "No Action Pages": "", "With Action Pages": ""}
+
+
+def results_dataframe(final_data):
+    """{component: row} as the sorted DataFrame with RESULT_COLUMNS."""
+    # Build final DataFrame with columns: Component, No Action, With Action, Units, pages
     rows = []
     for comp, values in final_data.items():
-        row = {
-            "Component": comp,
-            "No Action": values["No Action"],
-            "With Action": values["With Action"],
-            "Units": values["Units"],
-        }
-        rows.append(row)
+        row = dict(empty_result_row(), **values)
+        rows.append({"Component": comp, **{c: row[c] for c in RESULT_COLUMNS[1:]}})
 
-    df = pd.DataFrame(rows, columns=["Component", "No Action", "With Action", "Units"])
+    df = pd.DataFrame(rows, columns=RESULT_COLUMNS)
     df.sort_values("Component", inplace=True)
     df.reset_index(drop=True, inplace=True)
     return df
@@ -237,56 +1089,143 @@ def process_all_dictionary_questions(directory, vectorstore, llm):
 # 8. SAVE RESULTS TO EXCEL
 ###############################################################################
 def save_results_to_excel(df, directory_path):
+    with get_metrics().stage("excel", os.path.basename(os.path.normpath(directory_path))):
+        return _save_results_to_excel(df, directory_path)
+
+
+def _save_results_to_excel(df, directory_path):
     dir_name = os.path.basename(os.path.normpath(directory_path))
-    output_path = f".\Equity-Development-Index\Results_test\{dir_name}.xlsx"
-    
+    output_path = os.path.join(RESULTS_DIR, f"{dir_name}.xlsx")
+
     # make a copy so we don't alter the df you print in the terminal
     df_excel = df.copy()
     # replace any numeric 0 in the two columns with "Value not found"
     df_excel["No Action"]   = df_excel["No Action"].apply(lambda x: "Value not found" if x == 0 else x)
     df_excel["With Action"] = df_excel["With Action"].apply(lambda x: "Value not found" if x == 0 else x)
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Results"
+    # write-only mode streams whole rows instead of building every cell
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Results")
+    ws.append(list(df_excel.columns))
+    for row in df_excel.itertuples(index=False):
+        ws.append(list(row))
 
-    for r_idx, row in enumerate(dataframe_to_rows(df_excel, index=False, header=True)):
-        for c_idx, value in enumerate(row):
-            ws.cell(row=r_idx + 1, column=c_idx + 1, value=value)
-
-    #os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
     wb.save(output_path)
     return output_path
 
 
-def main_cli(directory):
-    from .libraries import ChatOpenAI
-    # 1) Discover which folders to process
+def project_folders(directory):
+    """The project folders under directory, or directory itself if it has no subfolders."""
     subfolders = [
         os.path.join(directory, d)
         for d in os.listdir(directory)
         if os.path.isdir(os.path.join(directory, d))
     ]
-    # If no subfolders, treat 'directory' itself as the folder
-    if not subfolders:
-        subfolders = [directory]
+    return subfolders or [directory]
+
+
+def save_project_results(sub, df, run_id, store):
+    """Prints a finished project, appends it to the results store and saves its Excel file."""
+    print(df[RESULT_COLUMNS[:4]].to_string(index=False))
+    store.append(run_id, sub, df)
+    output_file = save_results_to_excel(df, sub)
+    print(f"Results saved to {output_file}")
+    return output_file
+
+
+def main_cli(
+    directory,
+    query_workers=DEFAULT_QUERY_WORKERS,
+    pdf_workers=DEFAULT_PDF_WORKERS,
+    project_workers=None,
+    api_concurrency=None,
+    batched=False,
+    hybrid=True,
+    top_k=None,
+    context_tokens=None,
+    metrics_dir=None,
+    llm=None,
+    embedding_backend=DEFAULT_EMBEDDING_BACKEND,
+    vector_index=None,
+    resume=False,
+):
+    """
+    Runs every project folder under directory and saves one Excel file per
+    project under RESULTS_DIR. Every project's results are also appended to
+    the Parquet results store under the run's id, and the run ends with one
+    combined workbook (summary sheet plus a sheet per project). llm
+    defaults to GPT-4o; pass another chat model (e.g. the benchmark's
+    offline stand-in) to replace it.
+
+    Progress is journaled under .edi_cache/journals; resume=True continues
+    an interrupted run of the same directory and settings instead of
+    starting over.
+    """
+    from .scheduler import run_projects, DEFAULT_PROJECT_WORKERS, DEFAULT_API_CONCURRENCY
+    from .journal import RunJournal, journal_path
+    metrics = reset_metrics()
+    # 1) Discover which folders to process
+    subfolders = project_folders(directory)
 
     # 2) Initialize your LLM once
-    llm = ChatOpenAI(model="gpt-4o-2024-05-13")
+    if llm is None:
+        llm = make_chat_model()
 
-    # 3) Iterate and run the same pipeline you have in Streamlit
-    for sub in subfolders:
-        print(f"\n--- Processing {sub} ---")
-        cleanup_generated_files(sub)
+    # Settings that change the answers; a journal written with others is not reused
+    settings = {
+        "batched": batched,
+        "hybrid": hybrid,
+        "top_k": top_k,
+        "context_tokens": context_tokens,
+        "embedding_backend": embedding_backend,
+        "model": getattr(llm, "model_name", type(llm).__name__),
+    }
+    journal = RunJournal(journal_path(directory), settings, resume=resume)
+    if journal.resumed:
+        print(f"Resuming from {journal.path}: {journal.summary()}")
+    run_id = journal.run_id
+    store = get_results_store()
 
-        splits = load_and_split_pdfs_from_directory(sub)
-        if not splits:
-            print(f"No PDFs found in {sub}. Skipping.")
-            continue
+    def finish(sub, df):
+        return save_project_results(sub, df, run_id, store)
+
+    # 3) Run the same pipeline you have in Streamlit, overlapping projects
+    results = run_projects(
+        subfolders,
+        llm,
+        finish=finish,
+        project_workers=project_workers or DEFAULT_PROJECT_WORKERS,
+        cpu_workers=pdf_workers,
+        api_concurrency=api_concurrency or DEFAULT_API_CONCURRENCY,
+        query_workers=query_workers,
+        batched=batched,
+        hybrid=hybrid,
+        top_k=top_k,
+        context_tokens=context_tokens,
+        embedding_backend=embedding_backend,
+        vector_index=vector_index or DEFAULT_VECTOR_INDEX,
+        journal=journal,
+    )
+    journal.close()
+    if store.compact(run_id):
+        with metrics.stage("excel"):
+            workbook = export_run(run_id, store=store)
+        print(f"All projects of run {run_id} saved to {workbook} (results store: {store.path})")
+    print(format_cache_stats("Embedding", get_embedding_cache().stats()))
+    if response_cache_enabled():
+        print(format_cache_stats("LLM response", get_response_cache().stats()))
 
-        vs = create_vectorstore(splits)
-        df = process_all_dictionary_questions(sub, vs, llm)
-        print(df.to_string(index=False))
+    failed = [r for r in results if r.error]
+    for r in results:
+        if r.df is None and not r.error:
+            print(f"No PDFs found in {r.directory}. Skipped.")
+    if failed:
+        print(f"\n{len(failed)} of {len(results)} project(s) failed:")
+        for r in failed:
+            print(f"  {r.directory}: {r.error}")
 
-        output_file = save_results_to_excel(df, sub)
-        print(f"Results saved to {output_file}")
+    print(format_stage_summary(metrics.report()))
+    json_path, prom_path = metrics.write_reports(metrics_dir or os.path.join(CACHE_DIR, "metrics"))
+    print(f"Run report saved to {json_path} (Prometheus: {prom_path})")
+    return results
@@ -202,3 +202,34 @@ component_units_map = {
     "Solid Waste Generation": "weekly tons",
     "Greenhouse Gas Emissions": "annual tons",
 }
+
+
+###############################################################################
+# 7. CHAPTER ROUTING
+###############################################################################
+# Each prompt category only searches chunks from FEIS chapters whose title
+# contains one of these keywords (case-insensitive). Categories without an
+# entry, or with no matching chapter in a project, search all chunks.
+category_chapter_keywords = {
+    "Project Description": ["project description", "project desription"],
+    "Socioeconomic": ["socioeconomic"],
+    "Open Space": ["open space"],
+    "SolidWaste": ["solid waste"],
+    "GreenHouse Gas": ["greenhouse gas"],
+}
+
+
+###############################################################################
+# 8. TABLE LOOKUP LABELS
+###############################################################################
+# Row (or column) labels, as printed in FEIS RWCDS and summary tables, that
+# answer a component directly. Labels are tried in order and matched after
+# normalization (lowercase, punctuation dropped). Components without an entry
+# always go to the LLM.
+component_table_labels = {
+    "Market Rate Residential": ["DU", "Dwelling Units", "Residential Units", "Residential (DU)"],
+    "Parking Space": ["Parking Spaces", "Accessory Parking Spaces", "Public Parking Spaces"],
+    "Office Space": ["Office gsf", "Commercial gsf", "Retail gsf", "Office", "Commercial Office"],
+    "Community Space": ["Community Facility gsf", "Community Facility"],
+    "Building Total GSF": ["Total gsf", "Total Development gsf", "Total Floor Area"],
+}
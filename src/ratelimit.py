@@ -0,0 +1,377 @@
+# src/ratelimit.py
+
+from .libraries import (
+    os, re, threading, time, nullcontext, openai, ChatOpenAI,
+    Retrying, stop_after_attempt, wait_random_exponential, retry_if_exception,
+)
+from .metrics import get_metrics
+
+
+CHAT_MODEL = "gpt-4o-2024-05-13"
+
+# Account limits per minute. 0 means unknown until the x-ratelimit-*
+# response headers report them. Setting them also caps what the headers
+# report (e.g. to leave room for other jobs on the same key).
+CHAT_RPM = int(os.getenv("EDI_CHAT_RPM", "0"))
+CHAT_TPM = int(os.getenv("EDI_CHAT_TPM", "0"))
+EMBEDDING_RPM = int(os.getenv("EDI_EMBEDDING_RPM", "0"))
+EMBEDDING_TPM = int(os.getenv("EDI_EMBEDDING_TPM", "0"))
+
+# Attempts per request, and the jittered exponential backoff between them.
+API_MAX_RETRIES = int(os.getenv("EDI_API_MAX_RETRIES", "6"))
+BACKOFF_MULTIPLIER = 1.0
+BACKOFF_MAX = 60.0
+
+# Completion tokens reserved for a chat request before its usage is known.
+COMPLETION_TOKEN_RESERVE = 300
+
+# Successful requests in a row before a lane allows one more in flight.
+INCREASE_AFTER = 20
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+###############################################################################
+# 1. CLIENTS
+###############################################################################
+# Latest x-ratelimit-* headers seen per kind of request. They describe the
+# account, not one run, so every RateLimiter reads the same ones.
+_observed_headers = {}
+_observed_lock = threading.Lock()
+_http_client = None
+
+
+def _observe_response(response):
+    path = response.request.url.path
+    kind = "chat" if path.endswith("/chat/completions") else "embedding" if path.endswith("/embeddings") else None
+    headers = {name: value for name, value in response.headers.items() if name.startswith("x-ratelimit-")}
+    if kind and headers:
+        with _observed_lock:
+            _observed_headers[kind] = headers
+
+
+def observed_headers(kind):
+    with _observed_lock:
+        return dict(_observed_headers.get(kind, {}))
+
+
+def _warm_response_models():
+    """
+    Parses one sample of each response type. pydantic builds model schemas
+    lazily and, in the pinned version, not thread-safely: the first
+    responses parsed on several threads at once can come back empty
+    (KeyError: 'choices' in langchain-openai).
+    """
+    from openai.types.chat import ChatCompletion
+    from openai.types import CreateEmbeddingResponse
+    tool_call = {"id": "c", "type": "function", "function": {"name": "f", "arguments": "{}"}}
+    message = {"role": "assistant", "content": "", "tool_calls": [tool_call]}
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    ChatCompletion.model_validate({
+        "id": "warm", "object": "chat.completion", "created": 0, "model": CHAT_MODEL, "usage": usage,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+    }).model_dump()
+    CreateEmbeddingResponse.model_validate({
+        "object": "list", "model": "warm", "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        "data": [{"object": "embedding", "index": 0, "embedding": [0.0]}],
+    }).model_dump()
+
+
+def get_http_client():
+    """
+    The httpx client shared by the OpenAI chat and embedding models. A
+    response hook records the rate-limit headers of every response.
+    """
+    global _http_client
+    with _observed_lock:
+        if _http_client is None:
+            _warm_response_models()
+            _http_client = openai.DefaultHttpxClient(event_hooks={"response": [_observe_response]})
+    return _http_client
+
+
+def make_chat_model():
+    """
+    GPT-4o set up for the scheduler: the client's own retries are off, so
+    the scheduler sees every 429 and does the retrying itself.
+    """
+    return ChatOpenAI(model=CHAT_MODEL, max_retries=0, http_client=get_http_client())
+
+
+###############################################################################
+# 2. TOKEN BUCKETS
+###############################################################################
+def parse_duration(text):
+    """Seconds in an OpenAI reset header such as "1s", "6m0s" or "20ms"."""
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(str(text))
+    return sum(float(n) * DURATION_UNITS[unit] for n, unit in parts) if parts else None
+
+
+class TokenBucket:
+    """
+    A per-minute budget that refills continuously. A capacity of 0 means the
+    limit is not known yet and nothing is held back.
+    """
+
+    def __init__(self, per_minute=0):
+        self.cap = per_minute
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount can be taken (amounts above capacity wait for a full bucket)."""
+        self._refill(now)
+        if not self.capacity:
+            return 0.0
+        need = min(amount, self.capacity)
+        return 0.0 if self.level >= need else (need - self.level) * 60 / self.capacity
+
+    def take(self, amount):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + amount)
+
+    def set_limit(self, per_minute):
+        limit = min(self.cap, per_minute) if self.cap else per_minute
+        if limit != self.capacity:
+            # a newly learned limit starts with what the server says is left
+            self.level = min(self.level, limit) if self.capacity else float(limit)
+            self.capacity = limit
+
+    def sync(self, remaining):
+        """Never assume more is left than the server reports."""
+        if self.capacity:
+            self.level = min(self.level, remaining)
+
+
+class _Lane:
+    """Budgets and adaptive concurrency for one kind of request (chat or embedding)."""
+
+    def __init__(self, name, rpm, tpm, max_concurrency):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.window = max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.answered = False
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+
+
+###############################################################################
+# 3. SCHEDULER
+###############################################################################
+def _is_retryable(error):
+    if isinstance(error, openai.RateLimitError):
+        # an exhausted quota will not come back by waiting
+        return getattr(error, "code", None) != "insufficient_quota"
+    return isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError))
+
+
+def _retry_after(error):
+    """Seconds the server asked us to wait after a 429, if it said."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    waits = [
+        parse_duration(headers.get(name))
+        for name in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+    ]
+    waits = [w for w in waits if w is not None]
+    return min(max(waits), BACKOFF_MAX) if waits else None
+
+
+def _response_tokens(result):
+    message = result.get("raw") if isinstance(result, dict) else result
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+
+class RateLimiter:
+    """
+    The one gate every OpenAI chat and embedding request goes through.
+
+    Each kind of request has token buckets for requests and tokens per
+    minute, so a batch runs at the account's limit without tripping it
+    however many projects share the limiter. Limits come from EDI_*_RPM/TPM
+    or are learned from the x-ratelimit-* response headers (clients need
+    get_http_client for that).
+
+    Concurrency adapts like TCP congestion control: a 429 halves the
+    number of requests a lane allows in flight and pauses the lane for the
+    server's retry-after, and every INCREASE_AFTER successes in a row allow
+    one more, up to max_concurrency. Retryable errors (429s, timeouts,
+    connection errors, 5xx) are retried with jittered exponential backoff.
+
+    Entering it as a context manager only takes one of the max_concurrency
+    slots, like the semaphore it replaces.
+    """
+
+    def __init__(self, max_concurrency=16, max_retries=API_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.lanes = {
+            "chat": _Lane("chat", CHAT_RPM, CHAT_TPM, max_concurrency),
+            "embedding": _Lane("embedding", EMBEDDING_RPM, EMBEDDING_TPM, max_concurrency),
+        }
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "waited_seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def __enter__(self):
+        self.slots.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.slots.release()
+        return False
+
+    def call(self, kind, tokens, fn, *args, **kwargs):
+        """
+        fn(*args, **kwargs) once the kind's budgets allow a request of about
+        tokens tokens, retried on rate limits and transient errors.
+        """
+        lane = self.lanes[kind]
+        retrying = Retrying(
+            stop=stop_after_attempt(self.max_retries),
+            wait=wait_random_exponential(multiplier=BACKOFF_MULTIPLIER, max=BACKOFF_MAX),
+            retry=retry_if_exception(_is_retryable),
+            before_sleep=lambda state: self._before_retry(lane, state),
+            reraise=True,
+        )
+        for attempt in retrying:
+            with attempt:
+                return self._attempt(lane, tokens, fn, args, kwargs)
+
+    def _before_retry(self, lane, state):
+        error = state.outcome.exception()
+        with self._stats_lock:
+            self.stats["retries"] += 1
+        get_metrics().count("api_retries", component=lane.name)
+        print(
+            f"{lane.name} request failed ({type(error).__name__}), retry {state.attempt_number} "
+            f"in {state.next_action.sleep:.1f}s (concurrency now {lane.window})"
+        )
+
+    def _acquire(self, lane, tokens):
+        start = time.monotonic()
+        with lane.cond:
+            while True:
+                now = time.monotonic()
+                if lane.paused_until > now:
+                    wait = lane.paused_until - now
+                elif lane.in_flight >= (lane.window if lane.answered else 1):
+                    # until the first response brings the limits, send one at a time
+                    wait = 1.0  # woken early by notify_all on release
+                else:
+                    wait = max(lane.requests.wait_time(1, now), lane.tokens.wait_time(tokens, now))
+                    if wait == 0:
+                        lane.requests.take(1)
+                        lane.tokens.take(tokens)
+                        lane.in_flight += 1
+                        break
+                lane.cond.wait(wait)
+        waited = time.monotonic() - start
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["waited_seconds"] += waited
+
+    def _attempt(self, lane, tokens, fn, args, kwargs):
+        self._acquire(lane, tokens)
+        result = None
+        error = None
+        try:
+            with self.slots:
+                result = fn(*args, **kwargs)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(lane, tokens, result, error)
+
+    def _release(self, lane, tokens, result, error):
+        with lane.cond:
+            lane.in_flight -= 1
+            if isinstance(error, openai.RateLimitError):
+                lane.window = max(1, lane.window // 2)
+                lane.successes = 0
+                pause = _retry_after(error)
+                if pause:
+                    lane.paused_until = max(lane.paused_until, time.monotonic() + pause)
+            elif error is None:
+                headers = observed_headers(lane.name)
+                if headers.get("x-ratelimit-limit-requests"):
+                    lane.requests.set_limit(int(headers["x-ratelimit-limit-requests"]))
+                if headers.get("x-ratelimit-limit-tokens"):
+                    lane.tokens.set_limit(int(headers["x-ratelimit-limit-tokens"]))
+                # the server counted this request but not the ones still in flight
+                if headers.get("x-ratelimit-remaining-requests"):
+                    lane.requests.sync(int(headers["x-ratelimit-remaining-requests"]) - lane.in_flight)
+                if headers.get("x-ratelimit-remaining-tokens"):
+                    lane.tokens.sync(int(headers["x-ratelimit-remaining-tokens"]) - lane.in_flight * tokens)
+                used = _response_tokens(result)
+                if used is not None:
+                    # settle the estimate against what the request really used
+                    lane.tokens.give_back(tokens - used)
+                lane.answered = True
+                lane.successes += 1
+                if lane.successes >= INCREASE_AFTER and lane.window < lane.max_concurrency:
+                    lane.window += 1
+                    lane.successes = 0
+            lane.cond.notify_all()
+        if isinstance(error, openai.RateLimitError):
+            with self._stats_lock:
+                self.stats["rate_limited"] += 1
+            get_metrics().count("rate_limited", component=lane.name)
+
+    def summary(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lanes = ", ".join(
+            f"{lane.name} {lane.window}/{lane.max_concurrency} in flight"
+            + (f", {lane.requests.capacity} rpm" if lane.requests.capacity else "")
+            + (f", {lane.tokens.capacity} tpm" if lane.tokens.capacity else "")
+            for lane in self.lanes.values()
+        )
+        return (
+            f"API scheduler: {stats['requests']} requests, {stats['rate_limited']} rate-limited, "
+            f"{stats['retries']} retries, {stats['waited_seconds']:.1f}s queued ({lanes})"
+        )
+
+
+def limited_call(limiter, kind, tokens, fn, *args, **kwargs):
+    """
+    fn(*args, **kwargs) through limiter. A RateLimiter schedules and retries
+    it; anything else (a plain semaphore, or None) only caps concurrency,
+    with the same retries on transient errors.
+    """
+    if isinstance(limiter, RateLimiter):
+        return limiter.call(kind, tokens, fn, *args, **kwargs)
+    retrying = Retrying(
+        stop=stop_after_attempt(API_MAX_RETRIES),
+        wait=wait_random_exponential(multiplier=BACKOFF_MULTIPLIER, max=BACKOFF_MAX),
+        retry=retry_if_exception(_is_retryable),
+        reraise=True,
+    )
+    for attempt in retrying:
+        with attempt:
+            with limiter or nullcontext():
+                return fn(*args, **kwargs)
@@ -0,0 +1,287 @@
+# src/results_store.py
+
+from .libraries import os, re, time, uuid, hashlib, pa, pq, pads, pd, Workbook
+
+
+# Where result files go: one Excel file per project, the combined workbook
+# of each run and the Parquet store every run appends to. Relative paths are
+# resolved against the working directory.
+RESULTS_DIR = os.getenv("EDI_RESULTS_DIR", "Results_test")
+STORE_DIRNAME = "store"
+
+ACTIONS = ("No Action", "With Action")
+
+_schema = None
+
+
+def results_schema():
+    """
+    One row per (run, project, component, action). project is the folder's
+    display name and project_id tells apart folders with the same name
+    (see project_id). value is null when the value was not found. Built on
+    first use so importing this module does not load pyarrow.
+    """
+    global _schema
+    if _schema is None:
+        _schema = pa.schema([
+            ("run_id", pa.string()),
+            ("project", pa.string()),
+            ("project_id", pa.string()),
+            ("component", pa.string()),
+            ("action", pa.string()),
+            ("value", pa.float64()),
+            ("units", pa.string()),
+            ("source_pages", pa.string()),
+            ("recorded_at", pa.timestamp("s")),
+        ])
+    return _schema
+
+
+def new_run_id():
+    """Sortable id for one run: start time plus a random suffix."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def project_id(directory):
+    """A project folder's name plus a hash of its absolute path."""
+    path = os.path.abspath(directory)
+    return f"{os.path.basename(path)}-{hashlib.sha256(path.encode('utf-8')).hexdigest()[:8]}"
+
+
+def _file_name(project):
+    """File-system safe, and distinct for names that only differ in punctuation."""
+    safe = re.sub(r"[^\w\-]+", "_", project).strip("_") or "project"
+    return f"{safe}-{hashlib.sha256(project.encode('utf-8')).hexdigest()[:8]}.parquet"
+
+
+def _cell_value(value):
+    """Number stored for a results cell; None for "Value not found" and blanks."""
+    if value is None or isinstance(value, str):
+        return None
+    value = float(value)
+    return None if value == 0 or value != value else value
+
+
+def _write_atomic(table, path):
+    # dot-prefixed temp file: dataset scans skip it, and readers never see
+    # a half-written file
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+
+###############################################################################
+# 1. PARQUET STORE
+###############################################################################
+class ResultsStore:
+    """
+    Every run's results as a Parquet dataset, one row per project, component
+    and action:
+
+        <RESULTS_DIR>/store/run_id=<run id>/<project id>.parquet
+
+    Each finished project is written as its own small file (rewriting the
+    same file if a resumed run finishes it again), and compact() merges a
+    finished run into one file, so queries across all projects and runs read
+    a handful of files. Filters are pushed down into the Parquet scan.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(RESULTS_DIR, STORE_DIRNAME)
+
+    def _run_dir(self, run_id):
+        return os.path.join(self.path, f"run_id={run_id}")
+
+    def append(self, run_id, directory, df, project=None):
+        """
+        Stores the results DataFrame (see results_dataframe) of the project
+        folder directory, shown as project (default: the folder name).
+        """
+        key = project_id(directory)
+        project = project or os.path.basename(os.path.abspath(directory))
+        records = []
+        recorded_at = pd.Timestamp.now().floor("s")
+        for _, row in df.iterrows():
+            for action in ACTIONS:
+                records.append({
+                    "run_id": run_id,
+                    "project": project,
+                    "project_id": key,
+                    "component": row["Component"],
+                    "action": action,
+                    "value": _cell_value(row[action]),
+                    "units": row.get("Units") or "",
+                    "source_pages": row.get(f"{action} Pages") or "",
+                    "recorded_at": recorded_at,
+                })
+        table = pa.Table.from_pylist(records, schema=results_schema())
+        run_dir = self._run_dir(run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        path = os.path.join(run_dir, _file_name(key))
+        _write_atomic(table, path)
+        return path
+
+    def remove(self, run_id, directory):
+        """Drops a project folder's file from an uncompacted run; True if there was one."""
+        path = os.path.join(self._run_dir(run_id), _file_name(project_id(directory)))
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        return True
+
+    def compact(self, run_id):
+        """Merges a run's per-project files into one; returns its row count."""
+        run_dir = self._run_dir(run_id)
+        if not os.path.isdir(run_dir):
+            return 0
+        files = sorted(f for f in os.listdir(run_dir) if f.endswith(".parquet"))
+        if len(files) <= 1:
+            return sum(pq.read_metadata(os.path.join(run_dir, f)).num_rows for f in files)
+        table = pa.concat_tables(
+            [pq.read_table(os.path.join(run_dir, f), schema=results_schema()) for f in files]
+        ).sort_by([
+            ("project", "ascending"), ("project_id", "ascending"), ("component", "ascending"),
+            ("action", "ascending"),
+        ])
+        _write_atomic(table, os.path.join(run_dir, "part-0.parquet"))
+        for f in files:
+            if f != "part-0.parquet":
+                os.remove(os.path.join(run_dir, f))
+        return table.num_rows
+
+    def _dataset(self):
+        if not os.path.isdir(self.path):
+            return None
+        return pads.dataset(self.path, format="parquet", schema=results_schema(), partitioning="hive")
+
+    def query(self, run_id=None, projects=None, components=None, latest=False):
+        """
+        Results as a long DataFrame with the results_schema() columns. Filters
+        narrow the scan (projects by display name); latest=True keeps only
+        the most recent run of each project folder.
+        """
+        dataset = self._dataset()
+        if dataset is None:
+            return results_schema().empty_table().to_pandas()
+        conditions = []
+        if run_id is not None:
+            conditions.append(pads.field("run_id") == run_id)
+        if projects is not None:
+            conditions.append(pads.field("project").isin(list(projects)))
+        if components is not None:
+            conditions.append(pads.field("component").isin(list(components)))
+        condition = None
+        for c in conditions:
+            condition = c if condition is None else condition & c
+        df = dataset.to_table(filter=condition).to_pandas()
+        # stores written before project_id: the name was the key
+        df["project_id"] = df["project_id"].fillna(df["project"])
+        if latest and len(df):
+            newest = df.groupby("project_id")["run_id"].transform("max")
+            df = df[df["run_id"] == newest]
+        return df.sort_values(["project", "project_id", "component", "action"]).reset_index(drop=True)
+
+    def runs(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(d.split("=", 1)[1] for d in os.listdir(self.path) if d.startswith("run_id="))
+
+
+_store = None
+
+
+def get_results_store():
+    global _store
+    if _store is None:
+        _store = ResultsStore()
+    return _store
+
+
+###############################################################################
+# 2. EXCEL EXPORT
+###############################################################################
+def _display_value(value):
+    return "Value not found" if value is None or value != value else value
+
+
+def _sheet_titles(projects):
+    """Unique Excel-safe sheet titles (max 31 chars, no []:*?/\\)."""
+    titles = {}
+    used = {"summary"}
+    for project in projects:
+        base = re.sub(r"[\[\]:*?/\\]", "_", project)[:31] or "project"
+        title, n = base, 1
+        while title.lower() in used:
+            n += 1
+            suffix = f" ({n})"
+            title = base[:31 - len(suffix)] + suffix
+        used.add(title.lower())
+        titles[project] = title
+    return titles
+
+
+def export_workbook(results, path):
+    """
+    Writes long results (as returned by ResultsStore.query) to one workbook:
+    a Summary sheet with a row per component and a No Action / With Action
+    column pair per project, then one sheet per project in the same layout
+    as the per-project files. Uses openpyxl's write-only mode, so rows are
+    streamed to disk instead of built up cell by cell. path may also be a
+    file-like object, e.g. a BytesIO for a download.
+    """
+    # projects are keyed by project_id; same-named folders get "name (2)"
+    names = dict(zip(results["project_id"], results["project"])) if len(results) else {}
+    projects, counts = {}, {}
+    for key in sorted(names, key=lambda k: (names[k], k)):
+        counts[names[key]] = counts.get(names[key], 0) + 1
+        projects[key] = names[key] if counts[names[key]] == 1 else f"{names[key]} ({counts[names[key]]})"
+    components = sorted(results["component"].unique()) if len(results) else []
+    cells = {
+        (r.project_id, r.component, r.action): (r.value, r.units, r.source_pages)
+        for r in results.itertuples(index=False)
+    }
+    units = {}
+    for (project, component, action), (value, unit, pages) in cells.items():
+        if unit and not units.get(component):
+            units[component] = unit
+
+    wb = Workbook(write_only=True)
+    summary = wb.create_sheet("Summary")
+    summary.append(["Component", "Units"] + [f"{projects[p]} - {a}" for p in projects for a in ACTIONS])
+    for component in components:
+        row = [component, units.get(component, "")]
+        for project in projects:
+            for action in ACTIONS:
+                value = cells.get((project, component, action), (None,))[0]
+                row.append(None if (project, component, action) not in cells else _display_value(value))
+        summary.append(row)
+
+    titles = _sheet_titles(projects.values())
+    for project, label in projects.items():
+        ws = wb.create_sheet(titles[label])
+        ws.append(["Component", "No Action", "With Action", "Units", "No Action Pages", "With Action Pages"])
+        for component in components:
+            if (project, component, ACTIONS[0]) not in cells and (project, component, ACTIONS[1]) not in cells:
+                continue
+            no_action = cells.get((project, component, ACTIONS[0]), (None, "", ""))
+            with_action = cells.get((project, component, ACTIONS[1]), (None, "", ""))
+            ws.append([
+                component,
+                _display_value(no_action[0]),
+                _display_value(with_action[0]),
+                no_action[1] or with_action[1],
+                no_action[2],
+                with_action[2],
+            ])
+
+    if isinstance(path, str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    wb.save(path)
+    return path
+
+
+def export_run(run_id, path=None, store=None):
+    """The combined workbook of one run, saved as <RESULTS_DIR>/results-<run id>.xlsx."""
+    store = store or get_results_store()
+    path = path or os.path.join(RESULTS_DIR, f"results-{run_id}.xlsx")
+    return export_workbook(store.query(run_id=run_id), path)
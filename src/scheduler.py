@@ -0,0 +1,281 @@
+# src/scheduler.py
+
+from .libraries import os, time, tempfile, traceback, ThreadPoolExecutor
+from .cache import get_embeddings, DEFAULT_EMBEDDING_BACKEND
+from .indexing import open_project_index, open_project_bm25, project_table_rows, index_fingerprint, project_filter
+from .indexing import build_throwaway_index, project_lock
+from .tables import TableLookup
+from .bm25 import BM25Index
+from .numpy_index import NumpyVectorStore, searchable_index, DEFAULT_VECTOR_INDEX
+from .metrics import get_metrics, metrics_scope, project_scope, profiled_thread
+from .ratelimit import RateLimiter
+from .processing import (
+    cleanup_generated_files,
+    process_all_dictionary_questions,
+    results_dataframe,
+    make_pdf_pool,
+    DEFAULT_PDF_WORKERS,
+    DEFAULT_QUERY_WORKERS,
+)
+
+
+# How many projects are in flight at once. Each one alternates between CPU
+# work (PDF parsing) and network wait (embeddings, LLM calls), so a few
+# overlapping projects keep both the worker processes and the API busy.
+DEFAULT_PROJECT_WORKERS = 3
+
+# Upper bound on embedding + chat requests in flight across all projects;
+# the rate limiter lowers it while the API is returning 429s.
+DEFAULT_API_CONCURRENCY = 16
+
+
+class ProjectResult:
+    """Outcome of one project folder: a DataFrame, or the error that stopped it."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.df = None
+        self.output = None
+        self.error = None
+        self.elapsed = 0.0
+
+
+def run_project(sub, llm, finish=None, persistent_index=True, pool=None,
+                pdf_workers=1, limiter=None, query_workers=DEFAULT_QUERY_WORKERS, batched=False,
+                hybrid=True, top_k=None, context_tokens=None,
+                embedding_backend=DEFAULT_EMBEDDING_BACKEND, vector_index=DEFAULT_VECTOR_INDEX,
+                on_stage=None, on_row=None, index_cache=None, completed=None, response_cache=None):
+    """
+    Load → index → query → finish for a single project folder.
+
+    Chunks are stored in the shared LanceDB table (see indexing.py) and
+    searched with a filter on this project; vector_index picks what the
+    questions are searched with: "numpy" (in memory, see numpy_index.py),
+    "lancedb" or "auto" (NumPy for all but very large projects).
+    Components that a parsed RWCDS table answers unambiguously are taken
+    from the table; only the rest are sent to the LLM. With hybrid=True a
+    BM25 keyword index over the same chunks is fused with vector search.
+
+    Returns (df, output), or (None, None) if the folder has no PDFs. finish
+    (sub, df) is called with the DataFrame and its return value (e.g. the
+    saved Excel path) comes back as output.
+
+    on_stage(sub, stage) reports "indexing" and "querying" as the project
+    reaches them; on_row(sub, component, row) forwards each recorded value
+    (see process_all_dictionary_questions). index_cache is an optional dict
+    kept across runs (the UI keeps one in st.cache_resource) that holds
+    opened persistent indexes, so an unchanged project is not re-checked.
+    completed rows from an interrupted run are reused (see
+    process_all_dictionary_questions), and the old output is kept until the
+    new one is written. response_cache turns the LLM response cache on or
+    off for this project (None: the process-wide setting).
+    """
+    if not completed:
+        cleanup_generated_files(sub)
+    embedding = get_embeddings(limiter=limiter, backend=embedding_backend)
+    stage = (lambda name: on_stage(sub, name)) if on_stage else (lambda name: None)
+    row = (lambda component, values: on_row(sub, component, values)) if on_row else None
+
+    if persistent_index:
+        # another run (e.g. a second UI session) may be opening the same
+        # folder: wait for it and reuse its index instead of re-indexing
+        with project_lock(sub):
+            key = index_fingerprint(sub, embedding) + (vector_index,) if index_cache is not None else None
+            cached = index_cache.get(key) if key else None
+            if cached is None:
+                stage("indexing")
+                vs = open_project_index(sub, embedding=embedding, pdf_workers=pdf_workers, pool=pool)
+                if vs is None:
+                    return None, None
+                scope = project_filter(sub)
+                cached = {
+                    "lancedb": vs,
+                    "filter": scope,
+                    "vectorstore": searchable_index(vs, vector_index, where=scope),
+                    "tables": TableLookup(project_table_rows(sub)),
+                    "bm25": None,
+                }
+                if key:
+                    index_cache[key] = cached
+            else:
+                print(f"Reusing the open index for {sub}")
+                # the cached store embeds queries with an earlier run's limiter
+                cached["vectorstore"].embeddings.limiter = limiter
+            if hybrid and cached["bm25"] is None:
+                cached["bm25"] = open_project_bm25(sub, cached["lancedb"])
+        vs = cached["vectorstore"]
+        stage("querying")
+        df = process_all_dictionary_questions(
+            sub, vs, llm, max_workers=query_workers, limiter=limiter, batched=batched,
+            table_lookup=cached["tables"], bm25=cached["bm25"] if hybrid else None, top_k=top_k,
+            context_tokens=context_tokens, on_row=row, completed=completed,
+            project_filter=cached["filter"], response_cache=response_cache,
+        )
+    else:
+        stage("indexing")
+        table_rows = []
+        # private throwaway table, so projects running side by side don't clash
+        with tempfile.TemporaryDirectory(prefix="edi-lancedb-") as uri:
+            lance = build_throwaway_index(
+                sub, embedding, uri, pdf_workers=pdf_workers, pool=pool, tables=table_rows
+            )
+            if lance is None:
+                return None, None
+            with get_metrics().stage("index"):
+                vs = searchable_index(lance, vector_index)
+                if not hybrid:
+                    bm25 = None
+                elif isinstance(vs, NumpyVectorStore):
+                    bm25 = BM25Index.build(vs.ids, vs.texts)
+                else:
+                    bm25 = BM25Index.from_table(vs.get_table())
+            stage("querying")
+            df = process_all_dictionary_questions(
+                sub, vs, llm, max_workers=query_workers, limiter=limiter, batched=batched,
+                table_lookup=TableLookup(table_rows), bm25=bm25, top_k=top_k,
+                context_tokens=context_tokens, on_row=row, completed=completed,
+                response_cache=response_cache,
+            )
+
+    output = finish(sub, df) if finish else None
+    return df, output
+
+
+def run_projects(
+    subfolders,
+    llm,
+    finish=None,
+    persistent_index=True,
+    project_workers=DEFAULT_PROJECT_WORKERS,
+    cpu_workers=DEFAULT_PDF_WORKERS,
+    api_concurrency=DEFAULT_API_CONCURRENCY,
+    query_workers=DEFAULT_QUERY_WORKERS,
+    batched=False,
+    hybrid=True,
+    top_k=None,
+    context_tokens=None,
+    embedding_backend=DEFAULT_EMBEDDING_BACKEND,
+    vector_index=DEFAULT_VECTOR_INDEX,
+    on_stage=None,
+    on_row=None,
+    index_cache=None,
+    journal=None,
+    metrics=None,
+    response_cache=None,
+):
+    """
+    Runs the pipeline over many project folders with their stages overlapped.
+
+    Up to project_workers projects run at once, so one project's PDFs are
+    being parsed while another's embeddings and LLM queries are in flight.
+    All projects share one process pool of cpu_workers for parsing and one
+    RateLimiter for OpenAI calls (at most api_concurrency in flight, within
+    the account's request and token limits), so the global limits hold no
+    matter how many projects there are. A project that raises is recorded
+    on its ProjectResult and does not stop the rest of the batch.
+
+    on_stage, on_row and index_cache are passed to run_project; on_stage is
+    also called with "done", "skipped" (no PDFs) or "failed" at the end of
+    each project. Both callbacks run on the project threads.
+
+    journal (a journal.RunJournal) records each finished index, recorded
+    value and finished project as it happens. When it was resumed,
+    finished projects are not run again and unfinished ones continue from
+    their recorded values.
+
+    metrics (a metrics.Metrics) collects this run's timings and counts
+    instead of the process-wide registry, and response_cache turns the LLM
+    response cache on or off for this run only; a UI that runs several
+    jobs at once passes both rather than changing the process-wide
+    settings under a running job.
+
+    Returns one ProjectResult per folder, in the order given.
+    """
+    results = [ProjectResult(sub) for sub in subfolders]
+    if metrics is None:
+        metrics = get_metrics()
+    limiter = RateLimiter(max_concurrency=api_concurrency)
+    pool = make_pdf_pool(cpu_workers) if cpu_workers > 1 else None
+
+    def project_callbacks(sub, start):
+        """on_stage / on_row / finish for one project, with journaling added."""
+        if journal is None:
+            return on_stage, on_row, finish
+
+        def stage(name_sub, name):
+            if name == "querying":
+                journal.record_index(sub, time.time() - start)
+            if on_stage:
+                on_stage(name_sub, name)
+
+        def row(row_sub, component, values):
+            journal.record_row(sub, component, values)
+            if on_row:
+                on_row(row_sub, component, values)
+
+        def done(done_sub, df):
+            output = finish(done_sub, df) if finish else None
+            journal.record_done(sub, output)
+            return output
+
+        return stage, row, done
+
+    def resume_finished(result):
+        """Fills in a project the journal says is finished; False if it must run."""
+        output = journal.output(result.directory) if journal is not None else None
+        if output is None or (isinstance(output, str) and not os.path.exists(output)):
+            return False
+        print(f"\n--- {result.directory} finished in an earlier run, output {output} ---")
+        result.df = results_dataframe(journal.project_rows(result.directory))
+        result.output = output
+        return True
+
+    def run_one(result):
+        start = time.time()
+        if resume_finished(result):
+            if on_stage:
+                on_stage(result.directory, "done")
+            return result
+        print(f"\n--- Processing {result.directory} ---")
+        project = os.path.basename(os.path.normpath(result.directory))
+        stage, row, done = project_callbacks(result.directory, start)
+        try:
+            with metrics_scope(metrics), project_scope(project), profiled_thread():
+                result.df, result.output = run_project(
+                    result.directory,
+                    llm,
+                    finish=done,
+                    persistent_index=persistent_index,
+                    pool=pool,
+                    pdf_workers=cpu_workers,
+                    limiter=limiter,
+                    query_workers=query_workers,
+                    batched=batched,
+                    hybrid=hybrid,
+                    top_k=top_k,
+                    context_tokens=context_tokens,
+                    embedding_backend=embedding_backend,
+                    vector_index=vector_index,
+                    on_stage=stage,
+                    on_row=row,
+                    index_cache=index_cache,
+                    completed=journal.project_rows(result.directory) if journal is not None else None,
+                    response_cache=response_cache,
+                )
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+            print(f"Project {result.directory} failed:\n{traceback.format_exc()}")
+        result.elapsed = time.time() - start
+        metrics.add_time("project", result.elapsed, project=project)
+        if on_stage:
+            on_stage(result.directory, "failed" if result.error else "skipped" if result.df is None else "done")
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, project_workers)) as executor:
+            list(executor.map(run_one, results))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    print(limiter.summary())
+    return results
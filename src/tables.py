@@ -0,0 +1,186 @@
+# src/tables.py
+
+from .libraries import re
+
+
+# Condition names as they appear in FEIS tables (older EISs say Build/No-Build).
+CONDITION_PATTERN = re.compile(
+    r"\b(no[\s-]*action|with[\s-]*action|no[\s-]*build|build|increment)\b", re.IGNORECASE
+)
+NUMBER_PATTERN = re.compile(r"^\(?-?[\d,]*\d(\.\d+)?\)?$")
+HYPHENS = re.compile(r"[‐‑‒–—−]")
+
+
+###############################################################################
+# 1. CELL HELPERS
+###############################################################################
+def normalize_label(text):
+    """"Residential (DU)" → "residential du", "No‐Action" → "no action"."""
+    text = HYPHENS.sub("-", text).lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+
+def parse_number(cell):
+    """"128,169" → 128169, "(1,200)" → -1200, "2.5" → 2.5; anything else → None."""
+    cell = cell.strip()
+    if not NUMBER_PATTERN.match(cell):
+        return None
+    negative = cell.startswith("(") or cell.startswith("-")
+    digits = cell.strip("()").replace(",", "").lstrip("-")
+    value = float(digits) if "." in digits else int(digits)
+    return -value if negative else value
+
+
+def condition_name(text):
+    """Maps a table cell to "No Action", "With Action" or "Increment" (or None)."""
+    key = normalize_label(text).replace(" ", "")
+    return {
+        "noaction": "No Action",
+        "nobuild": "No Action",
+        "withaction": "With Action",
+        "build": "With Action",
+        "increment": "Increment",
+    }.get(key)
+
+
+def _split_row(line):
+    """Splits "<label> <n1> <n2> ..." into (label, [numbers]); numbers must trail."""
+    tokens = line.split()
+    numbers = []
+    while tokens and parse_number(tokens[-1]) is not None:
+        numbers.insert(0, parse_number(tokens.pop()))
+    return " ".join(tokens), numbers
+
+
+def _row(label, values, source, page):
+    row = {
+        "label": normalize_label(label),
+        "No Action": values.get("No Action"),
+        "With Action": values.get("With Action"),
+        "Increment": values.get("Increment"),
+        "source": source,
+        "page": page,
+    }
+    # the increment column lets us check the row was read correctly
+    row["verified"] = (
+        None not in (row["No Action"], row["With Action"], row["Increment"])
+        and abs(row["With Action"] - row["No Action"] - row["Increment"]) <= 1
+    )
+    return row
+
+
+###############################################################################
+# 2. TABLE DETECTION
+###############################################################################
+def _conditions_as_columns(lines, source, page):
+    """
+    Tables whose header names the conditions, e.g.
+        Use            No-Action  With-Action  Increment
+        Residential DU       171          897        726
+    """
+    rows = []
+    columns = None
+    misses = 0
+    for line in lines:
+        found = [condition_name(m.group(0)) for m in CONDITION_PATTERN.finditer(HYPHENS.sub("-", line))]
+        leftover = CONDITION_PATTERN.sub(" ", HYPHENS.sub("-", line)).split()
+        if len(set(found)) >= 2 and len(found) == len(set(found)) and len(leftover) <= 4 \
+                and not any(parse_number(t) is not None for t in line.split()):
+            columns, misses = found, 0
+            continue
+        if columns is None:
+            continue
+        label, numbers = _split_row(line)
+        if label and len(numbers) == len(columns) and condition_name(label) is None:
+            rows.append(_row(label, dict(zip(columns, numbers)), source, page))
+            misses = 0
+        else:
+            misses += 1
+            if misses > 3:
+                columns = None
+    return rows
+
+
+def _conditions_as_rows(lines, source, page):
+    """
+    Tables with one row per condition, e.g. (cells separated by 2+ spaces)
+        Condition    DU   Parking Spaces   Total gsf
+        No-Action   171               58     148,534
+        With-Action 897              409     930,886
+        Increment   726              351     782,352
+    """
+    rows = []
+    i = 0
+    while i < len(lines):
+        group = []
+        while i < len(lines):
+            match = CONDITION_PATTERN.match(HYPHENS.sub("-", lines[i].strip()))
+            if not match:
+                break
+            numbers = [parse_number(t) for t in lines[i].strip()[match.end():].split()]
+            if not numbers or None in numbers:
+                break
+            group.append((condition_name(match.group(0)), numbers))
+            i += 1
+        if len(group) >= 2:
+            header_line = next((l for l in reversed(lines[:i - len(group)]) if l.strip()), "")
+            headers = [h for h in re.split(r"\s{2,}", header_line.strip()) if h]
+            width = len(group[0][1])
+            if len(headers) == width + 1:
+                headers = headers[1:]  # leading "Condition"/"Scenario" cell
+            if len(headers) == width and all(len(n) == width for _, n in group):
+                for col, header in enumerate(headers):
+                    values = {cond: numbers[col] for cond, numbers in group}
+                    rows.append(_row(header, values, source, page))
+        if not group:
+            i += 1
+    return rows
+
+
+def extract_table_rows(text, source, page):
+    """
+    Finds No-Action / With-Action / Increment tables in one page of PDF text
+    and returns one row per table line, keyed by normalized row label.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    return _conditions_as_columns(lines, source, page) + _conditions_as_rows(lines, source, page)
+
+
+###############################################################################
+# 3. LOOKUP
+###############################################################################
+class TableLookup:
+    """
+    Answers components straight from parsed tables.
+
+    Only rows whose increment checks out are trusted, and a label that shows
+    up with conflicting values counts as a miss, so the caller falls back to
+    the LLM whenever the table answer is not clear-cut.
+    """
+
+    def __init__(self, rows):
+        self.rows = {}
+        for row in rows:
+            if row.get("verified"):
+                self.rows.setdefault(row["label"], []).append(row)
+
+    def __len__(self):
+        return sum(len(v) for v in self.rows.values())
+
+    def find(self, labels):
+        for label in labels:
+            matches = self.rows.get(normalize_label(label), [])
+            distinct = {(r["No Action"], r["With Action"]) for r in matches}
+            if len(distinct) == 1:
+                return matches[0]
+        return None
+
+    def answer(self, component, action_label, component_labels):
+        """(value, row) for a component/condition, or (None, None) on a miss."""
+        labels = component_labels.get(component)
+        if not labels:
+            return None, None
+        row = self.find(labels)
+        if row is None or row.get(action_label) is None:
+            return None, None
+        return row[action_label], row
@@ -0,0 +1,214 @@
+# src/watch.py
+
+from .libraries import os, time, threading, Observer
+from .cache import CACHE_DIR, DEFAULT_EMBEDDING_BACKEND
+from .indexing import drop_project_index
+from .metrics import reset_metrics
+from .numpy_index import DEFAULT_VECTOR_INDEX
+from .results_store import RESULTS_DIR, get_results_store, new_run_id, export_run
+from .scheduler import run_projects, DEFAULT_PROJECT_WORKERS, DEFAULT_API_CONCURRENCY
+from .processing import (
+    project_folders,
+    save_project_results,
+    make_chat_model,
+    DEFAULT_PDF_WORKERS,
+    DEFAULT_QUERY_WORKERS,
+)
+
+
+# A project is reprocessed once its files have been quiet this many seconds,
+# so a PDF that is still being copied, or a batch of chapters dropped in
+# together, triggers one run instead of one per file event.
+WATCH_DEBOUNCE = float(os.getenv("EDI_WATCH_DEBOUNCE", "2.0"))
+
+# Events that change what a project's index would contain. Reads (opened,
+# closed_no_write) are left out: the pipeline itself reads the PDFs.
+FILE_EVENTS = ("created", "deleted", "moved", "modified", "closed")
+FOLDER_EVENTS = ("created", "deleted", "moved")
+
+
+###############################################################################
+# 1. EVENTS → PROJECTS
+###############################################################################
+class ProjectEvents:
+    """
+    Maps file events under root to the project folders they affect and
+    debounces them. watchdog calls dispatch() from its observer thread;
+    the daemon loop takes the projects that are due with wait_due().
+
+    Only what the pipeline reads counts: *.pdf files directly in a project
+    folder (or in root when it is the project), and project folders being
+    created, deleted or renamed.
+    """
+
+    def __init__(self, root, debounce=WATCH_DEBOUNCE):
+        self.root = os.path.abspath(root)
+        self.debounce = debounce
+        self._pending = {}  # project folder -> monotonic time of its last event
+        self._changed = threading.Condition()
+
+    def project_of(self, path, is_directory):
+        rel = os.path.relpath(os.path.abspath(path), self.root)
+        if rel == os.curdir or rel.startswith(os.pardir):
+            return None
+        parts = rel.split(os.sep)
+        if is_directory:
+            return os.path.join(self.root, parts[0]) if len(parts) == 1 else None
+        if len(parts) > 2 or not parts[-1].endswith(".pdf"):
+            return None
+        return self.root if len(parts) == 1 else os.path.join(self.root, parts[0])
+
+    def dispatch(self, event):
+        allowed = FOLDER_EVENTS if event.is_directory else FILE_EVENTS
+        if event.event_type not in allowed:
+            return
+        paths = [event.src_path]
+        if event.event_type == "moved":
+            paths.append(event.dest_path)
+        projects = {self.project_of(os.fsdecode(p), event.is_directory) for p in paths} - {None}
+        if projects:
+            self.touch(projects)
+
+    def touch(self, projects):
+        """Marks projects as changed now, restarting their debounce."""
+        with self._changed:
+            now = time.monotonic()
+            for project in projects:
+                self._pending[project] = now
+            self._changed.notify()
+
+    def wait_due(self, timeout=1.0):
+        """
+        Projects whose last event is at least debounce seconds old (removed
+        from the pending set), or [] after timeout seconds without any.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                due = sorted(p for p, t in self._pending.items() if now - t >= self.debounce)
+                if due:
+                    for project in due:
+                        del self._pending[project]
+                    return due
+                wait = deadline - now
+                if self._pending:
+                    wait = min(wait, min(self.debounce - (now - t) for t in self._pending.values()))
+                if wait <= 0:
+                    return []
+                self._changed.wait(wait)
+
+
+###############################################################################
+# 2. DAEMON
+###############################################################################
+def watch_cli(
+    directory,
+    debounce=WATCH_DEBOUNCE,
+    query_workers=DEFAULT_QUERY_WORKERS,
+    pdf_workers=DEFAULT_PDF_WORKERS,
+    project_workers=None,
+    api_concurrency=None,
+    batched=False,
+    hybrid=True,
+    top_k=None,
+    context_tokens=None,
+    metrics_dir=None,
+    llm=None,
+    embedding_backend=DEFAULT_EMBEDDING_BACKEND,
+    vector_index=DEFAULT_VECTOR_INDEX,
+    stop=None,
+):
+    """
+    Processes every project folder under directory once, like main_cli, and
+    then keeps watching it. When a project's PDFs are added, changed or
+    deleted, only that project is re-indexed (incrementally, see
+    open_project_index) and re-queried, and its results are replaced in
+    place: its Excel file, its entry in the results store under this
+    daemon's run id and the run's combined workbook. A project folder that
+    is deleted or left without PDFs has its results and its chunks in the
+    shared index removed.
+
+    Runs until Ctrl-C, or until the stop event (a threading.Event) is set;
+    the run's store files are then compacted.
+    """
+    root = os.path.abspath(directory)
+    if llm is None:
+        llm = make_chat_model()
+    run_id = new_run_id()
+    store = get_results_store()
+    index_cache = {}  # open indexes of unchanged projects are reused between updates
+    options = dict(
+        project_workers=project_workers or DEFAULT_PROJECT_WORKERS,
+        cpu_workers=pdf_workers,
+        api_concurrency=api_concurrency or DEFAULT_API_CONCURRENCY,
+        query_workers=query_workers,
+        batched=batched,
+        hybrid=hybrid,
+        top_k=top_k,
+        context_tokens=context_tokens,
+        embedding_backend=embedding_backend,
+        vector_index=vector_index,
+    )
+
+    def finish(sub, df):
+        return save_project_results(sub, df, run_id, store)
+
+    def evict(project):
+        for key in [k for k in index_cache if k[0] == os.path.abspath(project)]:
+            del index_cache[key]
+
+    def forget(project):
+        evict(project)
+        drop_project_index(project)
+        name = os.path.basename(os.path.normpath(project))
+        excel = os.path.join(RESULTS_DIR, f"{name}.xlsx")
+        removed = store.remove(run_id, project)
+        if os.path.exists(excel):
+            os.remove(excel)
+            removed = True
+        if removed:
+            print(f"Removed the results of {name}")
+
+    def update(projects):
+        start = time.time()
+        metrics = reset_metrics()
+        current = set(project_folders(root))
+        for project in projects:
+            if project not in current:
+                forget(project)
+        changed = [p for p in projects if p in current]
+        for project in changed:
+            evict(project)
+        results = run_projects(changed, llm, finish=finish, index_cache=index_cache, **options) if changed else []
+        for r in results:
+            if r.error:
+                print(f"Project {r.directory} failed, keeping its previous results: {r.error}")
+            elif r.df is None:
+                forget(r.directory)
+        workbook = export_run(run_id, store=store)
+        metrics.write_reports(metrics_dir or os.path.join(CACHE_DIR, "metrics"))
+        names = ", ".join(os.path.basename(os.path.normpath(p)) for p in projects)
+        print(f"Updated {names} in {time.time() - start:.1f}s; all projects in {workbook}")
+
+    events = ProjectEvents(root, debounce=debounce)
+    observer = Observer()
+    # watchdog only needs a dispatch(event) method on the handler
+    observer.schedule(events, root, recursive=True)
+    observer.start()
+    try:
+        # events during the first pass queue up and are handled after it
+        update(project_folders(root))
+        print(f"\nWatching {root} for PDF changes (debounce {debounce:g}s, Ctrl-C to stop)")
+        while stop is None or not stop.is_set():
+            due = events.wait_due()
+            if due:
+                print(f"\n--- Changes in {len(due)} project(s) ---")
+                update(due)
+    except KeyboardInterrupt:
+        print("\nStopping the watch.")
+    finally:
+        observer.stop()
+        observer.join()
+        store.compact(run_id)
+    return run_id
@@ -8,16 +8,139 @@ import tempfile
 import shutil
 import zipfile
 import glob
+import threading
 
 from src.processing import (
-    cleanup_generated_files,
-    load_and_split_pdfs_from_directory,
-    create_vectorstore,
-    process_all_dictionary_questions,
+    DEFAULT_QUERY_WORKERS,
+    format_cache_stats,
+    iter_dictionary_questions,
 )
-from src.libraries import ChatOpenAI
+from src.cache import get_embedding_cache, get_response_cache, EMBEDDING_BACKENDS, DEFAULT_EMBEDDING_BACKEND
+from src.scheduler import run_projects
+from src.metrics import Metrics, format_stage_summary
+from src.ratelimit import make_chat_model
+from src.results_store import get_results_store, export_workbook, new_run_id
+from src.libraries import apply_nest_asyncio
+
+# How often the page polls a running analysis for new results.
+POLL_SECONDS = 1.0
+
+STAGE_LABELS = {
+    "queued": "Waiting",
+    "indexing": "Parsing and indexing PDFs",
+    "querying": "Answering questions",
+    "done": "Done",
+    "skipped": "No PDFs loaded, skipped",
+    "failed": "Failed",
+}
+
+
+@st.cache_resource
+def get_llm(api_key):
+    # keyed on the key so entering a new one builds a new client
+    return make_chat_model()
+
+
+@st.cache_resource
+def get_index_cache():
+    """
+    Opened project indexes, shared by every session and rerun (run_project
+    reads and fills it under the project's lock).
+    """
+    return {}
+
+
+class AnalysisJob:
+    """
+    One Run Analysis click, running on a background thread.
+
+    The pipeline reports stages and recorded values through run_projects'
+    callbacks; the page reads snapshot() on every poll, so widget
+    interactions rerun the script without touching the analysis.
+    """
+
+    def __init__(self, pdf_dirs, run_kwargs, temp_dirs=()):
+        self.pdf_dirs = pdf_dirs
+        self.run_kwargs = run_kwargs
+        self.temp_dirs = list(temp_dirs)
+        self.total = len(list(iter_dictionary_questions()))
+        self.lock = threading.Lock()
+        self.stages = {sub: "queued" for sub in pdf_dirs}
+        self.rows = {sub: {} for sub in pdf_dirs}
+        self.results = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    @property
+    def running(self):
+        return self.thread.is_alive()
+
+    def on_stage(self, sub, stage):
+        with self.lock:
+            self.stages[sub] = stage
+
+    def on_row(self, sub, component, row):
+        with self.lock:
+            self.rows[sub][component] = row
+
+    def _run(self):
+        try:
+            self.results = run_projects(
+                self.pdf_dirs, on_stage=self.on_stage, on_row=self.on_row, **self.run_kwargs
+            )
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            for td in self.temp_dirs:
+                shutil.rmtree(td, ignore_errors=True)
+
+    def snapshot(self):
+        """{sub: (stage, answered, rows DataFrame)} as of now."""
+        with self.lock:
+            stages = dict(self.stages)
+            rows = {sub: dict(r) for sub, r in self.rows.items()}
+        snapshot = {}
+        for sub in self.pdf_dirs:
+            answered = sum(
+                1 for row in rows[sub].values() for action in ("No Action", "With Action") if row[action] != 0
+            )
+            df = pd.DataFrame(
+                [dict(Component=c, **row) for c, row in sorted(rows[sub].items())],
+                columns=["Component", "No Action", "With Action", "Units"],
+            )
+            snapshot[sub] = (stages[sub], answered, df)
+        return snapshot
+
+
+def render_progress(job, directory):
+    for sub, (stage, answered, df) in job.snapshot().items():
+        name = os.path.relpath(sub, directory) if directory else os.path.basename(sub)
+        st.write(f"**{name}** — {STAGE_LABELS.get(stage, stage)}")
+        st.progress(
+            1.0 if stage in ("done", "skipped", "failed") else min(answered / job.total, 1.0),
+            text=f"{answered} of {job.total} values",
+        )
+        if not df.empty:
+            # "Value not found" mixes with numbers, show as text
+            st.dataframe(df.astype(str), hide_index=True, use_container_width=True)
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def poll_job():
+    job = st.session_state.job
+    render_progress(job, st.session_state.job_directory)
+    if not job.running:
+        # rerun the whole page once so the downloads appear
+        st.rerun(scope="app")
+
 
 def main():
+    # Streamlit runs the script inside its own event loop
+    apply_nest_asyncio()
+
     # ──────────────────────────────────────────
     # 0) Initialize session state
     # ──────────────────────────────────────────
@@ -77,19 +200,46 @@ def main():
             except zipfile.BadZipFile:
                 st.error("That doesn’t look like a valid ZIP file.")
 
+    batched = st.checkbox(
+        "Ask each prompt category in one call (fewer, larger LLM requests)", value=False
+    )
+    use_llm_cache = st.checkbox(
+        "Reuse cached LLM answers for unchanged questions", value=True
+    )
+    hybrid = st.checkbox(
+        "Hybrid retrieval (BM25 keywords + vector similarity)", value=True
+    )
+    embedding_backend = st.selectbox(
+        "Embeddings",
+        list(EMBEDDING_BACKENDS),
+        index=list(EMBEDDING_BACKENDS).index(DEFAULT_EMBEDDING_BACKEND),
+        format_func=lambda b: {"openai": "OpenAI", "local": "Local (offline, CPU)"}.get(b, b),
+    )
+    vector_index = st.selectbox(
+        "Vector index",
+        ["auto", "numpy", "lancedb"],
+        format_func=lambda i: {
+            "auto": "Auto (in memory unless very large)",
+            "numpy": "In memory (NumPy)",
+            "lancedb": "LanceDB",
+        }[i],
+    )
+
     # ──────────────────────────────────────────
-    # 3) Run Analysis
+    # 3) Run Analysis (in the background)
     # ──────────────────────────────────────────
-    if st.button("Run Analysis"):
+    job = st.session_state.get("job")
+    if st.button("Run Analysis", disabled=bool(job and job.running)):
+        # per job, not process-wide: other sessions may be mid-run
+        st.session_state.metrics = Metrics()
         # Clear out any previous run
         st.session_state.downloads.clear()
         st.session_state.analysis_done = False
+        st.session_state.job = job = None
 
         if not directory or not os.path.isdir(directory):
             st.warning("Please provide a valid directory, PDF upload, or ZIP path.")
         else:
-            llm = ChatOpenAI(model="gpt-4o-2024-05-13")
-
             # find every PDF‐containing folder
             pdf_dirs = [
                 root
@@ -100,45 +250,101 @@ def main():
             if not pdf_dirs:
                 st.error("No PDFs found under that path.")
             else:
-                for sub in pdf_dirs:
-                    st.write(f"## Processing: {os.path.relpath(sub, directory)}")
-                    cleanup_generated_files(sub)
-
-                    splits = load_and_split_pdfs_from_directory(sub)
-                    if not splits:
-                        st.error(f"No PDFs loaded from {sub}, skipping.")
-                        continue
-
-                    vs = create_vectorstore(splits)
-                    df = process_all_dictionary_questions(sub, vs, llm)
-                    if df.empty:
-                        st.error(f"No data extracted for {os.path.basename(sub)}.")
-                        continue
-
-                    # decide filename:
-                    # - single‐PDF upload uses upload_base
-                    # - otherwise each folder names itself
-                    if upload_base:
-                        base = upload_base
-                    else:
-                        base = os.path.basename(sub)
+                # decide filename:
+                # - single‐PDF upload uses upload_base
+                # - otherwise each folder names itself
+                def excel_name(sub):
+                    return upload_base if upload_base else os.path.basename(sub)
 
+                run_id = new_run_id()
+
+                def build_excel(sub, df):
+                    get_results_store().append(run_id, sub, df, project=excel_name(sub))
                     # build Excel in-memory
                     buffer = io.BytesIO()
-                    sheet_name = base[:31]  # Excel limit
+                    sheet_name = excel_name(sub)[:31]  # Excel limit
                     with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
                         df.to_excel(writer, index=False, sheet_name=sheet_name)
-                    buffer.seek(0)
+                    return excel_name(sub), buffer.getvalue()
+
+                # projects overlap; uploads live in temp dirs, so only
+                # Directory mode keeps a persistent index (and reuses it
+                # across runs through the shared index cache)
+                persistent = input_mode == "Directory"
+                job = AnalysisJob(
+                    pdf_dirs,
+                    dict(
+                        llm=get_llm(os.environ.get("OPENAI_API_KEY")),
+                        finish=build_excel,
+                        persistent_index=persistent,
+                        cpu_workers=1,
+                        query_workers=DEFAULT_QUERY_WORKERS,
+                        batched=batched,
+                        hybrid=hybrid,
+                        embedding_backend=embedding_backend,
+                        vector_index=vector_index,
+                        index_cache=get_index_cache() if persistent else None,
+                        metrics=st.session_state.metrics,
+                        response_cache=use_llm_cache,
+                    ),
+                    # the job removes the uploads once it is done with them
+                    temp_dirs=_temp_dirs,
+                )
+                _temp_dirs = []
+                st.session_state.job = job
+                st.session_state.job_directory = directory
+                st.session_state.job_llm_cache = use_llm_cache
+                st.session_state.job_run_id = run_id
+                job.start()
+
+    if job and job.running:
+        poll_job()
+    elif job and not st.session_state.analysis_done:
+        if job.error:
+            st.error(f"Analysis failed: {job.error}")
+        for res in job.results or []:
+            sub = res.directory
+            st.write(f"## Processed: {os.path.relpath(sub, st.session_state.job_directory)}")
+            if res.error:
+                st.error(f"Failed on {os.path.basename(sub)}: {res.error}")
+                continue
+            if res.df is None:
+                st.error(f"No PDFs loaded from {sub}, skipping.")
+                continue
+            if res.df.empty:
+                st.error(f"No data extracted for {os.path.basename(sub)}.")
+                continue
+
+            # stash it in session_state
+            name, data = res.output
+            st.session_state.downloads[name] = data
+
+        # every project of this run in one workbook, from the results store
+        if len(st.session_state.downloads) > 1:
+            buffer = io.BytesIO()
+            export_workbook(get_results_store().query(run_id=st.session_state.job_run_id), buffer)
+            st.session_state.downloads["All projects"] = buffer.getvalue()
+
+        # keep the summary on screen for later reruns
+        captions = [format_cache_stats("Embedding", get_embedding_cache().stats())]
+        if st.session_state.job_llm_cache:
+            captions.append(format_cache_stats("LLM response", get_response_cache().stats()))
+        st.session_state.summary = (captions, format_stage_summary(st.session_state.metrics.report()))
 
-                    # stash it in session_state
-                    st.session_state.downloads[base] = buffer.getvalue()
+        # mark that we did run
+        st.session_state.analysis_done = True
 
-                # mark that we did run
-                st.session_state.analysis_done = True
+    if job and not job.running and st.session_state.analysis_done:
+        render_progress(job, st.session_state.job_directory)
+        captions, timings = st.session_state.summary
+        for caption in captions:
+            st.caption(caption)
+        with st.expander("Stage timings"):
+            st.text(timings)
 
-        # cleanup temp dirs
-        for td in _temp_dirs:
-            shutil.rmtree(td, ignore_errors=True)
+    # uploads that no run took over (e.g. reruns from other widgets)
+    for td in _temp_dirs:
+        shutil.rmtree(td, ignore_errors=True)
 
     # ──────────────────────────────────────────
     # 4) Always render downloads if we’ve run once